@@ -0,0 +1,9 @@
+"""
+Benchmarks of the DAG stages on synthetic equipment data
+
+    python -m benchmarks run --rows 1000000 --output main.json
+    python -m benchmarks compare main.json branch.json
+
+The storage account is replaced with a local folder (LOCAL_BLOB_ROOT), so they run
+offline.
+"""
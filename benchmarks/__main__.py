@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+
+@click.group()
+def benchmarks():
+    pass
+
+
+def _commit():
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+        )
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+@benchmarks.command("run")
+@click.option("--rows", default=100_000, help="Rows of synthetic equipment data")
+@click.option("--seed", default=0, help="Seed of the synthetic data")
+@click.option(
+    "--search-budget",
+    type=float,
+    help="Seconds the hyperparameter search may take, SEARCH_TIME_BUDGET by default",
+)
+@click.option(
+    "--workbook",
+    is_flag=True,
+    help="Write the data as an xlsx workbook and time its ingestion",
+)
+@click.option(
+    "--root",
+    type=click.Path(file_okay=False),
+    help="Local folder standing in for the storage account, a temporary one by default",
+)
+@click.option("--output", type=click.Path(dir_okay=False), help="JSON file of results")
+def run(rows, seed, search_budget, workbook, root, output):
+    """Times each stage of the DAGs on synthetic data"""
+    root = root or tempfile.mkdtemp(prefix="benchmarks-")
+    # Set before dags.config is imported
+    os.environ["LOCAL_BLOB_ROOT"] = root
+    os.environ["BLOB_CACHE_DIR"] = os.path.join(root, "_cache")
+
+    from benchmarks.stages import run_stages
+    from dags import config
+
+    budget = config.SEARCH_TIME_BUDGET if search_budget is None else search_budget
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "rows": rows,
+        "seed": seed,
+        "search_budget": budget,
+        "stages": run_stages(rows, seed, budget, workbook),
+    }
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as file:
+            file.write(text)
+    print(text)
+
+
+def _start_server(args, env):
+    """Starts `run.py serve`, returns the process once its address answers"""
+    from benchmarks.load import get
+
+    address = args[-1] if "--unix" in args else f"http://127.0.0.1:{args[-1]}"
+    process = subprocess.Popen([sys.executable, "run.py", "serve", *args], env=env)
+    for _ in range(600):
+        if process.poll() is not None:
+            raise click.ClickException("The scoring server exited")
+        try:
+            asyncio.run(get(address, "/health"))
+            return process, address
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise click.ClickException("The scoring server didn't start")
+
+
+@benchmarks.command("serve")
+@click.option("--rows", default=100_000, help="Rows of synthetic data the model learns")
+@click.option("--seed", default=0, help="Seed of the synthetic data")
+@click.option("--connections", default=64, help="Concurrent connections")
+@click.option("--seconds", default=10.0, help="Seconds of load")
+@click.option(
+    "--equipment", default=1000, help="Equipment the readings are spread over"
+)
+@click.option("--tcp", is_flag=True, help="Connect over TCP instead of a Unix socket")
+@click.option("--max-batch", type=int, help="Most readings scored at a time")
+@click.option("--batch-wait", type=float, help="Seconds a batch waits for more")
+@click.option(
+    "--root",
+    type=click.Path(file_okay=False),
+    help="Local folder standing in for the storage account, a temporary one by default."
+    " A model already trained there is served as is",
+)
+@click.option("--output", type=click.Path(dir_okay=False), help="JSON file of results")
+def serve(
+    rows,
+    seed,
+    connections,
+    seconds,
+    equipment,
+    tcp,
+    max_batch,
+    batch_wait,
+    root,
+    output,
+):
+    """Latency and throughput of the scoring server under load"""
+    root = root or tempfile.mkdtemp(prefix="benchmarks-")
+    os.environ["LOCAL_BLOB_ROOT"] = root
+    os.environ["BLOB_CACHE_DIR"] = os.path.join(root, "_cache")
+    os.environ.setdefault("SEARCH_TIME_BUDGET", "10")
+
+    from benchmarks.load import get, readings, run_load
+    from benchmarks.synthetic import write_trusted
+    from dags.models.train import train_model
+    from dags.paths import LATEST_MODEL
+    from dags.storage import blob
+
+    if not blob.exists(LATEST_MODEL):
+        write_trusted(rows, seed)
+        train_model(mode="full")
+
+    args = ["--port", "8765"] if tcp else ["--unix", os.path.join(root, "scoring.sock")]
+    for name, value in [("--max-batch", max_batch), ("--batch-wait", batch_wait)]:
+        if value is not None:
+            args = [name, str(value), *args]
+    process, address = _start_server(args, dict(os.environ))
+    try:
+        bodies = readings(100_000, equipment, seed + 1)
+        load = run_load(address, bodies, connections, seconds)
+        stats = asyncio.run(get(address, "/stats"))
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "transport": "tcp" if tcp else "unix",
+        "equipment": equipment,
+        **load,
+        "mean_batch": stats["mean_batch"],
+    }
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as file:
+            file.write(text)
+    print(text)
+
+
+@benchmarks.command("compare")
+@click.argument("baseline", type=click.File())
+@click.argument("candidate", type=click.File())
+def compare(baseline, candidate):
+    """Wall time and peak memory of each stage of two runs"""
+    baseline, candidate = json.load(baseline), json.load(candidate)
+    if baseline["rows"] != candidate["rows"]:
+        click.secho("WARNING: the runs have different numbers of rows", err=True)
+
+    print(
+        f"{'stage':<18} {'seconds':>9} {'->':>9} {'ratio':>6}"
+        f" {'peak MB':>9} {'->':>9}"
+    )
+    for stage, old in baseline["stages"].items():
+        new = candidate["stages"].get(stage)
+        if new is None:
+            continue
+        ratio = new["wall_seconds"] / old["wall_seconds"]
+        print(
+            f"{stage:<18} {old['wall_seconds']:>9.3f} {new['wall_seconds']:>9.3f}"
+            f" {ratio:>6.2f} {old['peak_rss_mb']:>9.1f} {new['peak_rss_mb']:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(benchmarks())
@@ -0,0 +1,120 @@
+"""
+Load generator of the scoring server
+
+Keeps a number of HTTP/1.1 connections busy for a while, each one posting a reading
+as soon as the previous one is answered, and records the latency of every request.
+The readings are synthetic, spread over a number of equipment.
+"""
+
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import generate
+from dags.data.schema import TARGET
+
+
+def readings(count, equipment, seed=0):
+    """Request bodies of `count` synthetic readings of `equipment` equipment"""
+    data = next(generate(count, seed, chunksize=count)).drop(columns=TARGET)
+    records = data.to_dict("records")
+    for position, record in enumerate(records):
+        record["equipment"] = position % equipment
+    return [json.dumps(record).encode() for record in records]
+
+
+async def _connect(address):
+    if address.startswith("http://"):
+        host, port = address.removeprefix("http://").rsplit(":", 1)
+        return await asyncio.open_connection(host, int(port))
+    return await asyncio.open_unix_connection(address)
+
+
+async def request(reader, writer, method, path, body=b""):
+    """Sends a request on a keep-alive connection, returns the status and JSON"""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: scoring\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    head = await reader.readuntil(b"\r\n\r\n")
+    status_line, *lines = head.decode("latin-1").rstrip().split("\r\n")
+    headers = dict(line.lower().split(": ", 1) for line in lines)
+    payload = await reader.readexactly(int(headers["content-length"]))
+    return int(status_line.split(" ")[1]), json.loads(payload)
+
+
+async def _client(address, bodies, offset, deadline, latencies):
+    reader, writer = await _connect(address)
+    errors = 0
+    try:
+        position = offset
+        while time.perf_counter() < deadline:
+            body = bodies[position % len(bodies)]
+            start = time.perf_counter()
+            status, _ = await request(reader, writer, "POST", "/score", body)
+            latencies.append(time.perf_counter() - start)
+            errors += status != 200
+            position += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def get(address, path):
+    reader, writer = await _connect(address)
+    try:
+        return (await request(reader, writer, "GET", path))[1]
+    finally:
+        writer.close()
+
+
+async def _load(address, bodies, connections, seconds):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    errors = await asyncio.gather(
+        *(
+            _client(
+                address,
+                bodies,
+                client * len(bodies) // connections,
+                deadline,
+                latencies,
+            )
+            for client in range(connections)
+        )
+    )
+    return latencies, time.perf_counter() - start, sum(errors)
+
+
+def run_load(address, bodies, connections=64, seconds=10.0):
+    """
+    Posts `bodies` to the /score route of the server at `address` from `connections`
+    concurrent connections for `seconds`.
+
+    Args:
+        address (str): http://host:port of the server, or the path of its Unix socket.
+        bodies (list): Request bodies, sent in turn.
+        connections (int): Concurrent connections, each with a request at a time.
+        seconds (float): Duration of the load.
+
+    Returns:
+        dict: Requests sent, failed and per second, and percentiles of their latency
+            in milliseconds.
+    """
+    latencies, wall, errors = asyncio.run(_load(address, bodies, connections, seconds))
+    milliseconds = np.array(latencies) * 1000
+    return {
+        "connections": connections,
+        "wall_seconds": round(wall, 3),
+        "requests": len(latencies),
+        "errors": errors,
+        "requests_per_second": round(len(latencies) / wall, 1),
+        "latency_ms": {
+            name: round(float(np.percentile(milliseconds, q)), 3)
+            for name, q in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]
+        },
+    }
@@ -0,0 +1,109 @@
+"""
+Wall time, peak memory and throughput of the benchmarked stages
+
+The resident memory of the process and of its children, e.g. the workers of the
+hyperparameter search, is sampled on a thread while a stage runs. Without /proc, the
+peak is the one of the whole run so far, from getrusage.
+"""
+
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds between two samples of the resident memory
+SAMPLE_INTERVAL = 0.005
+
+PROC = os.path.exists("/proc/self/statm")
+
+
+def _rss(pid):
+    with open(f"/proc/{pid}/statm") as file:
+        return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _children(pid):
+    children = []
+    for thread in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{thread}/children") as file:
+            children.extend(int(child) for child in file.read().split())
+    return children
+
+
+def tree_rss(pid=None):
+    """Resident bytes of a process and of its descendants"""
+    total, pids = 0, [pid or os.getpid()]
+    while pids:
+        pid = pids.pop()
+        # Processes may exit while being read
+        try:
+            total += _rss(pid)
+            pids.extend(_children(pid))
+        except (OSError, ValueError):
+            pass
+    return total
+
+
+def _max_rss():
+    # ru_maxrss is in kilobytes, in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return unit * max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+
+
+class PeakRss:
+    """Samples the resident memory of the process tree until stopped"""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while True:
+            self.peak = max(self.peak, tree_rss())
+            if self._stopped.wait(self.interval):
+                return
+
+    def start(self):
+        if PROC:
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Peak resident bytes"""
+        if not PROC:
+            return _max_rss()
+        self._stopped.set()
+        self._thread.join()
+        return max(self.peak, tree_rss())
+
+
+@contextmanager
+def measure(results, stage, rows):
+    """
+    Records the wall time, peak resident memory and throughput of a stage.
+
+    Args:
+        results (dict): Measures of each stage, the stage's are added to it.
+        stage (str): Name of the stage.
+        rows (int): Number of rows the stage processes.
+    """
+    peak_rss = PeakRss().start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - start
+        peak = peak_rss.stop()
+        results[stage] = {
+            "wall_seconds": round(wall, 4),
+            "peak_rss_mb": round(peak / 1024**2, 1),
+            "rows": rows,
+            "rows_per_second": round(rows / wall, 1) if wall else None,
+        }
@@ -0,0 +1,70 @@
+"""
+Stages of the DAGs, timed one by one
+
+The training stages are the functions train_model runs one after the other, so the
+feature building, the hyperparameter search and the final fit are timed apart.
+"""
+
+from benchmarks.measure import measure
+from benchmarks.synthetic import write_trusted, write_workbook
+from dags.data.ingest import ingest
+from dags.models.artifact import latest_model_path, load_model
+from dags.models.train import (
+    build_training_set,
+    evaluate_model,
+    fit,
+    load_data,
+    save,
+    search,
+)
+from dags.visualization.inference import predictions
+
+
+def run_stages(rows, seed=0, search_budget=None, workbook=False):
+    """
+    Runs the stages on `rows` rows of synthetic data.
+
+    Args:
+        rows (int): Rows of equipment data.
+        seed (int): Seed of the synthetic data.
+        search_budget (float): Seconds the hyperparameter search may take.
+        workbook (bool): Whether to write the data as an input workbook and time its
+            ingestion, instead of writing it to the trusted layer directly.
+
+    Returns:
+        dict: Measures of each stage, see benchmarks.measure.measure.
+    """
+    results = {}
+    if workbook:
+        with measure(results, "generate", rows):
+            write_workbook(rows, seed)
+        with measure(results, "ingest", rows):
+            ingest()
+    else:
+        with measure(results, "generate", rows):
+            write_trusted(rows, seed)
+
+    loaded = {}
+    with measure(results, "load", rows):
+        loaded["equip_data"] = load_data()
+    with measure(results, "features", rows):
+        # Popped, so the stage releases the raw data as it does in train_model
+        data = build_training_set(loaded.pop("equip_data"))
+
+    with measure(results, "search", len(data.y_train)):
+        params = search(data, time_budget=search_budget)
+    with measure(results, "fit", len(data.y_train)):
+        model = fit(data, params)
+    with measure(results, "evaluate", len(data.y_val) + len(data.y_test)):
+        report = evaluate_model(data, model)
+    with measure(results, "save_model", rows):
+        save(data, model, report)
+
+    with measure(results, "load_model", rows):
+        load_model(latest_model_path())
+
+    del data
+    with measure(results, "score", rows):
+        predictions()
+
+    return results
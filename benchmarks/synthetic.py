@@ -0,0 +1,94 @@
+"""
+Synthetic equipment data
+
+Mimics O_G_Equipment_Data.xlsx at any scale: consecutive cycles, uniformly drawn
+presets and normal sensor readings, with the moments of the real data, whose mean
+shifts on the cycles the equipment fails.
+"""
+
+import tempfile
+from io import BytesIO
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dags.data.ingest import mark_ingested
+from dags.data.schema import SCHEMA, TARGET
+from dags.paths import EQUIPMENT_DATA, input_path, trusted_path
+from dags.storage import blob
+
+# Rows of a sheet of an xlsx workbook, the header included
+XLSX_MAX_ROWS = 1_048_576
+
+# Rows generated at a time
+CHUNKSIZE = 1_000_000
+
+FAIL_RATE = 0.11
+PRESET_LEVELS = {"Preset_1": 3, "Preset_2": 8}
+
+# Mean, standard deviation and shift of the mean when failing of each sensor
+SENSOR_MOMENTS = {
+    "Temperature": (69.5, 10.0, 4.7),
+    "Pressure": (78.3, 19.9, 19.1),
+    "VibrationX": (69.0, 15.2, 11.1),
+    "VibrationY": (69.5, 14.8, 10.0),
+    "VibrationZ": (69.0, 15.0, 10.0),
+    "Frequency": (69.5, 11.9, 4.0),
+}
+
+
+def generate(rows, seed=0, chunksize=CHUNKSIZE):
+    """Synthetic equipment data, as DataFrames of at most `chunksize` rows"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunksize):
+        size = min(chunksize, rows - start)
+        fail = rng.random(size) < FAIL_RATE
+
+        data = {"Cycle": np.arange(start + 1, start + size + 1)}
+        for name, levels in PRESET_LEVELS.items():
+            data[name] = rng.integers(1, levels + 1, size)
+        for name, (mean, std, shift) in SENSOR_MOMENTS.items():
+            data[name] = rng.normal(mean, std, size) + shift * fail
+        data[TARGET] = fail
+        yield pd.DataFrame(data)[SCHEMA.names]
+
+
+def write_workbook(rows, seed=0, name=EQUIPMENT_DATA):
+    """Writes synthetic data as the input workbook `name`, for the ingestion"""
+    if rows >= XLSX_MAX_ROWS:
+        raise ValueError(f"A workbook holds less than {XLSX_MAX_ROWS} rows")
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(SCHEMA.names)
+    for chunk in generate(rows, seed):
+        for row in zip(*(chunk[column].tolist() for column in chunk)):
+            sheet.append(row)
+
+    byte_stream = BytesIO()
+    workbook.save(byte_stream)
+    blob.to_any(byte_stream, input_path(name))
+
+
+def write_trusted(rows, seed=0, name=EQUIPMENT_DATA, chunksize=CHUNKSIZE):
+    """
+    Writes synthetic data to the trusted layer, as if `name` had been ingested.
+
+    Workbooks can't hold tens of millions of rows, so the input workbook is only a
+    placeholder here, recorded as already converted by the manifest of the ingestion.
+    Tables of the same seed and `chunksize` share the rows of their first chunks, like
+    the equipment data growing between two runs.
+    """
+    blob.to_any(BytesIO(b"synthetic"), input_path(name))
+
+    with tempfile.TemporaryFile() as tfile:
+        with pq.ParquetWriter(tfile, SCHEMA, compression="zstd") as writer:
+            for chunk in generate(rows, seed, chunksize):
+                table = pa.Table.from_pandas(chunk, schema=SCHEMA, preserve_index=False)
+                writer.write_table(table)
+        blob.to_any(tfile, trusted_path(name))
+
+    mark_ingested(name, rows)
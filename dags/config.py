@@ -7,18 +7,102 @@ A maior parte da configuracao dos modulos sera feita aqui
 
 import datetime
 import os
+import tempfile
 
 import dotenv
-import pandas as pd
-from dateutil.relativedelta import relativedelta
 
 dotenv.load_dotenv()
 
 TODAY = os.getenv("TODAY", datetime.date.today().strftime("%Y-%m-%d"))
-YESTERDAY = (pd.to_datetime(TODAY) - relativedelta(days=1)).strftime("%Y-%m-%d")
+YESTERDAY = (datetime.date.fromisoformat(TODAY) - datetime.timedelta(days=1)).strftime(
+    "%Y-%m-%d"
+)
 
 BASE_FOLDER = "abfs://testmlopaes.dfs.core.windows.net/testing"
 RAW_FOLDER = f"{BASE_FOLDER}/raw"
 INPUT_FOLDER = f"{BASE_FOLDER}/input"
 TRUSTED_FOLDER = f"{BASE_FOLDER}/trusted"
 REFINED_FOLDER = f"{BASE_FOLDER}/refined"
+
+# Container of the logs and metrics of the tasks
+LOGS_FOLDER = "abfs://testmlopaes.dfs.core.windows.net/logs"
+
+# Local folder standing in for the storage account, to run the DAGs offline
+LOCAL_BLOB_ROOT = os.getenv("LOCAL_BLOB_ROOT")
+
+# Seconds added to each request to LOCAL_BLOB_ROOT and bytes per second each request
+# transfers (0 for no limit), to emulate the network of the storage account offline
+LOCAL_BLOB_LATENCY = float(os.getenv("LOCAL_BLOB_LATENCY", 0))
+LOCAL_BLOB_BANDWIDTH = float(os.getenv("LOCAL_BLOB_BANDWIDTH", 0))
+
+# Read-through cache of the storage account, shared by the tasks of a Batch node
+BLOB_CACHE_DIR = os.getenv(
+    "BLOB_CACHE_DIR",
+    os.path.join(
+        os.getenv("AZ_BATCH_NODE_SHARED_DIR", tempfile.gettempdir()), "blob-cache"
+    ),
+)
+BLOB_CACHE_MAX_BYTES = int(os.getenv("BLOB_CACHE_MAX_BYTES", 4 * 1024**3))
+
+# Most requests to the storage account in flight at a time, among the prefetches,
+# ranged reads and background uploads of a process
+BLOB_CONCURRENCY = int(os.getenv("BLOB_CONCURRENCY", 8))
+
+# Blobs larger than this are downloaded as parallel ranges of this many bytes, and
+# uploaded in as many parallel blocks
+BLOB_RANGE_BYTES = int(os.getenv("BLOB_RANGE_BYTES", 8 * 1024**2))
+
+# Maximum number of rows held in memory by the ingestion and prediction tasks
+INGEST_CHUNKSIZE = int(os.getenv("INGEST_CHUNKSIZE", 100_000))
+PREDICT_CHUNKSIZE = int(os.getenv("PREDICT_CHUNKSIZE", 100_000))
+
+# Seconds the hyperparameter search may take before settling for its best candidate
+SEARCH_TIME_BUDGET = float(os.getenv("SEARCH_TIME_BUDGET", 1800))
+
+# "incremental" refines the latest model with the rows added since it was trained,
+# "full" always retrains from scratch on the whole history
+TRAIN_MODE = os.getenv("TRAIN_MODE", "incremental")
+
+# Shift of the mean of a model input in the new rows, in standard deviations of the
+# training data, from which the incremental training falls back to a full retrain. The
+# validation of the new rows flags a sensor whose mean shifts as much
+DRIFT_THRESHOLD = float(os.getenv("DRIFT_THRESHOLD", 0.5))
+
+# Distance between the distribution of a sensor in the new rows and in the training
+# data (Kolmogorov-Smirnov statistic), and population stability index of the preset
+# combinations, from which the validation flags drift
+DRIFT_KS_THRESHOLD = float(os.getenv("DRIFT_KS_THRESHOLD", 0.1))
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", 0.2))
+
+# Whether drift fails the validation, stopping the DAG, instead of being flagged
+FAIL_ON_DRIFT = os.getenv("FAIL_ON_DRIFT", "false").lower() == "true"
+
+# Fraction of missing readings of a sensor from which the new rows are rejected
+MAX_NULL_FRACTION = float(os.getenv("MAX_NULL_FRACTION", 0.05))
+
+# Iterations of the solver refining the previous coefficients on the new rows
+INCREMENTAL_MAX_ITER = int(os.getenv("INCREMENTAL_MAX_ITER", 20))
+
+# Columns identifying each independent series of the equipment data, e.g.
+# "Preset_1,Preset_2". When set the features are computed within each series, on a
+# pool of SHARD_WORKERS processes (defaults to the number of cores)
+SHARD_KEYS = [key for key in os.getenv("SHARD_KEYS", "").split(",") if key]
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", 0)) or None
+
+# Most readings the scoring server scores in a single call, and seconds it waits for
+# more readings to join a batch once it has one. Without a wait a batch takes the
+# requests that arrived while the previous one was being scored
+SERVE_MAX_BATCH = int(os.getenv("SERVE_MAX_BATCH", 1024))
+SERVE_BATCH_WAIT = float(os.getenv("SERVE_BATCH_WAIT", 0))
+
+# Local folder the metrics record of each task run is written to, besides LOGS_FOLDER.
+# In Batch the working directory of the task keeps them with its other outputs
+METRICS_DIR = os.getenv(
+    "METRICS_DIR",
+    os.path.join(
+        os.getenv("AZ_BATCH_TASK_WORKING_DIR", tempfile.gettempdir()), "task-metrics"
+    ),
+)
+
+# Profiler run around each task: "cprofile", "sample" for a sampling profiler, or none
+TASK_PROFILE = os.getenv("TASK_PROFILE", "")
@@ -0,0 +1,207 @@
+"""
+Ingestion of the input workbooks
+
+Parsing xlsx is by far the slowest way to load the equipment data, so each input
+workbook is converted once to a typed, compressed parquet file in the trusted layer.
+The copy records the ETag and size of its source and is only rebuilt when they change.
+"""
+
+import json
+import logging
+import tempfile
+from io import BytesIO
+from itertools import islice
+
+import openpyxl
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from paeio.path import path_join
+
+from dags import config, metrics
+from dags.data.schema import CATEGORIES, SCHEMA, SCHEMA_VERSION
+from dags.paths import EQUIPMENT_DATA, input_path, trusted_path
+from dags.storage import blob, cache
+
+logger = logging.getLogger(__name__)
+
+
+def _manifest_path(name):
+    return path_join(
+        config.TRUSTED_FOLDER, "project1", f"{name.rsplit('.', 1)[0]}.json"
+    )
+
+
+def _fingerprint(source):
+    """Version of `source` and of the schema its parquet copy is written with"""
+    return {"source": source, "schema": SCHEMA_VERSION, **blob.stat(source)._asdict()}
+
+
+def _write_manifest(name, fingerprint, rows):
+    converted = {"fingerprint": fingerprint, "rows": rows}
+    blob.to_any(BytesIO(json.dumps(converted).encode()), _manifest_path(name))
+
+
+def mark_ingested(name, rows):
+    """
+    Records the parquet copy of `name` in TRUSTED_FOLDER, of `rows` rows, as the
+    conversion of the current version of its workbook, e.g. for a copy written
+    directly. ingest(name) then returns it until the workbook changes.
+    """
+    _write_manifest(name, _fingerprint(input_path(name)), rows)
+
+
+def read_excel_chunks(uri, chunksize=None):
+    """
+    Reads an excel file as DataFrames of at most `chunksize` rows.
+
+    The workbook is parsed in read-only mode, so only one chunk of rows is
+    materialised at a time. A `chunksize` of None yields the whole sheet at once.
+    """
+    with cache.open_blob(uri) as file_obj:
+        workbook = openpyxl.load_workbook(file_obj, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = next(rows)
+            while True:
+                # Timed apart from the yield, the caller's work isn't parsing
+                with metrics.span("ingest.read_excel", "io"):
+                    batch = list(islice(rows, chunksize))
+                    chunk = pd.DataFrame.from_records(batch, columns=header)
+                if not batch:
+                    break
+                metrics.count("rows_read", len(chunk))
+                yield chunk
+        finally:
+            workbook.close()
+
+
+def ingest(name=EQUIPMENT_DATA, chunksize=config.INGEST_CHUNKSIZE):
+    """
+    Converts an input workbook to parquet, unless its current version already was.
+
+    Args:
+        name (str): File name of the workbook in INPUT_FOLDER.
+        chunksize (int): Number of rows converted at a time.
+
+    Returns:
+        str: Path of the parquet copy in TRUSTED_FOLDER.
+    """
+    source = input_path(name)
+    target = trusted_path(name)
+    manifest = _manifest_path(name)
+
+    fingerprint = _fingerprint(source)
+    if blob.exists(manifest):
+        converted = cache.read_any(manifest, func=json.load)
+        if converted["fingerprint"] == fingerprint:
+            logger.info(f"{name} unchanged since its last ingestion")
+            return target
+
+    logger.info(f"Converting {name} to parquet")
+    rows = 0
+    with tempfile.TemporaryFile() as tfile:
+        with pq.ParquetWriter(tfile, SCHEMA, compression="zstd") as writer:
+            for chunk in read_excel_chunks(source, chunksize or None):
+                with metrics.span("ingest.write_parquet", "io"):
+                    table = pa.Table.from_pandas(
+                        chunk[SCHEMA.names], schema=SCHEMA, preserve_index=False
+                    )
+                    writer.write_table(table)
+                rows += len(chunk)
+
+        blob.to_any(tfile, target)
+
+    # Written last, so a conversion that didn't finish is redone on the next run
+    _write_manifest(name, fingerprint, rows)
+    return target
+
+
+def _first_row_group(metadata, start):
+    """First row group holding the rows from `start` on, and the position of its row"""
+    first, offset = 0, 0
+    while (
+        first < metadata.num_row_groups
+        and offset + metadata.row_group(first).num_rows <= start
+    ):
+        offset += metadata.row_group(first).num_rows
+        first += 1
+    return first, offset
+
+
+def trusted_rows(name=EQUIPMENT_DATA, path=None):
+    """
+    Number of rows of an ingested workbook, from the metadata of its parquet copy.
+
+    As in the readers below, `path` is the parquet copy ingest(name) returned, so a
+    task reading the table several times ingests it once. It's ingested when None.
+    """
+    with cache.open_blob(path or ingest(name)) as file_obj:
+        return pq.ParquetFile(file_obj).metadata.num_rows
+
+
+def read_trusted(name=EQUIPMENT_DATA, columns=None, start=0, stop=None, path=None):
+    """
+    Reads the `columns` of an ingested workbook.
+
+    Only the row groups holding the rows from `start` to `stop` (excluded, the last
+    row when None) are decoded, and the DataFrame index keeps the position of each
+    row in the whole table. CATEGORIES columns are read as pandas categoricals.
+    """
+    with (
+        cache.open_blob(path or ingest(name)) as file_obj,
+        metrics.span("ingest.read_trusted", "io"),
+    ):
+        parquet_file = pq.ParquetFile(file_obj)
+        metadata = parquet_file.metadata
+        stop = metadata.num_rows if stop is None else min(stop, metadata.num_rows)
+        first, offset = _first_row_group(metadata, start)
+        last, _ = _first_row_group(metadata, stop - 1)
+
+        table = parquet_file.read_row_groups(
+            range(first, min(last + 1, metadata.num_row_groups)), columns=columns
+        )
+        table = table.slice(max(start - offset, 0), max(stop - start, 0))
+        df = table.to_pandas(categories=CATEGORIES)
+
+    df.index = pd.RangeIndex(start, start + len(df))
+    metrics.count("rows_read", len(df))
+    return df
+
+
+def read_trusted_chunks(
+    name=EQUIPMENT_DATA, columns=None, chunksize=None, start=0, stop=None, path=None
+):
+    """
+    Reads the `columns` of an ingested workbook as DataFrames of at most `chunksize`
+    rows.
+
+    Only the rows from `start` to `stop` (excluded, the last row when None) are
+    read, decoding the row groups holding them. As in read_trusted, the DataFrame
+    index keeps the position of each row in the whole table.
+    """
+    with cache.open_blob(path or ingest(name)) as file_obj:
+        parquet_file = pq.ParquetFile(file_obj)
+        metadata = parquet_file.metadata
+        stop = metadata.num_rows if stop is None else min(stop, metadata.num_rows)
+        first, position = _first_row_group(metadata, start)
+        batches = parquet_file.iter_batches(
+            batch_size=chunksize or max(metadata.num_rows, 1),
+            row_groups=range(first, metadata.num_row_groups),
+            columns=columns,
+        )
+        while position < stop:
+            with metrics.span("ingest.read_trusted", "io"):
+                batch = next(batches, None)
+                if batch is None:
+                    break
+                begin = max(start, position)
+                end = min(stop, position + batch.num_rows)
+                chunk = batch.slice(begin - position, max(end - begin, 0))
+                chunk = chunk.to_pandas(categories=CATEGORIES)
+            position += batch.num_rows
+            if not len(chunk):
+                continue
+            chunk.index = pd.RangeIndex(begin, end)
+            metrics.count("rows_read", len(chunk))
+            yield chunk
@@ -0,0 +1,376 @@
+"""
+Data quality and drift of the equipment data
+
+The rows about to be trained on or scored are profiled in a single streaming pass:
+for each sensor the count of readings and of missing ones, the minimum and maximum,
+the mean and sum of squared deviations, and a quantile sketch, along with the
+frequency of each preset combination and the number of failures. Every statistic is
+mergeable, so the profiles of chunks, or of ranges of rows profiled on a process
+pool, add up to the profile of all the rows, and an incremental training extends the
+profile saved with the model with the rows it adds.
+
+The profile of the new rows is compared with the profile of the data the latest model
+was trained on before any feature is built. Sensors missing too many readings fail
+the validation, drift (a shifted mean, a different distribution, different preset
+combinations) is flagged, or fails it too with FAIL_ON_DRIFT.
+"""
+
+import json
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from io import BytesIO
+from itertools import repeat
+
+import numpy as np
+from paeio.path import path_join
+
+from dags import config, metrics
+from dags.data.ingest import ingest, read_trusted_chunks, trusted_rows
+from dags.data.schema import PRESETS, SENSORS, TARGET
+from dags.features.sketch import QuantileSketch
+from dags.models.artifact import latest_model_path, load_model
+from dags.paths import LATEST_MODEL, quality_report_path
+from dags.storage import blob, cache
+
+logger = logging.getLogger(__name__)
+
+# Kolmogorov-Smirnov statistic two samples reach by chance 1% of the time, times the
+# square root of their effective size
+KS_CRITICAL = 1.63
+
+
+class DataQualityError(Exception):
+    """The new rows can't be trained on or scored"""
+
+
+class DataProfile:
+    """Mergeable statistics of the raw equipment data"""
+
+    def __init__(self, sensors=SENSORS):
+        self.sensors = list(sensors)
+        self.rows = 0
+        self.fails = 0
+        self.counts = np.zeros(len(self.sensors), dtype=np.int64)
+        self.nulls = np.zeros(len(self.sensors), dtype=np.int64)
+        self.mins = np.full(len(self.sensors), np.inf)
+        self.maxs = np.full(len(self.sensors), -np.inf)
+        self.means = np.zeros(len(self.sensors))
+        self.m2 = np.zeros(len(self.sensors))
+        self.sketches = [QuantileSketch() for _ in self.sensors]
+        self.presets = Counter()
+
+    def _add_moments(self, counts, means, m2):
+        # Pairwise update of Chan et al., for each sensor
+        total = self.counts + counts
+        weight = np.divide(counts, total, out=np.zeros(len(total)), where=total > 0)
+        delta = means - self.means
+        self.means = self.means + delta * weight
+        self.m2 = self.m2 + m2 + delta**2 * self.counts * weight
+        self.counts = total
+
+    def update(self, df):
+        """Adds the raw equipment data of new rows"""
+        if not len(df):
+            return self
+
+        block = df[self.sensors].to_numpy(dtype=np.float64)
+        nulls = np.isnan(block).sum(axis=0)
+        counts = len(block) - nulls
+        means = np.nansum(block, axis=0) / np.maximum(counts, 1)
+        self._add_moments(counts, means, np.nansum((block - means) ** 2, axis=0))
+        self.nulls += nulls
+        self.mins = np.fmin(self.mins, np.fmin.reduce(block, axis=0))
+        self.maxs = np.fmax(self.maxs, np.fmax.reduce(block, axis=0))
+        for sketch, values in zip(self.sketches, block.T):
+            sketch.update(values)
+
+        keys, frequencies = np.unique(
+            df[PRESETS].to_numpy(dtype=np.int64), axis=0, return_counts=True
+        )
+        self.presets.update(dict(zip(map(tuple, keys.tolist()), frequencies.tolist())))
+        if TARGET in df:
+            self.fails += int(df[TARGET].sum())
+        self.rows += len(block)
+        metrics.count("rows_profiled", len(block))
+        return self
+
+    def merge(self, other):
+        """Adds the rows profiled by `other`"""
+        self._add_moments(other.counts, other.means, other.m2)
+        self.nulls = self.nulls + other.nulls
+        self.mins = np.fmin(self.mins, other.mins)
+        self.maxs = np.fmax(self.maxs, other.maxs)
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        self.presets.update(other.presets)
+        self.fails += other.fails
+        self.rows += other.rows
+        return self
+
+    def std(self):
+        """Standard deviation of each sensor, 0 without readings"""
+        return np.sqrt(self.m2 / np.maximum(self.counts, 1))
+
+    def to_dict(self):
+        """JSON friendly profile"""
+        sensors = {}
+        for i, name in enumerate(self.sensors):
+            read = bool(self.counts[i])
+            sensors[name] = {
+                "count": int(self.counts[i]),
+                "nulls": int(self.nulls[i]),
+                "min": float(self.mins[i]) if read else None,
+                "max": float(self.maxs[i]) if read else None,
+                "mean": float(self.means[i]),
+                "m2": float(self.m2[i]),
+                "sketch": self.sketches[i].to_array().tolist() if read else None,
+            }
+        return {
+            "rows": self.rows,
+            "fails": self.fails,
+            "sensors": sensors,
+            "presets": [[*key, count] for key, count in sorted(self.presets.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        profile = cls(list(data["sensors"]))
+        profile.rows, profile.fails = data["rows"], data["fails"]
+        for i, sensor in enumerate(data["sensors"].values()):
+            profile.counts[i], profile.nulls[i] = sensor["count"], sensor["nulls"]
+            profile.means[i], profile.m2[i] = sensor["mean"], sensor["m2"]
+            if sensor["sketch"] is not None:
+                profile.mins[i], profile.maxs[i] = sensor["min"], sensor["max"]
+                profile.sketches[i] = QuantileSketch.from_array(sensor["sketch"])
+        profile.presets = Counter(
+            {
+                (preset_1, preset_2): count
+                for preset_1, preset_2, count in data["presets"]
+            }
+        )
+        return profile
+
+
+def _profile_range(start, stop, chunksize, path):
+    profile = DataProfile()
+    chunks = read_trusted_chunks(
+        columns=[*PRESETS, *SENSORS, TARGET],
+        chunksize=chunksize,
+        start=start,
+        stop=stop,
+        path=path,
+    )
+    for chunk in chunks:
+        profile.update(chunk)
+    return profile
+
+
+def profile_rows(
+    start=0, stop=None, chunksize=config.INGEST_CHUNKSIZE, workers=None, path=None
+):
+    """
+    Profiles the rows of the trusted table from `start` to `stop` (excluded, the last
+    row when None), holding `chunksize` rows in memory at a time.
+
+    Rows spanning several chunks are split into ranges profiled on a pool of
+    `workers` processes (SHARD_WORKERS by default) and merged. `path` is the parquet
+    copy of the table, see dags.data.ingest.trusted_rows.
+    """
+    path = path or ingest()
+    stop = trusted_rows(path=path) if stop is None else stop
+    # As in ingest, a chunksize of 0 or None reads the rows at once
+    chunksize = max(chunksize or stop - start, 1)
+    workers = workers or config.SHARD_WORKERS or os.cpu_count()
+    parts = min(workers, -(-(stop - start) // chunksize))
+    if parts <= 1:
+        return _profile_range(start, stop, chunksize, path)
+
+    bounds = np.linspace(start, stop, parts + 1).astype(np.int64).tolist()
+    with ProcessPoolExecutor(max_workers=parts) as executor:
+        profiles = executor.map(
+            _profile_range, bounds[:-1], bounds[1:], repeat(chunksize), repeat(path)
+        )
+        profile = reduce(DataProfile.merge, profiles)
+    metrics.count("rows_profiled", profile.rows)
+    return profile
+
+
+def profile_path(model, name="profile.json"):
+    """Path of the profile of the data `model` was trained on"""
+    return path_join(model.rsplit("/", 1)[0], name)
+
+
+def read_profile(model, name="profile.json"):
+    """Profile of the data `model` was trained on, None when saved without one"""
+    path = profile_path(model, name)
+    if not blob.exists(path):
+        return None
+    return DataProfile.from_dict(cache.read_any(path, func=json.load))
+
+
+def reference_profile(start):
+    """
+    Profile of the training data the rows from `start` on are compared with, None
+    without one.
+
+    An incremental training adds the rows it refines the latest model with to its
+    profile, so when they are validated again the profile of the model it refined,
+    saved as previous_profile.json, is used instead.
+    """
+    if not blob.exists(LATEST_MODEL):
+        return None
+    model = latest_model_path()
+    profiles = [read_profile(model), read_profile(model, "previous_profile.json")]
+    profiles = [profile for profile in profiles if profile is not None]
+    for profile in profiles:
+        if profile.rows <= start:
+            return profile
+    if profiles:
+        logger.warning(
+            f"The profile of the training data has {profiles[-1].rows - start} of "
+            "the rows validated"
+        )
+        return profiles[-1]
+    return None
+
+
+def _ks(sketch, reference):
+    """Largest distance between the distribution functions of two sketches"""
+    points = np.concatenate(
+        ([sketch.min, sketch.max, reference.min, reference.max], sketch.means)
+    )
+    points = np.concatenate((points, reference.means))
+    return float(np.abs(sketch.cdf(points) - reference.cdf(points)).max())
+
+
+def _psi(frequencies, reference):
+    """Population stability index of the preset combinations"""
+    keys = sorted(set(frequencies) | set(reference))
+    actual = np.array([frequencies.get(key, 0) for key in keys], dtype=np.float64)
+    expected = np.array([reference.get(key, 0) for key in keys], dtype=np.float64)
+    # Smoothed, so a combination missing on either side doesn't make it infinite
+    actual = (actual + 0.5) / (actual.sum() + 0.5 * len(keys))
+    expected = (expected + 0.5) / (expected.sum() + 0.5 * len(keys))
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def compare(profile, reference=None):
+    """
+    Checks the profile of new rows, against the profile of the training data.
+
+    The drift limits are raised to the distance samples of these sizes reach by
+    chance, so a handful of new rows isn't flagged for its noise.
+
+    Returns:
+        dict: Statistics of each sensor and of the presets, the errors rejecting the
+            rows and the drift found.
+    """
+    report = {
+        "rows": profile.rows,
+        "reference_rows": reference.rows if reference else None,
+        "errors": [],
+        "drift": [],
+        "sensors": {},
+    }
+    nulls = profile.nulls / max(profile.rows, 1)
+    for i, name in enumerate(profile.sensors):
+        sensor = {"null_fraction": float(nulls[i])}
+        if nulls[i] > config.MAX_NULL_FRACTION:
+            report["errors"].append(f"{name} misses {nulls[i]:.1%} of its readings")
+        report["sensors"][name] = sensor
+
+        if reference is None or name not in reference.sensors:
+            continue
+        j = reference.sensors.index(name)
+        n, m = profile.counts[i], reference.counts[j]
+        if not n or not m:
+            continue
+
+        std = reference.std()[j]
+        delta = abs(profile.means[i] - reference.means[j])
+        shift = delta / std if std else float(delta > 0) * np.inf
+        ks = _ks(profile.sketches[i], reference.sketches[j])
+        ks_limit = max(
+            config.DRIFT_KS_THRESHOLD, KS_CRITICAL * np.sqrt((n + m) / (n * m))
+        )
+        sensor.update(mean_shift=float(shift), ks=ks, ks_limit=float(ks_limit))
+        if shift > config.DRIFT_THRESHOLD:
+            report["drift"].append(
+                f"The mean of {name} shifted {shift:.2f} standard deviations"
+            )
+        if ks > ks_limit:
+            report["drift"].append(
+                f"The distribution of {name} moved {ks:.3f} away (KS, over {ks_limit:.3f})"
+            )
+
+    if reference is not None and profile.rows:
+        unseen = sorted(set(profile.presets) - set(reference.presets))
+        psi = _psi(profile.presets, reference.presets)
+        # Expected index of samples of the same distribution
+        keys = len(set(profile.presets) | set(reference.presets))
+        psi_limit = config.DRIFT_PSI_THRESHOLD + (keys - 1) * (
+            1 / profile.rows + 1 / reference.rows
+        )
+        report["presets"] = {
+            "psi": psi,
+            "psi_limit": psi_limit,
+            "unseen": [list(key) for key in unseen],
+        }
+        if psi > psi_limit:
+            report["drift"].append(
+                f"The preset combinations moved {psi:.3f} away (PSI, over {psi_limit:.3f})"
+            )
+        if unseen:
+            report["drift"].append(
+                f"{len(unseen)} preset combinations never seen in training, "
+                f"e.g. {unseen[0]}"
+            )
+        report["fail_rate"] = {
+            "rows": profile.fails / profile.rows,
+            "reference": reference.fails / max(reference.rows, 1),
+        }
+    return report
+
+
+def trained_rows():
+    """Rows of the trusted table the latest model was trained on, 0 without one"""
+    if not blob.exists(LATEST_MODEL):
+        return 0
+    training = load_model(latest_model_path()).training
+    return training["rows"] if training else 0
+
+
+def validate(dag, start=0, date=config.TODAY):
+    """
+    Validates the rows of the trusted table from `start` on, before `dag` trains on
+    or scores them, and writes the report to quality_report_path(dag, date).
+
+    Raises:
+        DataQualityError: If the rows are rejected, or drifted with FAIL_ON_DRIFT.
+
+    Returns:
+        dict: Report of the validation, see compare.
+    """
+    reference = reference_profile(start)
+    if reference is None:
+        logger.info("No profile of the training data, the drift isn't checked")
+
+    path = ingest()
+    rows = trusted_rows(path=path)
+    with metrics.span("quality.profile", "compute"):
+        profile = (
+            profile_rows(start, rows, path=path) if start < rows else DataProfile()
+        )
+    report = {"start": start, "stop": max(rows, start), **compare(profile, reference)}
+    blob.to_any(BytesIO(json.dumps(report).encode()), quality_report_path(dag, date))
+
+    for message in report["drift"]:
+        logger.warning(message)
+    problems = report["errors"] + (report["drift"] if config.FAIL_ON_DRIFT else [])
+    if problems:
+        raise DataQualityError("; ".join(problems))
+    logger.info(f"{profile.rows} new rows validated, {len(report['drift'])} drifts")
+    return report
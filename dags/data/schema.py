@@ -0,0 +1,36 @@
+"""
+Schema of the equipment data
+
+Columns not declared here are dropped when the input workbooks are ingested. The
+sensors are stored as float32, enough for their readings at half the memory, and the
+presets as small integers read back as pandas categoricals (see CATEGORIES).
+"""
+
+import pyarrow as pa
+
+KEYS = ["Cycle"]
+PRESETS = ["Preset_1", "Preset_2"]
+SENSORS = [
+    "Temperature",
+    "Pressure",
+    "VibrationX",
+    "VibrationY",
+    "VibrationZ",
+    "Frequency",
+]
+TARGET = "Fail"
+
+SCHEMA = pa.schema(
+    [
+        *[pa.field(name, pa.int64()) for name in KEYS],
+        *[pa.field(name, pa.int16()) for name in PRESETS],
+        *[pa.field(name, pa.float32()) for name in SENSORS],
+        pa.field(TARGET, pa.bool_()),
+    ]
+)
+
+# Columns with a handful of distinct values, read as pandas categoricals
+CATEGORIES = PRESETS
+
+# Bumped on every change of SCHEMA, so the workbooks are ingested again
+SCHEMA_VERSION = 2
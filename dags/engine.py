@@ -0,0 +1,221 @@
+"""
+Local DAG engine
+
+Runs the tasks of a DAG of dags.yaml inside one interpreter, each one as soon as the
+tasks it depends on are done, so independent tasks run concurrently on a pool of
+threads or forked processes. Failed tasks are retried and tasks running longer than
+their timeout are given up on, following their spec. A task is never retried while an
+attempt of it is still running, so two attempts can't write its outputs at once.
+
+Only the standard library is imported here, deploy_infra parses the DAGs with it.
+"""
+
+import graphlib
+import logging
+import math
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from multiprocessing import connection
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Task:
+    name: str
+    depends_on: list = field(default_factory=list)
+    # Attempts after the first one, and seconds each attempt may take
+    retries: int = None
+    timeout: float = None
+
+
+def parse_tasks(spec):
+    """
+    Tasks of a DAG of dags.yaml, by name.
+
+    `tasks` is either a list, where each task depends on the previous one, or a
+    mapping of each task to its optional `depends_on`, `retries` and `timeout`.
+
+    Raises:
+        ValueError: If a task depends on an unknown task or on itself, indirectly.
+    """
+    tasks = spec["tasks"]
+    if isinstance(tasks, list):
+        return {
+            name: Task(name, depends_on=[tasks[i - 1]] if i else [])
+            for i, name in enumerate(tasks)
+        }
+
+    parsed = {name: Task(name, **(options or {})) for name, options in tasks.items()}
+    for task in parsed.values():
+        unknown = set(task.depends_on) - set(parsed)
+        if unknown:
+            raise ValueError(f"Task {task.name} depends on unknown tasks {unknown}")
+
+    try:
+        graphlib.TopologicalSorter(_graph(parsed)).prepare()
+    except graphlib.CycleError as ex:
+        raise ValueError(f"Tasks depend on each other: {ex.args[1]}") from ex
+    return parsed
+
+
+def _graph(tasks):
+    return {name: task.depends_on for name, task in tasks.items()}
+
+
+def _run_task(dag, task, force):
+    from dags.runner import run_task
+
+    run_task(dag, task, force)
+
+
+def _attempt(conn, dag, name, attempt, force):
+    """Runs an attempt of a task and sends the error it raised, None if it didn't"""
+    try:
+        _run_task(dag, name, force)
+    except BaseException as ex:
+        # Whatever the task raised, the outcome has to reach the engine
+        try:
+            pickle.dumps(ex)
+        except Exception:
+            ex = RuntimeError(repr(ex))
+        conn.send(ex)
+    else:
+        conn.send(None)
+    finally:
+        conn.close()
+
+
+def run_dag(dag, spec, workers=None, processes=False, force=False):
+    """
+    Runs the tasks of a DAG, the independent ones concurrently.
+
+    A task whose attempts all failed doesn't stop the tasks that don't depend on it,
+    the ones that do are skipped. Each attempt runs on a thread or a forked process
+    of its own. A process that times out is terminated before the task is retried;
+    threads can't be interrupted, so a thread that timed out is waited for before the
+    next attempt starts, and left running once the DAG is over.
+
+    Args:
+        dag (str): Name of the DAG module in `dags`.
+        spec (dict): DAG spec of dags.yaml.
+        workers (int): Maximum number of tasks running at a time, defaults to the
+            number of cores.
+        processes (bool): Whether to run the tasks on forked processes, which share
+            the modules already imported, instead of threads.
+        force (bool): Whether to run the memoized tasks even when up to date.
+
+    Returns:
+        dict: Final status of each task, "done", "failed" or "skipped".
+    """
+    tasks = parse_tasks(spec)
+    sorter = graphlib.TopologicalSorter(_graph(tasks))
+    sorter.prepare()
+    workers = workers or os.cpu_count()
+    context = multiprocessing.get_context("fork")
+
+    status = dict.fromkeys(tasks, "skipped")
+    attempts = dict.fromkeys(tasks, 0)
+    # Tasks waiting for a worker, and the attempts running by the connection they
+    # report on. Only the last attempt of a task that didn't time out has a deadline
+    waiting = deque()
+    running = {}
+    deadlines = {}
+    # Tasks to retry once their attempt that timed out, still running, returns
+    retry_after = set()
+
+    def start(name):
+        attempts[name] += 1
+        attempt, timeout = attempts[name], tasks[name].timeout
+        logger.info(f"Running {dag} {name}, attempt {attempt}")
+        reader, writer = context.Pipe(duplex=False)
+        args = (writer, dag, name, attempt, force)
+        if processes:
+            worker = context.Process(target=_attempt, args=args, daemon=True)
+            worker.start()
+            # The reader sees the end of the pipe if the process dies
+            writer.close()
+        else:
+            worker = threading.Thread(target=_attempt, args=args, daemon=True)
+            worker.start()
+        running[reader] = (name, attempt, worker)
+        deadlines[name] = time.monotonic() + timeout if timeout else math.inf
+
+    def retry(name, error):
+        if attempts[name] > (tasks[name].retries or 0):
+            logger.error(f"{dag} {name} failed: {error!r}")
+            status[name] = "failed"
+        elif any(running_name == name for running_name, _, _ in running.values()):
+            logger.warning(
+                f"{dag} {name} failed, retrying once its attempt returns: {error!r}"
+            )
+            retry_after.add(name)
+        else:
+            logger.warning(f"{dag} {name} failed, retrying: {error!r}")
+            waiting.append(name)
+
+    def finish(name, error):
+        del deadlines[name]
+        if error is None:
+            logger.info(f"{dag} {name} done")
+            status[name] = "done"
+            sorter.done(name)
+        else:
+            retry(name, error)
+
+    def time_out(reader):
+        name, _, worker = running[reader]
+        del deadlines[name]
+        if processes:
+            worker.terminate()
+            worker.join()
+            reader.close()
+            del running[reader]
+        retry(name, TimeoutError(f"{tasks[name].timeout}s timeout"))
+
+    try:
+        while True:
+            waiting.extend(sorter.get_ready())
+            # Threads that timed out still take a worker until they return
+            while waiting and len(running) < workers:
+                start(waiting.popleft())
+            if not deadlines and not retry_after and not waiting:
+                break
+
+            timeout = min(deadlines.values(), default=math.inf) - time.monotonic()
+            ready = connection.wait(
+                list(running), timeout=max(timeout, 0) if timeout < math.inf else None
+            )
+            for reader in ready:
+                name, attempt, worker = running.pop(reader)
+                try:
+                    error = reader.recv()
+                except EOFError:
+                    worker.join()
+                    error = RuntimeError(f"Exited with code {worker.exitcode}")
+                reader.close()
+                if name in retry_after:
+                    # The attempt that timed out returned, the retry can start
+                    retry_after.discard(name)
+                    waiting.append(name)
+                elif name in deadlines and attempt == attempts[name]:
+                    finish(name, error)
+
+            now = time.monotonic()
+            for reader, (name, attempt, _) in list(running.items()):
+                if deadlines.get(name, math.inf) <= now and attempt == attempts[name]:
+                    time_out(reader)
+    finally:
+        if processes:
+            for _, _, worker in running.values():
+                worker.terminate()
+
+    skipped = [name for name, value in status.items() if value == "skipped"]
+    if skipped:
+        logger.warning(f"Skipped {skipped}, a task they depend on failed")
+    return status
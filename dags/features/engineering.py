@@ -0,0 +1,218 @@
+"""
+Feature engineering shared by the training and inference DAGs
+
+The model features are computed in a single pass over a NumPy block with the
+raw sensor readings, so both DAGs always see the same definitions.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from dags.data.schema import PRESETS
+from dags.features.state import FeatureState
+
+FEATURES = [
+    "Sum_of_variables",
+    "Sum_of_variables_MA",
+    "N_equip_feats_abv_85_pct",
+    "Max_value_among_feat",
+    "Sum_of_variables_std",
+    "Diff_Median_Sum_of_variables_Preset",
+    "Diff_Median_Sum_of_variables",
+]
+
+# Mean avg should be a useful feature if there's a trend pre-fail, rolling std of the
+# sum of variables should be useful if variance starts to grow pre-fail
+MA_WINDOW = 4
+STD_WINDOW = 3
+MIN_PERIODS = 2
+
+# Preceding rows the rolling features of a row depend on
+WARMUP_ROWS = max(MA_WINDOW, STD_WINDOW) - 1
+
+# Using the number of equip features that are above their 85th percentile
+FLAG_QUANTILE = 0.85
+
+# filling NA values with -1 because it's the first value and we know it's not a fail
+FILL_VALUE = -1
+
+
+def sensor_columns(df):
+    """Continuous sensor readings of the equipment data"""
+    return list(df.select_dtypes("floating").columns)
+
+
+def target(fail, following=np.nan):
+    """
+    Label of the rows on the verge of failing.
+
+    We want to PREDICT failures in the equipment, not classify fails, so a row is
+    positive when the next one fails. When we know the equipment is failing we also
+    mark it as about to fail, because if no one comes to fix it, the expectation is
+    that it will keep failing.
+
+    Args:
+        fail (array-like): Fail column of consecutive rows.
+        following (float): Fail value of the row right after the last one, when the
+            rows are a chunk of a larger table. The label of the last row is unknown
+            (NaN) without it, unless it is already failing.
+    """
+    fail = np.asarray(fail, dtype=np.float64)
+    verge = np.empty_like(fail)
+    verge[:-1] = fail[1:]
+    verge[-1:] = following
+    return np.where(fail == 1, 1.0, verge)
+
+
+def _rolling_windows(values, window, history):
+    """
+    Trailing windows over `values`, preceded by the `history` values of earlier rows
+    and padded with NaN before the first row.
+    """
+    start = max(len(history) - window + 1, 0)
+    history = history[start:]
+    padding = np.full(window - 1 - len(history), np.nan)
+    return sliding_window_view(np.concatenate((padding, history, values)), window)
+
+
+def _window_mean(windows):
+    count = windows.shape[1] - np.isnan(windows).sum(axis=1)
+    total = np.nansum(windows, axis=1)
+    return np.divide(
+        total, count, out=np.full(len(windows), np.nan), where=count >= MIN_PERIODS
+    )
+
+
+def _window_std(windows):
+    count = windows.shape[1] - np.isnan(windows).sum(axis=1)
+    mean = np.nansum(windows, axis=1) / np.maximum(count, 1)
+    squares = np.nansum((windows - mean[:, None]) ** 2, axis=1)
+    variance = np.divide(
+        squares,
+        count - 1,
+        out=np.full(len(windows), np.nan),
+        where=count >= MIN_PERIODS,
+    )
+    return np.sqrt(variance)
+
+
+def _group_median(values, keys):
+    """Distinct rows of `keys` and the median of `values` within each of them"""
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    counts = np.bincount(inverse)
+    starts = np.cumsum(counts) - counts
+
+    ordered = values[np.lexsort((values, inverse))]
+    lower = ordered[starts + (counts - 1) // 2]
+    upper = ordered[starts + counts // 2]
+    return unique, (lower + upper) / 2
+
+
+def fit_state(df, sensors=None):
+    """
+    Fits the dataset-wide statistics the features depend on.
+
+    Args:
+        df (pd.DataFrame): Raw equipment data, with the sensors and presets columns.
+        sensors (list): Sensor columns, inferred from the float columns if not given.
+
+    Returns:
+        FeatureState: Fitted statistics, without the scaler parameters.
+    """
+    sensors = sensor_columns(df) if sensors is None else sensors
+    block = df[sensors].to_numpy(dtype=np.float64)
+    total = np.nansum(block, axis=1)
+
+    # Per combination of presets
+    presets = df[PRESETS].to_numpy(dtype=np.int64)
+    preset_keys, preset_medians = _group_median(total, presets)
+
+    return FeatureState(
+        sensors=list(sensors),
+        thresholds=np.nanquantile(block, FLAG_QUANTILE, axis=0),
+        median=float(np.median(total)),
+        preset_keys=preset_keys.astype(np.int64),
+        preset_medians=preset_medians,
+    )
+
+
+def build_features(df, state, history=()):
+    """
+    Computes the model features of the raw equipment data.
+
+    Only the rolling features look at other rows (the few preceding ones), every
+    dataset-wide statistic comes from the fitted `state`. Data read in chunks gives
+    the same features as the whole table as long as each chunk gets the trailing
+    `Sum_of_variables` of the previous ones as `history` (see `tail`).
+
+    Args:
+        df (pd.DataFrame): Raw equipment data, with the sensors and presets columns.
+        state (FeatureState): Statistics fitted by `fit_state`.
+        history (array-like): `Sum_of_variables` of the rows preceding `df`.
+
+    Returns:
+        np.ndarray: float32 matrix of shape (n_rows, len(FEATURES)), in FEATURES order.
+    """
+    block = df[state.sensors].to_numpy(dtype=np.float64)
+    presets = df[PRESETS].to_numpy(dtype=np.int64)
+
+    # Focus on variables that combine the effect of multiple variables at high values
+    total = np.nansum(block, axis=1)
+    history = np.asarray(history, dtype=np.float64)
+    moving_avg = _window_mean(_rolling_windows(total, MA_WINDOW, history))
+    moving_std = _window_std(_rolling_windows(total, STD_WINDOW, history))
+    return _assemble(block, presets, total, moving_avg, moving_std, state)
+
+
+def build_row_features(block, presets, state, histories):
+    """
+    Computes the model features of rows of independent series, e.g. the latest
+    reading of several equipment, each one following its own preceding rows.
+
+    The rows come as arrays rather than a DataFrame, whose overhead would dominate
+    for the few rows of a request.
+
+    Args:
+        block (np.ndarray): float64 readings of the `state.sensors` of each row.
+        presets (np.ndarray): int64 PRESETS of each row.
+        state (FeatureState): Statistics fitted by `fit_state`.
+        histories (np.ndarray): `Sum_of_variables` of the WARMUP_ROWS rows preceding
+            each row in its series, oldest first, NaN where the series has fewer.
+
+    Returns:
+        tuple: float32 features matrix, as build_features, and the histories of the
+            rows following each row in its series.
+    """
+    total = np.nansum(block, axis=1)
+    windows = np.column_stack((histories, total))
+    moving_avg = _window_mean(windows[:, -MA_WINDOW:])
+    moving_std = _window_std(windows[:, -STD_WINDOW:])
+    features = _assemble(block, presets, total, moving_avg, moving_std, state)
+    return features, windows[:, 1:]
+
+
+def _assemble(block, presets, total, moving_avg, moving_std, state):
+    features = np.empty((len(block), len(FEATURES)), dtype=np.float32)
+    features[:, 0] = total
+    features[:, 1] = np.where(np.isnan(moving_avg), FILL_VALUE, moving_avg)
+    features[:, 2] = (block >= state.thresholds).sum(axis=1)
+    # Max value of a feature might be useful, although we know individual higher
+    # values don't necessarily result in failure
+    features[:, 3] = np.fmax.reduce(block, axis=1)
+    features[:, 4] = np.where(np.isnan(moving_std), FILL_VALUE, moving_std)
+    features[:, 5] = total - state.preset_median(presets)
+    features[:, 6] = total - state.median
+    return features
+
+
+def tail(df, state, history=()):
+    """`history` to build the features of the rows following `df`"""
+    block = df[state.sensors].tail(WARMUP_ROWS).to_numpy(dtype=np.float64)
+    total = np.nansum(block, axis=1)
+    return np.concatenate((np.asarray(history, dtype=np.float64), total))[-WARMUP_ROWS:]
+
+
+def transform(df, state):
+    """Model input of the raw equipment data: the features, standardized"""
+    return state.scale(build_features(df, state))
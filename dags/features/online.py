@@ -0,0 +1,116 @@
+"""
+Running statistics of the training data
+
+The feature statistics and the scaler are kept as mergeable summaries saved with the
+model: quantile sketches of each sensor, of the sum of variables and of the sum of
+variables of each preset combination, plus the count, mean and sum of squared
+deviations of the model inputs. An incremental training only adds the new rows to
+them instead of going over the whole history again.
+"""
+
+import numpy as np
+
+from dags.data.schema import PRESETS
+from dags.features.engineering import FLAG_QUANTILE
+from dags.features.sharding import shard_groups
+from dags.features.sketch import QuantileSketch
+from dags.features.state import FeatureState
+
+
+class OnlineStatistics:
+    def __init__(self, sensors):
+        self.sensors = list(sensors)
+        self.sensor_sketches = [QuantileSketch() for _ in self.sensors]
+        self.total_sketch = QuantileSketch()
+        self.preset_sketches = {}
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, df):
+        """Adds the raw equipment data of new rows to the feature statistics"""
+        block = df[self.sensors].to_numpy(dtype=np.float64)
+        for sketch, values in zip(self.sensor_sketches, block.T):
+            sketch.update(values)
+
+        total = np.nansum(block, axis=1)
+        self.total_sketch.update(total)
+
+        if len(df):
+            keys, groups = shard_groups(df[PRESETS].to_numpy(dtype=np.int64))
+            for key, rows in zip(map(tuple, keys.tolist()), groups):
+                self.preset_sketches.setdefault(key, QuantileSketch()).update(
+                    total[rows]
+                )
+        return self
+
+    def update_moments(self, features):
+        """Merges the mean and variance of new model inputs into the running ones"""
+        features = np.asarray(features, dtype=np.float64)
+        count = len(features)
+        if not count:
+            return self
+
+        mean = features.mean(axis=0)
+        m2 = ((features - mean) ** 2).sum(axis=0)
+        if not self.count:
+            self.count, self.mean, self.m2 = count, mean, m2
+            return self
+
+        # Pairwise update of Chan et al.
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta**2 * self.count * count / total
+        self.count = total
+        return self
+
+    def feature_state(self):
+        """FeatureState with the statistics of every row added so far"""
+        keys = sorted(self.preset_sketches)
+        scale = np.sqrt(self.m2 / self.count)
+        # Constant features are left unscaled, as StandardScaler does
+        scale[scale < 10 * np.finfo(np.float64).eps] = 1.0
+
+        return FeatureState(
+            sensors=list(self.sensors),
+            thresholds=np.array(
+                [s.quantile(FLAG_QUANTILE) for s in self.sensor_sketches]
+            ),
+            median=float(self.total_sketch.quantile(0.5)),
+            preset_keys=np.array(keys, dtype=np.int64).reshape(-1, 2),
+            preset_medians=np.array(
+                [self.preset_sketches[k].quantile(0.5) for k in keys]
+            ),
+            scaler_mean=self.mean,
+            scaler_scale=scale,
+        )
+
+    def to_arrays(self):
+        """Flat float64 arrays with all the statistics, by name"""
+        arrays = {
+            f"sensor/{name}": sketch.to_array()
+            for name, sketch in zip(self.sensors, self.sensor_sketches)
+        }
+        arrays["total"] = self.total_sketch.to_array()
+        for (preset_1, preset_2), sketch in sorted(self.preset_sketches.items()):
+            arrays[f"preset/{preset_1}/{preset_2}"] = sketch.to_array()
+        arrays["count"] = np.array([self.count], dtype=np.float64)
+        arrays["moments"] = np.vstack((self.mean, self.m2))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, sensors, arrays):
+        stats = cls(sensors)
+        stats.sensor_sketches = [
+            QuantileSketch.from_array(arrays[f"sensor/{name}"])
+            for name in stats.sensors
+        ]
+        stats.total_sketch = QuantileSketch.from_array(arrays["total"])
+        for name, array in arrays.items():
+            if name.startswith("preset/"):
+                key = tuple(int(part) for part in name.split("/")[1:])
+                stats.preset_sketches[key] = QuantileSketch.from_array(array)
+        stats.count = int(arrays["count"][0])
+        stats.mean, stats.m2 = np.array(arrays["moments"], dtype=np.float64)
+        return stats
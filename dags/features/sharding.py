@@ -0,0 +1,100 @@
+"""
+Sharded feature engineering
+
+The rolling features and the label look at the neighbouring rows, so when the table
+interleaves independent series (equipment, preset combinations) they are computed
+within each series instead. The table is split by the shard key columns, each shard
+is processed by a worker of a process pool and the outputs are merged back.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dags import config
+from dags.data.schema import TARGET
+from dags.features.engineering import FEATURES, build_features, target
+
+
+def shard_groups(keys):
+    """
+    Distinct rows of `keys` and the positions of the rows of each, in order.
+
+    Args:
+        keys (np.ndarray): Shard key of each row, of shape (n_rows, n_keys).
+
+    Returns:
+        tuple: Sorted distinct keys and a list with the row positions of each.
+    """
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    inverse = inverse.ravel()
+    groups = np.split(
+        np.argsort(inverse, kind="stable"), np.cumsum(np.bincount(inverse))[:-1]
+    )
+    return unique, groups
+
+
+def _shard_features(df, state):
+    return build_features(df, state), target(df[TARGET])
+
+
+def labelled_features(df, state, workers=config.SHARD_WORKERS):
+    """
+    Model features and label of every row, computed within each shard.
+
+    Args:
+        df (pd.DataFrame): Raw equipment data, with the shard keys and Fail columns.
+        state (FeatureState): Fitted statistics, with the shard keys.
+        workers (int): Number of worker processes, defaults to the number of cores.
+
+    Returns:
+        tuple: Features matrix and labels, in the row order of `df`. The label of
+            the last row of each shard is NaN unless it is already failing.
+    """
+    if not state.shard_keys:
+        return _shard_features(df, state)
+
+    _, groups = shard_groups(df[state.shard_keys].to_numpy(dtype=np.int64))
+    X = np.empty((len(df), len(FEATURES)), dtype=np.float32)
+    y = np.empty(len(df), dtype=np.float64)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        shards = (df.iloc[rows] for rows in groups)
+        for rows, (X_shard, y_shard) in zip(
+            groups, executor.map(_shard_features, shards, repeat(state))
+        ):
+            X[rows], y[rows] = X_shard, y_shard
+    return X, y
+
+
+def spill_shards(chunks, keys, folder):
+    """
+    Splits consecutive chunks of a table into a parquet file per shard.
+
+    Args:
+        chunks (iterable): DataFrames with consecutive rows of the table.
+        keys (list): Shard key columns.
+        folder (str): Local folder the shard files are written to.
+
+    Returns:
+        list: Shard key tuple and path of each shard file, sorted by shard key. Each
+            file has the rows of a shard in their original order.
+    """
+    writers = {}
+    try:
+        for chunk in chunks:
+            shard_keys, groups = shard_groups(chunk[keys].to_numpy(dtype=np.int64))
+            for key, rows in zip(map(tuple, shard_keys.tolist()), groups):
+                table = pa.Table.from_pandas(chunk.iloc[rows], preserve_index=False)
+                if key not in writers:
+                    path = os.path.join(folder, f"shard-{len(writers):05d}.parquet")
+                    writers[key] = pq.ParquetWriter(path, table.schema)
+                writers[key].write_table(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return [(key, writers[key].where) for key in sorted(writers)]
@@ -0,0 +1,104 @@
+"""
+Mergeable quantile sketch
+
+A merging t-digest: the distribution is summarised by weighted centroids, small at
+the tails and larger around the median, so the quantiles keep a small relative
+error while the sketch size stays bounded by `compression`. Sketches built over
+different chunks or shards of the data merge into the sketch of the whole.
+"""
+
+import numpy as np
+
+COMPRESSION = 200
+
+
+class QuantileSketch:
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return float(self.weights.sum())
+
+    def _compress(self, means, weights):
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+
+        # Centroids covering the same unit of the k1 scale function are merged
+        cumulative = np.cumsum(weights)
+        quantiles = (cumulative - weights / 2) / cumulative[-1]
+        scale = self.compression / (2 * np.pi) * np.arcsin(2 * quantiles - 1)
+        groups = np.floor(scale - scale[0]).astype(np.int64)
+        groups = np.unique(groups, return_inverse=True)[1]
+
+        self.weights = np.bincount(groups, weights=weights)
+        self.means = np.bincount(groups, weights=weights * means) / self.weights
+
+    def update(self, values):
+        """Adds the non-NaN `values` to the sketch"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress(
+            np.concatenate((self.means, values)),
+            np.concatenate((self.weights, np.ones(len(values)))),
+        )
+        return self
+
+    def merge(self, other):
+        """Adds the values summarised by `other` to the sketch"""
+        if not other.count:
+            return self
+
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress(
+            np.concatenate((self.means, other.means)),
+            np.concatenate((self.weights, other.weights)),
+        )
+        return self
+
+    def quantile(self, q):
+        """Approximate `q` quantile(s) of the values added so far"""
+        if not self.count:
+            return np.full(np.shape(q), np.nan)[()]
+
+        cumulative = np.cumsum(self.weights)
+        centers = cumulative - self.weights / 2
+        positions = np.concatenate(([0], centers, [cumulative[-1]]))
+        values = np.concatenate(([self.min], self.means, [self.max]))
+        return np.interp(np.asarray(q) * cumulative[-1], positions, values)[()]
+
+    def cdf(self, x):
+        """Approximate fraction of the values added so far at most `x`"""
+        if not self.count:
+            return np.full(np.shape(x), np.nan)[()]
+
+        cumulative = np.cumsum(self.weights)
+        centers = cumulative - self.weights / 2
+        positions = np.concatenate(([0], centers, [cumulative[-1]]))
+        values = np.concatenate(([self.min], self.means, [self.max]))
+        return (np.interp(x, values, positions) / cumulative[-1])[()]
+
+    def to_array(self):
+        """Flat float64 array with the whole sketch"""
+        return np.concatenate(
+            ([self.compression, self.min, self.max], self.means, self.weights)
+        )
+
+    @classmethod
+    def from_array(cls, array):
+        sketch = cls(compression=float(array[0]))
+        sketch.min, sketch.max = float(array[1]), float(array[2])
+        sketch.means, sketch.weights = np.split(
+            np.asarray(array[3:], dtype=np.float64), 2
+        )
+        return sketch
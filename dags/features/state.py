@@ -0,0 +1,80 @@
+"""
+Statistics fitted on the training data that the features depend on
+
+Saving them with the model makes inference a row-local transform: no quantile,
+median or groupby pass is needed over the rows being scored.
+"""
+
+from dataclasses import dataclass, field
+
+import numpy as np
+
+STATE_VERSION = 1
+
+
+def _preset_codes(presets):
+    """Packs each (Preset_1, Preset_2) pair into a single sortable int64 code"""
+    presets = np.asarray(presets, dtype=np.int64)
+    return (presets[:, 0] << 32) | (presets[:, 1] & 0xFFFFFFFF)
+
+
+@dataclass
+class FeatureState:
+    sensors: list
+    thresholds: np.ndarray
+    median: float
+    preset_keys: np.ndarray
+    preset_medians: np.ndarray
+    scaler_mean: np.ndarray = None
+    scaler_scale: np.ndarray = None
+    # Columns of the independent series the rolling features are computed within
+    shard_keys: list = field(default_factory=list)
+
+    def preset_median(self, presets):
+        """
+        Median sum of variables of each row's preset combination.
+
+        Combinations never seen in training fall back to the global median.
+        """
+        if not len(self.preset_keys):
+            return np.full(len(presets), self.median)
+        codes = _preset_codes(self.preset_keys)
+        order = np.argsort(codes)
+        codes, medians = codes[order], self.preset_medians[order]
+
+        wanted = _preset_codes(presets)
+        idx = np.searchsorted(codes, wanted).clip(max=len(codes) - 1)
+        return np.where(codes[idx] == wanted, medians[idx], self.median)
+
+    def scale(self, features):
+        """Standardizes the features the same way the training StandardScaler did"""
+        scaled = np.array(features, dtype=np.float64)
+        scaled -= self.scaler_mean
+        scaled /= self.scaler_scale
+        return scaled
+
+    def to_dict(self):
+        """JSON friendly statistics, the scaler parameters are stored with the model"""
+        return {
+            "version": STATE_VERSION,
+            "sensors": list(self.sensors),
+            "thresholds": self.thresholds.tolist(),
+            "median": self.median,
+            "presets": [
+                [*key, value]
+                for key, value in zip(self.preset_keys.tolist(), self.preset_medians)
+            ],
+            "shard_keys": list(self.shard_keys),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        presets = np.array(data["presets"], dtype=np.float64).reshape(-1, 3)
+        return cls(
+            sensors=data["sensors"],
+            thresholds=np.array(data["thresholds"]),
+            median=data["median"],
+            preset_keys=presets[:, :2].astype(np.int64),
+            preset_medians=presets[:, 2],
+            shard_keys=data.get("shard_keys", []),
+        )
@@ -0,0 +1,113 @@
+"""
+Memoization of the DAG tasks
+
+A task declares the blobs it reads and writes with `memoize`. Before running it, the
+runner hashes the ETag and size of its inputs with its parameters and the code
+version of pyproject.toml, and skips the task when the manifest of its last run has
+the same hash and its outputs are still there. The manifests are kept in
+REFINED_FOLDER/_manifests. The storage modules, which import the Azure SDK, are only
+imported once a task is about to run.
+"""
+
+import hashlib
+import json
+import logging
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+from dags.paths import MANIFESTS_FOLDER
+
+logger = logging.getLogger(__name__)
+
+PYPROJECT = Path(__file__).parents[1] / "pyproject.toml"
+
+
+def code_version():
+    """Version of the project in pyproject.toml, None if it isn't available"""
+    try:
+        with PYPROJECT.open("rb") as file:
+            return tomllib.load(file)["project"]["version"]
+    except (OSError, KeyError):
+        return None
+
+
+@dataclass
+class Memo:
+    inputs: list
+    outputs: list
+    params: dict = field(default_factory=dict)
+
+    def key(self, dag, task):
+        """
+        Hash of everything the outputs of the task depend on.
+
+        Returns:
+            str: Hex digest, None when an input or the code version is missing and
+                the task can't be skipped.
+        """
+        from dags.storage import blob
+
+        version = code_version()
+        if version is None:
+            logger.warning(f"No code version in {PYPROJECT}, {task} isn't memoized")
+            return None
+
+        fingerprints = {}
+        for uri in self.inputs:
+            if not blob.exists(uri):
+                return None
+            info = blob.stat(uri)
+            fingerprints[uri] = [info.etag, info.size]
+
+        content = {
+            "task": f"{dag}.{task}",
+            "version": version,
+            "inputs": fingerprints,
+            "params": self.params,
+        }
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def is_fresh(self, dag, task, key):
+        """Whether the last run of the task had the same `key` and left its outputs"""
+        from dags.storage import blob, cache
+
+        path = _manifest_path(dag, task)
+        if not blob.exists(path):
+            return False
+        if cache.read_any(path, func=json.load)["key"] != key:
+            return False
+        return all(blob.exists(uri) for uri in self.outputs)
+
+    def record(self, dag, task, key):
+        """Saves the manifest of a successful run"""
+        from dags.storage import blob
+
+        manifest = {"key": key, "outputs": self.outputs}
+        blob.to_any(BytesIO(json.dumps(manifest).encode()), _manifest_path(dag, task))
+
+
+def _manifest_path(dag, task):
+    return f"{MANIFESTS_FOLDER}/{dag}/{task}.json"
+
+
+def memoize(inputs, outputs, params=None):
+    """
+    Declares the blobs a task reads and writes, so it's skipped when they're current.
+
+    Args:
+        inputs (list): URIs of the blobs the task reads.
+        outputs (list): URIs of the blobs the task writes.
+        params (dict): JSON friendly settings the outputs also depend on.
+    """
+
+    def decorator(func):
+        func.memo = Memo(list(inputs), list(outputs), params or {})
+        return func
+
+    return decorator
@@ -0,0 +1,262 @@
+"""
+Instrumentation of the DAG tasks
+
+The runner runs each task inside `instrument`. Meanwhile the DAG code times its hot
+paths with `span` and counts what it processes with `count`, both doing nothing
+outside of a task. A span is of a kind, "io", "compute" or "fit", and the time of
+nested spans only counts for the innermost one, so the time of the task splits into
+the time of each kind and the time outside of any span, "other". Spans only time the
+thread of the task: the transfers it runs in the background count what they process,
+and their time shows as the time the task waits for them.
+
+When the task ends its metrics are logged, and written as a JSON record to
+METRICS_DIR and to METRICS_FOLDER in the storage account. TASK_PROFILE=cprofile
+profiles the task with cProfile and TASK_PROFILE=sample samples its stack every
+PROFILE_INTERVAL seconds, as folded stacks for flame graphs; the profiles are written
+next to the records.
+"""
+
+import contextvars
+import cProfile
+import datetime
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from io import BytesIO
+
+from dags import config
+from dags.paths import METRICS_FOLDER
+
+logger = logging.getLogger(__name__)
+
+KINDS = ["io", "compute", "fit"]
+
+# Seconds between two samples of the sampling profiler
+PROFILE_INTERVAL = 0.01
+
+_current = contextvars.ContextVar("task_metrics", default=None)
+
+
+class TaskMetrics:
+    """Spans and counters of a task run"""
+
+    def __init__(self, dag, task):
+        self.dag = dag
+        self.task = task
+        self.status = None
+        self.started = datetime.datetime.now(datetime.timezone.utc)
+        self.spans = defaultdict(lambda: {"seconds": 0.0, "calls": 0})
+        self.kinds = dict.fromkeys(KINDS, 0.0)
+        self.counters = Counter()
+        # Seconds of the spans nested in each open span
+        self._nested = []
+        self._thread = threading.get_ident()
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+
+    def record(self, status):
+        """Metrics of the run so far, JSON friendly"""
+        wall = time.perf_counter() - self._start
+        kinds = {kind: round(seconds, 4) for kind, seconds in self.kinds.items()}
+        kinds["other"] = round(max(wall - sum(self.kinds.values()), 0), 4)
+        return {
+            "dag": self.dag,
+            "task": self.task,
+            "status": status,
+            "started": self.started.isoformat(),
+            "wall_seconds": round(wall, 4),
+            "cpu_seconds": round(time.process_time() - self._cpu_start, 4),
+            "peak_rss_mb": _peak_rss_mb(resource.RUSAGE_SELF),
+            "children_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN),
+            "kinds": kinds,
+            "spans": {
+                name: {"seconds": round(span["seconds"], 4), "calls": span["calls"]}
+                for name, span in sorted(
+                    self.spans.items(), key=lambda item: -item[1]["seconds"]
+                )
+            },
+            "counters": dict(self.counters),
+        }
+
+
+def _peak_rss_mb(who):
+    # Peak of the whole process, a task has its own process in Batch. ru_maxrss is in
+    # kilobytes, in bytes on macOS
+    unit = 1 if sys.platform == "darwin" else 1024
+    return round(resource.getrusage(who).ru_maxrss * unit / 1024**2, 1)
+
+
+def current():
+    """Metrics of the task running, None outside of a task"""
+    return _current.get()
+
+
+@contextmanager
+def span(name, kind="compute"):
+    """
+    Times a block of code, or a function when used as a decorator.
+
+    Args:
+        name (str): Name of the span, the time of the spans sharing it adds up.
+        kind (str): "io", "compute" or "fit".
+    """
+    metrics = _current.get()
+    if metrics is None or threading.get_ident() != metrics._thread:
+        yield
+        return
+
+    nested = [0.0]
+    metrics._nested.append(nested)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics._nested.pop()
+        if metrics._nested:
+            metrics._nested[-1][0] += elapsed
+        metrics.kinds[kind] += elapsed - nested[0]
+        metrics.spans[name]["seconds"] += elapsed
+        metrics.spans[name]["calls"] += 1
+
+
+def count(name, value=1):
+    """Adds `value` to a counter of the task running, e.g. rows_read"""
+    metrics = _current.get()
+    if metrics is not None:
+        with metrics._lock:
+            metrics.counters[name] += value
+
+
+class _CProfiler:
+    suffix = "prof"
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self):
+        self._profile.enable()
+
+    def stop(self):
+        self._profile.disable()
+
+    def dump(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "profile.prof")
+            self._profile.dump_stats(path)
+            with open(path, "rb") as file:
+                return file.read()
+
+
+class _SamplingProfiler:
+    """Samples the stack of the thread that started it"""
+
+    suffix = "folded"
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{frame.f_globals.get('__name__')}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self):
+        lines = [f"{stack} {samples}" for stack, samples in self.stacks.items()]
+        return "\n".join(lines).encode()
+
+
+PROFILERS = {"cprofile": _CProfiler, "sample": _SamplingProfiler}
+
+
+def _write(metrics, record, profiler):
+    """Writes the record, and profile, locally and to the storage account"""
+    started = metrics.started.strftime("%Y%m%dT%H%M%S")
+    name = f"{metrics.dag}/{metrics.task}/{started}-{os.getpid()}"
+    files = {f"{name}.json": json.dumps(record, indent=2).encode()}
+    if profiler is not None:
+        files[f"{name}.{profiler.suffix}"] = profiler.dump()
+
+    # The metrics are no reason to fail the task, they're uploaded in the background
+    try:
+        from dags.storage import transfer
+
+        for file_name, content in files.items():
+            path = os.path.join(config.METRICS_DIR, file_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(content)
+            transfer.upload(
+                BytesIO(content), f"{METRICS_FOLDER}/{file_name}", critical=False
+            )
+    except Exception:
+        logger.warning(f"Couldn't write the metrics of {name}", exc_info=True)
+
+
+def _log(record):
+    kinds = ", ".join(
+        f"{kind} {seconds:.2f}s" for kind, seconds in record["kinds"].items()
+    )
+    logger.info(
+        f"{record['dag']} {record['task']} {record['status']} in "
+        f"{record['wall_seconds']:.2f}s ({kinds}), peak RSS "
+        f"{record['peak_rss_mb']} MB, counters {record['counters']}"
+    )
+
+
+@contextmanager
+def instrument(dag, task):
+    """
+    Collects the metrics of a task run, written when it ends.
+
+    The status of the run is "failed" when it raises, TaskMetrics.status when set,
+    e.g. to "skipped", and "done" otherwise.
+
+    Yields:
+        TaskMetrics: Metrics of the run.
+    """
+    metrics = TaskMetrics(dag, task)
+    token = _current.set(metrics)
+
+    profiler = None
+    if config.TASK_PROFILE:
+        if config.TASK_PROFILE not in PROFILERS:
+            raise ValueError(f"Unknown TASK_PROFILE {config.TASK_PROFILE}")
+        profiler = PROFILERS[config.TASK_PROFILE]()
+        profiler.start()
+
+    status = "failed"
+    try:
+        yield metrics
+        status = metrics.status or "done"
+    finally:
+        if profiler is not None:
+            profiler.stop()
+        _current.reset(token)
+        record = metrics.record(status)
+        _log(record)
+        _write(metrics, record, profiler)
@@ -0,0 +1,280 @@
+"""
+Binary format of the trained model
+
+A fitted linear model is a handful of small arrays, so instead of pickling the whole
+estimator we store:
+
+    magic (8 bytes) | header length (uint32, little endian) | JSON header | arrays
+
+The header has the feature order, the fitted feature statistics, the parameters,
+decision threshold and training watermark of the estimator and the dtype, shape and
+offset of each array.
+The arrays are raw little endian buffers aligned to 64 bytes, so a loaded model is
+just a set of views over a memory map of the file.
+
+Every trained model is saved under its own content hash and LATEST.json points to
+the current one, so tasks sharing a node also share the cached copy of the model. The
+evaluation report of the model, when given, is saved next to it.
+"""
+
+import hashlib
+import json
+import mmap
+import struct
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+from paeio.path import path_join
+
+from dags.features.online import OnlineStatistics
+from dags.features.state import FeatureState
+from dags.paths import MODELS_FOLDER
+from dags.storage import blob, cache, transfer
+
+MAGIC = b"DDLRM\x00\x00\x00"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+
+# Estimator parameters kept in the header, to refine the model later on
+PARAMS = ["solver", "C", "class_weight"]
+ONLINE_PREFIX = "online/"
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+@dataclass
+class ModelArtifact:
+    header: dict
+    arrays: dict
+
+    @property
+    def features(self):
+        return self.header["features"]
+
+    @property
+    def coef(self):
+        return self.arrays["coef"]
+
+    @property
+    def intercept(self):
+        return self.arrays["intercept"]
+
+    @property
+    def classes(self):
+        return self.arrays["classes"]
+
+    @property
+    def state(self):
+        state = FeatureState.from_dict(self.header["feature_state"])
+        state.scaler_mean = self.arrays["scaler_mean"]
+        state.scaler_scale = self.arrays["scaler_scale"]
+        return state
+
+    @property
+    def params(self):
+        params = dict(self.header.get("params", {}))
+        if isinstance(params.get("class_weight"), dict):
+            # JSON turned the class labels into strings
+            params["class_weight"] = {
+                int(label): weight for label, weight in params["class_weight"].items()
+            }
+        return params
+
+    @property
+    def threshold(self):
+        """Probability from which a row is positive, None for the 0.5 of predict"""
+        return self.header.get("threshold")
+
+    @property
+    def training(self):
+        """Watermark of the training data the model has seen, if it was recorded"""
+        return self.header.get("training")
+
+    @property
+    def online(self):
+        """Running statistics of the training data, if they were saved"""
+        arrays = {
+            name.removeprefix(ONLINE_PREFIX): array
+            for name, array in self.arrays.items()
+            if name.startswith(ONLINE_PREFIX)
+        }
+        if not arrays:
+            return None
+        return OnlineStatistics.from_arrays(
+            self.header["feature_state"]["sensors"], arrays
+        )
+
+    def to_estimator(self):
+        """scikit-learn LogisticRegression with the stored parameters"""
+        from sklearn.linear_model import LogisticRegression
+
+        estimator = LogisticRegression()
+        estimator.coef_ = np.array(self.coef)
+        estimator.intercept_ = np.array(self.intercept)
+        estimator.classes_ = np.array(self.classes)
+        estimator.n_features_in_ = len(self.features)
+        return estimator
+
+
+def write_artifact(
+    model, state, features, file_obj, online=None, training=None, threshold=None
+):
+    """
+    Writes a fitted linear model and its feature statistics to `file_obj`.
+
+    Args:
+        model: Fitted scikit-learn linear classifier (coef_, intercept_, classes_).
+        state (FeatureState): Fitted feature statistics, with the scaler parameters.
+        features (list): Names of the model inputs, in order.
+        file_obj: Binary stream to write to.
+        online (OnlineStatistics): Running statistics of the training data.
+        training (dict): Watermark of the training data, e.g. the rows it had.
+        threshold (float): Probability from which a row is positive.
+    """
+    arrays = {
+        "coef": model.coef_,
+        "intercept": model.intercept_,
+        "classes": model.classes_,
+        "scaler_mean": state.scaler_mean,
+        "scaler_scale": state.scaler_scale,
+    }
+    if online is not None:
+        for name, array in online.to_arrays().items():
+            arrays[ONLINE_PREFIX + name] = array
+    arrays = {
+        name: np.ascontiguousarray(
+            array, dtype=np.asarray(array).dtype.newbyteorder("<")
+        )
+        for name, array in arrays.items()
+    }
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = {
+            "dtype": array.dtype.str,
+            "shape": array.shape,
+            "offset": offset,
+        }
+        offset = _aligned(offset + array.nbytes)
+
+    header = json.dumps(
+        {
+            "format": FORMAT_VERSION,
+            "estimator": type(model).__name__,
+            "features": list(features),
+            "feature_state": state.to_dict(),
+            "params": {
+                name: value
+                for name, value in model.get_params().items()
+                if name in PARAMS
+            },
+            "threshold": threshold,
+            "training": training,
+            "arrays": layout,
+        }
+    ).encode()
+    prefix = len(MAGIC) + 4 + len(header)
+
+    file_obj.write(MAGIC)
+    file_obj.write(struct.pack("<I", len(header)))
+    file_obj.write(header)
+    file_obj.write(b"\x00" * (_aligned(prefix) - prefix))
+    for array in arrays.values():
+        file_obj.write(array.tobytes())
+        file_obj.write(b"\x00" * (_aligned(array.nbytes) - array.nbytes))
+
+
+def read_artifact(buffer):
+    """Model stored in `buffer`, with its arrays as zero-copy views over it"""
+    if bytes(buffer[: len(MAGIC)]) != MAGIC:
+        raise ValueError("Not a model artifact")
+
+    (header_size,) = struct.unpack_from("<I", buffer, len(MAGIC))
+    start, end = len(MAGIC) + 4, len(MAGIC) + 4 + header_size
+    header = json.loads(bytes(buffer[start:end]))
+    if header["format"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model artifact format {header['format']}")
+
+    data_start = _aligned(end)
+    arrays = {}
+    for name, spec in header.pop("arrays").items():
+        count = int(np.prod(spec["shape"]))
+        array = np.frombuffer(
+            buffer, dtype=spec["dtype"], count=count, offset=data_start + spec["offset"]
+        )
+        arrays[name] = array.reshape(spec["shape"])
+    return ModelArtifact(header=header, arrays=arrays)
+
+
+def save_model(
+    model,
+    state,
+    features,
+    folder=MODELS_FOLDER,
+    online=None,
+    training=None,
+    threshold=None,
+    evaluation=None,
+    profile=None,
+    previous_profile=None,
+):
+    """
+    Saves a model under its content hash and points LATEST.json to it.
+
+    Args:
+        evaluation (dict): Evaluation report of the model, saved as evaluation.json
+            next to it, see dags.models.evaluation.evaluate.
+        profile (dict): Profile of the training data, saved as profile.json next to
+            it, see dags.data.quality.DataProfile.
+        previous_profile (dict): Profile of the training data of the model this one
+            refines, saved as previous_profile.json next to it.
+
+    Returns:
+        str: Path of the saved model.
+    """
+    byte_stream = BytesIO()
+    write_artifact(
+        model,
+        state,
+        features,
+        byte_stream,
+        online=online,
+        training=training,
+        threshold=threshold,
+    )
+
+    version = hashlib.sha256(byte_stream.getbuffer()).hexdigest()[:16]
+    path = path_join(folder, version, "model.bin")
+    uploads = [transfer.upload(byte_stream, path)]
+    reports = {
+        "evaluation.json": evaluation,
+        "profile.json": profile,
+        "previous_profile.json": previous_profile,
+    }
+    for name, report in reports.items():
+        if report is not None:
+            report = BytesIO(json.dumps(report).encode())
+            uploads.append(transfer.upload(report, path_join(folder, version, name)))
+
+    # LATEST.json only points to the model once its files are all there
+    for upload in uploads:
+        upload.result()
+    latest = {"version": version}
+    blob.to_any(BytesIO(json.dumps(latest).encode()), path_join(folder, "LATEST.json"))
+    return path
+
+
+def load_model(path):
+    """Memory maps the model saved in `path`"""
+    with cache.open_blob(path) as file_obj:
+        buffer = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+    return read_artifact(buffer)
+
+
+def latest_model_path(folder=MODELS_FOLDER):
+    latest = cache.read_any(path_join(folder, "LATEST.json"), func=json.load)
+    return path_join(folder, latest["version"], "model.bin")
@@ -0,0 +1,203 @@
+"""
+Evaluation of the binary classifier over every decision threshold
+
+The probabilities of the holdout are sorted once. The cumulative count of positives
+in that order then gives the confusion matrix at each distinct probability taken as
+threshold, and the ROC and precision-recall curves, their areas and the F1-optimal
+threshold all follow from those counts without another pass over the rows.
+
+The report is plain JSON: the curves are thinned to at most CURVE_POINTS points, and
+plotting it needs matplotlib, which is only imported by `plot_report`.
+"""
+
+import numpy as np
+
+# Points kept of each curve in the report
+CURVE_POINTS = 101
+
+DEFAULT_THRESHOLD = 0.5
+
+
+def threshold_counts(y, proba):
+    """
+    Confusion matrix at every distinct probability taken as threshold.
+
+    A row is predicted positive when its probability is at least the threshold.
+
+    Args:
+        y (np.ndarray): Labels, 1 for the positive class.
+        proba (np.ndarray): Probability of the positive class of each row.
+
+    Returns:
+        tuple: Thresholds in decreasing order and the true positives, false positives,
+            false negatives and true negatives at each one.
+    """
+    y = np.asarray(y) == 1
+    proba = np.asarray(proba, dtype=np.float64)
+
+    order = np.argsort(proba, kind="stable")[::-1]
+    sorted_proba = proba[order]
+
+    # Last row of each run of equal probabilities
+    last = np.append(np.flatnonzero(np.diff(sorted_proba)), len(proba) - 1)
+    tp = np.cumsum(y[order], dtype=np.int64)[last]
+    fp = last + 1 - tp
+
+    n_positive, n_negative = tp[-1], fp[-1]
+    return sorted_proba[last], tp, fp, n_positive - tp, n_negative - fp
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / np.maximum(denominator, 1), 0.0)
+
+
+def _scores(tp, fp, fn, tn):
+    precision = _ratio(tp, tp + fp)
+    recall = _ratio(tp, tp + fn)
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": _ratio(2 * tp, 2 * tp + fp + fn),
+        "fpr": _ratio(fp, fp + tn),
+    }
+
+
+def _at(index, thresholds, counts, scores, threshold=None):
+    """Confusion matrix and scores at `index`, -1 predicting every row negative"""
+    tp, fp, fn, tn = (int(count[index]) for count in counts)
+    if index < 0:
+        # Nothing is predicted positive
+        fn, tn = tp + fn, fp + tn
+        tp = fp = 0
+    return {
+        "threshold": float(thresholds[index] if threshold is None else threshold),
+        "confusion_matrix": [[tn, fp], [fn, tp]],
+        **{
+            name: float(values[index]) if index >= 0 else 0.0
+            for name, values in scores.items()
+            if name != "fpr"
+        },
+    }
+
+
+def evaluate(y, proba, threshold=DEFAULT_THRESHOLD, curve_points=CURVE_POINTS):
+    """
+    Evaluates the probabilities of a binary classifier at every threshold.
+
+    Args:
+        y (np.ndarray): Labels, 1 for the positive class.
+        proba (np.ndarray): Probability of the positive class of each row.
+        threshold (float): Threshold the "default" scores are computed at.
+        curve_points (int): Points kept of each curve.
+
+    Returns:
+        dict: Rows and positives, ROC AUC, average precision, the scores and
+            confusion matrix at `threshold` ("default") and at the F1-optimal
+            threshold ("best"), and the thinned ROC and precision-recall curves.
+    """
+    thresholds, *counts = threshold_counts(y, proba)
+    scores = _scores(*counts)
+    tp, fp = counts[0], counts[1]
+
+    # The curves start from the threshold above every probability
+    fpr = np.append(0.0, scores["fpr"])
+    tpr = np.append(0.0, scores["recall"])
+    roc_auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    average_precision = float(np.sum(np.diff(tpr) * scores["precision"]))
+
+    best = int(np.argmax(scores["f1"]))
+    # Thresholds are decreasing, the last one at least `threshold` is its cut
+    default = int(np.searchsorted(-thresholds, -threshold, side="right")) - 1
+
+    points = np.unique(
+        np.append(np.linspace(0, len(thresholds) - 1, curve_points).round(), best)
+    ).astype(int)
+    return {
+        "rows": int(tp[-1] + fp[-1]),
+        "positives": int(tp[-1]),
+        "roc_auc": roc_auc,
+        "average_precision": average_precision,
+        "default": _at(default, thresholds, counts, scores, threshold),
+        "best": _at(best, thresholds, counts, scores),
+        "curves": {
+            "threshold": thresholds[points].tolist(),
+            "fpr": scores["fpr"][points].tolist(),
+            "recall": scores["recall"][points].tolist(),
+            "precision": scores["precision"][points].tolist(),
+        },
+    }
+
+
+def plot_report(report, labels=("Positives", "Negatives")):
+    """
+    Draws the confusion matrix at the decision threshold of a report ("default"),
+    the ROC curve and the precision-recall curve.
+
+    Returns:
+        matplotlib.figure.Figure: The figure, for the caller to show or save.
+    """
+    import matplotlib.pyplot as plt
+
+    chosen, best, curves = report["default"], report["best"], report["curves"]
+    figure, (cm_ax, roc_ax, pr_ax) = plt.subplots(1, 3, figsize=[20, 5])
+
+    # 1 -- Confusion matrix
+    cm = np.array(chosen["confusion_matrix"])
+    cm_ax.imshow(cm, cmap="Blues")
+    cmlabels = [
+        ["True Negatives", "False Positives"],
+        ["False Negatives", "True Positives"],
+    ]
+    for (i, j), value in np.ndenumerate(cm):
+        cm_ax.text(j, i, f"{value}\n{cmlabels[i][j]}", ha="center", va="center")
+    cm_ax.set_xticks([0, 1], labels[::-1])
+    cm_ax.set_yticks([0, 1], labels[::-1])
+    cm_ax.set_title(f"Matriz de Confusão (limiar {chosen['threshold']:.2f})", size=15)
+    cm_ax.set_xlabel("Predição", size=13)
+    cm_ax.set_ylabel("Realidade", size=13)
+
+    # 2 -- ROC curve with the decision points
+    roc_ax.plot(
+        curves["fpr"],
+        curves["recall"],
+        color="green",
+        lw=1,
+        label=f"ROC curve (area = {report['roc_auc']:.2f})",
+    )
+    roc_ax.plot([0, 1], [0, 1], lw=1, linestyle="--", color="grey")
+    for name, color in [("default", "blue"), ("best", "red")]:
+        (tn, fp), (fn, tp) = report[name]["confusion_matrix"]
+        roc_ax.plot(
+            fp / max(fp + tn, 1),
+            tp / max(tp + fn, 1),
+            "o",
+            color=color,
+            markersize=8,
+            label=f"Decision Point ({report[name]['threshold']:.2f})",
+        )
+    roc_ax.set_xlim([0.0, 1.0])
+    roc_ax.set_ylim([0.0, 1.05])
+    roc_ax.set_xlabel("False Positive Rate", size=13)
+    roc_ax.set_ylabel("True Positive Rate", size=13)
+    roc_ax.set_title("ROC Curve", size=15)
+    roc_ax.legend(loc="lower right")
+
+    # 3 -- Precision-recall curve
+    pr_ax.plot(
+        curves["recall"],
+        curves["precision"],
+        color="green",
+        lw=1,
+        label=f"AP = {report['average_precision']:.2f}",
+    )
+    pr_ax.plot(best["recall"], best["precision"], "ro", markersize=8, label="Best F1")
+    pr_ax.set_xlim([0.0, 1.0])
+    pr_ax.set_ylim([0.0, 1.05])
+    pr_ax.set_xlabel("Recall", size=13)
+    pr_ax.set_ylabel("Precision", size=13)
+    pr_ax.set_title("Precision-Recall Curve", size=15)
+    pr_ax.legend(loc="lower left")
+
+    figure.tight_layout()
+    return figure
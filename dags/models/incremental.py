@@ -0,0 +1,192 @@
+"""
+Incremental training of the logistic regression
+
+The latest model records how many rows of the equipment data it was trained on, so
+only the rows added since then are read. They are added to the running statistics
+saved with the model, which give the new feature thresholds, medians and scaler,
+and the previous coefficients are refined with a few solver iterations over them.
+
+When the new rows drifted too far from the training data, or the latest model can't
+be refined, the caller should retrain from scratch instead.
+"""
+
+import logging
+import warnings
+
+import numpy as np
+from paeio.path import path_join
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.linear_model import LogisticRegression
+
+from dags import config, metrics
+from dags.data.ingest import read_trusted
+from dags.data.quality import DataProfile, read_profile
+from dags.data.schema import PRESETS, SENSORS, TARGET
+from dags.features.engineering import FEATURES, WARMUP_ROWS, build_features, target
+from dags.models.artifact import (
+    MODELS_FOLDER,
+    latest_model_path,
+    load_model,
+    save_model,
+)
+from dags.models.search import MAX_ITER, RANDOM_STATE
+from dags.storage import blob
+
+logger = logging.getLogger(__name__)
+
+
+def labelled_rows(y):
+    """Number of leading rows with a known label"""
+    return len(y) - 1 if len(y) and np.isnan(y[-1]) else len(y)
+
+
+def _reparametrize(coef, intercept, old, new):
+    """Coefficients giving the same decision function over the `new` scaler inputs"""
+    coef = np.asarray(coef, dtype=np.float64) / old.scaler_scale
+    intercept = np.asarray(intercept, dtype=np.float64) + coef @ (
+        new.scaler_mean - old.scaler_mean
+    )
+    return coef * new.scaler_scale, intercept
+
+
+def _refine(coef, intercept, X, y, params, n_rows):
+    """
+    Warm-started solver iterations from the previous coefficients over new rows.
+
+    Args:
+        coef (np.ndarray): Previous coefficients, of shape (1, n_features).
+        intercept (np.ndarray): Previous intercept, of shape (1,).
+        X (np.ndarray): Scaled features of the new rows.
+        y (np.ndarray): Labels of the new rows.
+        params (dict): Parameters the model was searched with.
+        n_rows (int): Number of rows of the whole training history.
+
+    Returns:
+        tuple: Refined coefficients and intercept.
+    """
+    # liblinear penalizes the intercept as the weight of a constant feature, lbfgs
+    # (the solver that can be warm-started) gets that feature explicitly
+    penalized = params.get("solver") == "liblinear"
+    if penalized:
+        X = np.column_stack((X, np.ones(len(X))))
+        coef = np.column_stack((coef, intercept))
+
+    # The penalty is weighed against the loss of every training row, so C is scaled
+    # for the new rows to stand in for the whole history
+    refiner = LogisticRegression(
+        C=params.get("C", 1.0) * n_rows / len(y),
+        class_weight=params.get("class_weight"),
+        solver="lbfgs",
+        fit_intercept=not penalized,
+        warm_start=True,
+        max_iter=config.INCREMENTAL_MAX_ITER,
+        random_state=RANDOM_STATE,
+    )
+    refiner.coef_, refiner.intercept_ = coef, intercept
+
+    # A few iterations from the previous optimum, not a fit to the new rows alone
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        with metrics.span("train.refine", "fit"):
+            refiner.fit(X, y)
+
+    if penalized:
+        return refiner.coef_[:, :-1], refiner.coef_[:, -1]
+    return refiner.coef_, refiner.intercept_
+
+
+def update_model(folder=MODELS_FOLDER):
+    """
+    Refines the latest model with the rows added since it was trained.
+
+    Returns:
+        bool: Whether the model is up to date, False when it has to be retrained from
+            scratch.
+    """
+    if not blob.exists(path_join(folder, "LATEST.json")):
+        logger.info("No previous model to refine")
+        return False
+
+    model_path = latest_model_path(folder)
+    artifact = load_model(model_path)
+    online, training = artifact.online, artifact.training
+    if online is None or training is None or artifact.features != FEATURES:
+        logger.info("The latest model can't be refined")
+        return False
+
+    # The rows of a shard added since the last training are preceded by rows of other
+    # shards, so only models over a single series are refined
+    if artifact.state.shard_keys or config.SHARD_KEYS:
+        logger.info("Sharded models are retrained from scratch")
+        return False
+
+    seen, labelled = training["rows"], training["labelled_rows"]
+    start = max(labelled - WARMUP_ROWS, 0)
+    data = read_trusted(columns=[*PRESETS, *SENSORS, TARGET], start=start)
+    rows = start + len(data)
+    if rows < seen:
+        logger.info("The equipment data shrank since the last training")
+        return False
+
+    y = target(data[TARGET])
+    new_labelled = start + labelled_rows(y)
+    if new_labelled == labelled:
+        logger.info("No new rows since the last training")
+        return True
+
+    previous = artifact.state
+    with metrics.span("train.features", "compute"):
+        online.update(data.loc[seen:])
+        X = build_features(data, online.feature_state())
+
+    # Rows whose label was unknown in the last training are only trained on now
+    new = slice(labelled - start, new_labelled - start)
+    X, y = X[new].astype(np.float64), y[new].astype(int)
+
+    shift = np.abs(X.mean(axis=0) - previous.scaler_mean) / previous.scaler_scale
+    if shift.max() > config.DRIFT_THRESHOLD:
+        logger.warning(
+            f"{FEATURES[shift.argmax()]} drifted {shift.max():.2f} standard "
+            f"deviations in {len(y)} new rows, retraining from scratch"
+        )
+        return False
+
+    online.update_moments(X)
+    state = online.feature_state()
+    coef, intercept = _reparametrize(artifact.coef, artifact.intercept, previous, state)
+
+    params = artifact.params
+    if len(np.unique(y)) == len(artifact.classes):
+        coef, intercept = _refine(
+            coef, intercept, state.scale(X), y, params, new_labelled
+        )
+    else:
+        logger.info("New rows have a single class, keeping the coefficients")
+
+    # Saved with the parameters of the search, the next refinement uses them as well
+    model = LogisticRegression(**params, max_iter=MAX_ITER, random_state=RANDOM_STATE)
+    model.coef_, model.intercept_ = coef, intercept
+    model.classes_ = np.array(artifact.classes)
+
+    # The profile of the training data follows the rows added, a model saved without
+    # one stays without until the next full training. The profile without them is
+    # kept as well, to validate these rows against, see dags.data.quality
+    profile = previous = read_profile(model_path)
+    if profile is not None:
+        previous = profile.to_dict()
+        profile = profile.merge(DataProfile().update(data.loc[seen:])).to_dict()
+
+    logger.info(f"Model refined with {len(y)} new rows")
+    path = save_model(
+        model,
+        state,
+        FEATURES,
+        folder,
+        online=online,
+        training={"rows": rows, "labelled_rows": new_labelled},
+        threshold=artifact.threshold,
+        profile=profile,
+        previous_profile=previous,
+    )
+    logger.info(f"Model saved to {path}")
+    return True
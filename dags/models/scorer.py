@@ -0,0 +1,116 @@
+"""
+Scoring of the linear model with NumPy only
+
+Inference only needs the stored coefficients and scaler statistics, so the daily
+task doesn't import scikit-learn at all. Rows are scored in blocks small enough to
+stay in cache, scaling them and applying the linear and logistic functions in one
+go. The operations mirror StandardScaler.transform and LogisticRegression, so the
+labels are the same as the ones of `model.predict` unless the model was saved with a
+decision threshold other than 0.5.
+"""
+
+import numpy as np
+
+# Rows scored at a time. Each block is scaled in a float64 buffer of BLOCK_ROWS rows,
+# so smaller blocks hold less memory and larger ones make fewer NumPy calls; the
+# score stage of `python -m benchmarks run` measures the effect of a change
+BLOCK_ROWS = 16384
+
+
+class LinearScorer:
+    """
+    Binary linear classifier over standardized features.
+
+    Args:
+        coef (np.ndarray): Coefficients, of shape (1, n_features).
+        intercept (np.ndarray): Intercept, of shape (1,).
+        classes (np.ndarray): Negative and positive class labels.
+        mean (np.ndarray): Mean of each feature, subtracted before scoring.
+        scale (np.ndarray): Scale of each feature, dividing it before scoring.
+        threshold (float): Probability from which a row is positive, between 0 and
+            1. Defaults to the 0.5 of `model.predict`.
+    """
+
+    def __init__(self, coef, intercept, classes, mean, scale, threshold=None):
+        self.coef = np.asarray(coef, dtype=np.float64).reshape(1, -1)
+        self.intercept = float(np.asarray(intercept).reshape(-1)[0])
+        self.classes = np.asarray(classes)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.threshold = threshold
+
+        if len(self.classes) != 2:
+            raise ValueError("A binary class problem is required")
+        if threshold is not None and not 0 <= threshold <= 1:
+            raise ValueError(f"The threshold {threshold} isn't a probability")
+
+    @classmethod
+    def from_artifact(cls, artifact, threshold=None):
+        """Scorer of a ModelArtifact, with its threshold unless `threshold` is given"""
+        if threshold is None:
+            threshold = artifact.threshold
+        return cls(
+            coef=artifact.coef,
+            intercept=artifact.intercept,
+            classes=artifact.classes,
+            mean=artifact.arrays["scaler_mean"],
+            scale=artifact.arrays["scaler_scale"],
+            threshold=threshold,
+        )
+
+    def decision_function(self, features):
+        """Signed distance of each row of the raw `features` to the hyperplane"""
+        features = np.asarray(features)
+        decision = np.empty(len(features), dtype=np.float64)
+        block = np.empty(
+            (min(BLOCK_ROWS + 1, len(features)), self.coef.shape[1]), np.float64
+        )
+
+        start = 0
+        while start < len(features):
+            stop = min(start + BLOCK_ROWS, len(features))
+            # A single row goes through a different BLAS routine than a block, so a
+            # lone last row is scored along the previous ones to get the same rounding
+            if stop == len(features) - 1:
+                stop += 1
+
+            scaled = block[: stop - start]
+            scaled[...] = features[start:stop]
+            scaled -= self.mean
+            scaled /= self.scale
+            decision[start:stop] = (scaled @ self.coef.T).ravel()
+            start = stop
+
+        decision += self.intercept
+        return decision
+
+    def _positive(self, decision):
+        if self.threshold is None:
+            return decision > 0
+        # The log-odds of the endpoints are infinite
+        if self.threshold == 0:
+            return np.ones(len(decision), dtype=bool)
+        if self.threshold == 1:
+            return self._logistic(decision) >= 1
+        # Compared in the decision space, avoiding the exponential of every row
+        return decision >= np.log(self.threshold / (1 - self.threshold))
+
+    @staticmethod
+    def _logistic(decision):
+        # exp(-log(1 + exp(-x))), which doesn't overflow for large negative values
+        return np.exp(-np.logaddexp(0, -decision))
+
+    def predict_proba(self, features):
+        positive = self._logistic(self.decision_function(features))
+        return np.column_stack((1 - positive, positive))
+
+    def predict(self, features):
+        return self.classes[
+            self._positive(self.decision_function(features)).view(np.int8)
+        ]
+
+    def score(self, features):
+        """Probability of the positive class and predicted label of each row"""
+        decision = self.decision_function(features)
+        labels = self.classes[self._positive(decision).view(np.int8)]
+        return self._logistic(decision), labels
@@ -1,157 +1,202 @@
+"""
+Training of the failure model
+
+A full training runs as a sequence of stages, each a function of the previous ones'
+results: load_data, build_training_set, search, fit, evaluate_model and save. The
+benchmarks time the same functions one by one, see benchmarks.stages.
+"""
+
 import logging
-import pickle
-import tempfile
-from io import BytesIO
+from dataclasses import dataclass
 
 import numpy as np
-from paeio import io
-from paeio.path import path_join
-from sklearn.linear_model import LogisticRegressionCV
-from sklearn.metrics import confusion_matrix
-from sklearn.model_selection import GridSearchCV, train_test_split
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 
-from dags import config
+from dags import config, metrics
+from dags.data.ingest import read_trusted
+from dags.data.quality import DataProfile
+from dags.data.schema import PRESETS, SENSORS, TARGET
+from dags.features.engineering import FEATURES, fit_state
+from dags.features.online import OnlineStatistics
+from dags.features.sharding import labelled_features
+from dags.models.artifact import save_model
+from dags.models.evaluation import evaluate
+from dags.models.incremental import labelled_rows, update_model
+from dags.models.search import MAX_ITER, RANDOM_STATE, halving_search
 
 logger = logging.getLogger(__name__)
 
+# Fraction of the labelled rows held out to evaluate the model, and fraction of the
+# remaining ones held out to choose its decision threshold
+TEST_SIZE = 0.2
+VALIDATION_SIZE = 0.2
+
+
+@dataclass
+class TrainingSet:
+    """Scaled features and labels of the labelled rows, with their statistics"""
+
+    X_train: np.ndarray
+    y_train: np.ndarray
+    X_val: np.ndarray
+    y_val: np.ndarray
+    X_test: np.ndarray
+    y_test: np.ndarray
+    state: object
+    scaler: StandardScaler
+    online: OnlineStatistics
+    profile: DataProfile
+    training: dict
+
+
+def load_data():
+    """Raw equipment data of the whole history"""
+    return read_trusted(columns=[*PRESETS, *SENSORS, TARGET])
+
+
+def build_training_set(equip_data):
+    """
+    Builds the features of the raw data and splits them into train, validation and
+    test rows, scaled in float64.
+
+    The raw data is released once the statistics of it are taken, so the caller
+    shouldn't keep a reference to `equip_data`.
+
+    Returns:
+        TrainingSet: Features and statistics of the data.
+    """
+    with metrics.span("train.features", "compute"):
+        state = fit_state(equip_data, SENSORS)
+        state.shard_keys = config.SHARD_KEYS
+        X, y = labelled_features(equip_data, state)
+
+    # Running statistics the next incremental trainings start from. The raw data
+    # isn't needed past them, so it is released before the features are split
+    with metrics.span("train.online_statistics", "compute"):
+        online = OnlineStatistics(state.sensors).update(equip_data)
+    # Reference the new rows are validated against, see dags.data.quality
+    with metrics.span("train.profile", "compute"):
+        profile = DataProfile().update(equip_data)
+    n_rows = len(equip_data)
+    del equip_data
+
+    # The label of the last row is unknown when the equipment isn't failing yet
+    n_labelled = labelled_rows(y)
+    labelled = ~np.isnan(y)
+    X, y = X[labelled], y[labelled].astype(int)
 
-def save_pickle(model, path):
-    with tempfile.NamedTemporaryFile() as tfile:
-        pickle.dump(model, open(tfile.name, "wb"))
-        model_file = open(tfile.name, "rb")
-        byte_stream = BytesIO()
-        byte_stream.write(model_file.read())
-        io.to_any(byte_stream, path)
-
-
-def train_model():
-    equip_data = io.read_excel(
-        path_join(config.INPUT_FOLDER, "O_G_Equipment_Data.xlsx")
-    )
-    equip_data["Fail"] = equip_data["Fail"].replace({False: 0, True: 1})
-
-    # Segregating the continous variables, it will be useful for EDA
-    continuous_variables = equip_data.select_dtypes(float).columns
-
-    # We want to PREDICT failures in the equipment, not classify fails,
-    # so we need to predict before it happens
-    equip_data["Verge_of_failing"] = equip_data["Fail"].shift(-1)
-
-    features_df = equip_data.copy()
-
-    # Also when we know the equipment is failing we should mark as it is about to fail,
-    # because if no one comes to fix it, the expectation is that it will keep failing
-    features_df["Verge_of_failing"] = np.where(
-        (features_df["Fail"] == 1) & (features_df["Verge_of_failing"] != 1),
-        1,
-        features_df["Verge_of_failing"],
-    )
-
-    # Focus on variables that combine the effect of multiple variables at high values
-    features_df["Sum_of_variables"] = features_df[continuous_variables].sum(axis=1)
-    features_df["Diff_Sum_of_variables"] = features_df["Sum_of_variables"].diff()
-    features_df["Diff_acum_Sum_of_variables"] = (
-        features_df["Diff_Sum_of_variables"].rolling(4, min_periods=2).sum()
-    )
-
-    # Mean avg should be a useful feature if there's a trend pre-fail
-    # Rolling std of sum of variables should be a useful feature if variance
-    # starts to grow pre-fail
-    features_df["Sum_of_variables_MA"] = (
-        features_df["Sum_of_variables"].rolling(4, min_periods=2).mean()
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=TEST_SIZE, random_state=42
     )
-    features_df["Sum_of_variables_std"] = (
-        features_df["Sum_of_variables"].rolling(3, min_periods=2).std()
+    del X, y
+    X_train, X_val, y_train, y_val = train_test_split(
+        X_train, y_train, test_size=VALIDATION_SIZE, random_state=42
     )
 
-    features_df["Median_Sum_of_variables"] = features_df["Sum_of_variables"].median()
-    features_df["Diff_Median_Sum_of_variables"] = (
-        features_df["Sum_of_variables"] - features_df["Median_Sum_of_variables"]
+    # The model is fitted in float64, the precision LinearScorer works with. The
+    # float64 copies are scaled in place
+    X_train = X_train.astype(np.float64)
+    with metrics.span("train.online_statistics", "compute"):
+        online.update_moments(X_train)
+    scaler = StandardScaler(copy=False)
+    X_train = scaler.fit_transform(X_train)
+    X_val = scaler.transform(X_val.astype(np.float64))
+    X_test = scaler.transform(X_test.astype(np.float64))
+    state.scaler_mean, state.scaler_scale = scaler.mean_, scaler.scale_
+
+    return TrainingSet(
+        X_train=X_train,
+        y_train=y_train,
+        X_val=X_val,
+        y_val=y_val,
+        X_test=X_test,
+        y_test=y_test,
+        state=state,
+        scaler=scaler,
+        online=online,
+        profile=profile,
+        training={"rows": n_rows, "labelled_rows": n_labelled},
     )
 
-    # Per combination of presets
-    features_df["Median_Sum_of_variables_Preset"] = features_df.groupby(
-        ["Preset_1", "Preset_2"]
-    )["Sum_of_variables"].transform("median")
-    features_df["Diff_Median_Sum_of_variables_Preset"] = (
-        features_df["Sum_of_variables"] - features_df["Median_Sum_of_variables_Preset"]
-    )
 
-    # Max value of a feature might be useful, although we know individual higher values
-    # don't necessarily result in failure
-    features_df["Max_value_among_feat"] = np.max(
-        features_df[continuous_variables], axis=1
+def search(data, time_budget=None):
+    """Parameters of the logistic regression with the best F1 on the train rows"""
+    with metrics.span("train.search", "fit"):
+        best_params, _ = halving_search(
+            data.X_train, data.y_train, time_budget=time_budget
+        )
+    logger.info(f"Best parameters: {best_params}")
+    return best_params
+
+
+def fit(data, params):
+    """Logistic regression with `params` fitted on the train rows"""
+    with metrics.span("train.fit", "fit"):
+        model = LogisticRegression(
+            **params, max_iter=MAX_ITER, random_state=RANDOM_STATE
+        ).fit(data.X_train, data.y_train)
+    metrics.count("rows_fitted", len(data.y_train))
+    return model
+
+
+def evaluate_model(data, model):
+    """
+    Chooses the decision threshold of `model` on the validation rows and evaluates
+    it on the test rows, which play no part in the choice.
+
+    Returns:
+        dict: Evaluation report of the test rows, see dags.models.evaluation.evaluate,
+            with their scores at the chosen threshold as "default" and the scores of
+            the validation rows at it as "validation". The "best" threshold of the
+            test rows is only there for reference, its scores are optimistic.
+    """
+    with metrics.span("train.evaluate", "compute"):
+        positive = list(model.classes_).index(1)
+        validation = evaluate(data.y_val, model.predict_proba(data.X_val)[:, positive])
+        threshold = validation["best"]["threshold"]
+        report = evaluate(
+            data.y_test, model.predict_proba(data.X_test)[:, positive], threshold
+        )
+    report["validation"] = validation["best"]
+
+    chosen = report["default"]
+    logger.info(
+        f"Threshold: {threshold:.4f} (F1 {validation['best']['f1']:.4f} on the "
+        f"validation rows)\n Precision: {chosen['precision']}\n Recall: "
+        f"{chosen['recall']}\n F1 Score: {chosen['f1']}\n ROC AUC: {report['roc_auc']}"
     )
-    features_df["Std_equip_features"] = np.std(
-        features_df[continuous_variables], axis=1
+    return report
+
+
+def save(data, model, report):
+    """Saves the model with its statistics and evaluation, returns its path"""
+    path = save_model(
+        model,
+        data.state,
+        FEATURES,
+        online=data.online,
+        training=data.training,
+        threshold=report["default"]["threshold"],
+        evaluation=report,
+        profile=data.profile.to_dict(),
     )
+    logger.info(f"Model saved to {path}")
+    return path
 
-    # Using the sum of equip features that are above their 85th percentile
-    for col in continuous_variables:
-        features_df[f"FLAG_{col}"] = features_df[col] >= equip_data[col].quantile(0.85)
-    features_df["N_equip_feats_abv_85_pct"] = np.sum(
-        features_df[features_df.columns[features_df.columns.str.contains("FLAG")]],
-        axis=1,
-    )
 
-    features = [
-        "Sum_of_variables",
-        "Sum_of_variables_MA",
-        "N_equip_feats_abv_85_pct",
-        "Max_value_among_feat",
-        "Sum_of_variables_std",
-        "Diff_Median_Sum_of_variables_Preset",
-        "Diff_Median_Sum_of_variables",
-    ]
-
-    X = features_df[features]
-    # filling NA values with -1 because it's the first value and we know it's not a fail
-    X[["Sum_of_variables_MA", "Sum_of_variables_std"]] = X[
-        ["Sum_of_variables_MA", "Sum_of_variables_std"]
-    ].fillna(-1)
-    y = features_df["Verge_of_failing"]
+def train_model(mode=config.TRAIN_MODE):
+    """
+    Trains the failure model.
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
+    Args:
+        mode (str): "incremental" refines the latest model with the new rows when it
+            can, "full" always retrains on the whole history.
+    """
+    if mode == "incremental" and update_model():
+        return
 
-    scaler = StandardScaler()
-    X_train_lr = scaler.fit_transform(X_train)
-    X_test_lr = scaler.transform(X_test)
-
-    lr_model = LogisticRegressionCV(
-        solver="liblinear", cv=2, random_state=42, n_jobs=-1
-    ).fit(X_train_lr, y_train)
-
-    weights = np.linspace(0, 0.75, 4)
-    lr_param_grid = {
-        "solver": ["liblinear", "lbfgs"],
-        "Cs": [1, 10, 100],
-        "class_weight": [{0: x, 1: 1 - x} for x in weights],
-    }
-    grid_lr = GridSearchCV(lr_model, lr_param_grid, scoring="f1", cv=2, n_jobs=-1).fit(
-        X_train_lr, y_train
-    )
-    grid_lr.best_params_
-
-    grid_lr_model = LogisticRegressionCV(
-        solver=grid_lr.best_params_["solver"],
-        Cs=grid_lr.best_params_["Cs"],
-        class_weight=grid_lr.best_params_["class_weight"],
-        cv=2,
-        random_state=42,
-        n_jobs=-1,
-    ).fit(X_train_lr, y_train)
-
-    cm = confusion_matrix(y_test, grid_lr_model.predict(X_test_lr))
-    tn, fp, fn, tp = [i for i in cm.ravel()]
-    precision = tp / (tp + fp)
-    recall = tp / (tp + fn)
-    F1 = 2 * (precision * recall) / (precision + recall)
-
-    logger.info(f"Precision: {precision}\n Recall: {recall}\n F1 Score: {F1}")
-
-    save_pickle(
-        grid_lr_model, path_join(config.REFINED_FOLDER, "project1/models/model.pkl")
-    )
+    data = build_training_set(load_data())
+    model = fit(data, search(data, time_budget=config.SEARCH_TIME_BUDGET))
+    save(data, model, evaluate_model(data, model))
@@ -1,16 +1,9 @@
-import matplotlib.pyplot as plt
-import pandas as pd
-import seaborn as sns
-from sklearn.metrics import auc, confusion_matrix, roc_curve
+from dags.models.evaluation import evaluate, plot_report
 
 
-def evalBinaryClassifier(model, x, y, labels=["Positives", "Negatives"]):
+def evalBinaryClassifier(model, x, y, labels=["Positives", "Negatives"], show=False):
     """
-    Visualize the performance of  a Logistic Regression Binary Classifier.
-
-    Displays a labelled Confusion Matrix, distributions of the predicted
-    probabilities for both classes, the ROC curve, and F1 score of a fitted
-    Binary Logistic Classifier. Author: gregcondit.com/articles/logr-charts
+    Evaluates a fitted binary classifier, see dags.models.evaluation.evaluate.
 
     Parameters
     ----------
@@ -28,104 +21,32 @@ def evalBinaryClassifier(model, x, y, labels=["Positives", "Negatives"]):
     labels: list, optional
         list of text labels for the two classes, with the positive label first
 
-    Displays
-    ----------
-    3 Subplots
+    show: bool, optional
+        whether to plot the report and show the figure, importing matplotlib. Off by
+        default, the Batch nodes have no display
 
     Returns
     ----------
     F1: float
+        F1 score of `model.predict`, at the 0.5 threshold. The full report is
+        returned by dags.models.evaluation.evaluate
     """
-    # model predicts probabilities of positive class
-    p = model.predict_proba(x)
     if len(model.classes_) != 2:
         raise ValueError("A binary class problem is required")
-    if model.classes_[1] == 1:
-        pos_p = p[:, 1]
-    elif model.classes_[0] == 1:
-        pos_p = p[:, 0]
-
-    # FIGURE
-    plt.figure(figsize=[20, 5])
-
-    # 1 -- Confusion matrix
-    cm = confusion_matrix(y, model.predict(x))
-    plt.subplot(131)
-    ax = sns.heatmap(
-        cm, annot=True, cmap="Blues", cbar=False, annot_kws={"size": 14}, fmt="g"
-    )
-    cmlabels = [
-        "True Negatives",
-        "False Positives",
-        "False Negatives",
-        "True Positives",
-    ]
-    for i, t in enumerate(ax.texts):
-        t.set_text(t.get_text() + "\n" + cmlabels[i])
-    plt.title("Matriz de Confusão", size=15)
-    plt.xlabel("Predição", size=13)
-    plt.ylabel("Realidade", size=13)
+    positive = list(model.classes_).index(1)
+    report = evaluate(y, model.predict_proba(x)[:, positive])
 
-    # 2 -- Distributions of Predicted Probabilities of both classes
-    df = pd.DataFrame({"probPos": pos_p, "target": y})
-    plt.subplot(132)
-    plt.hist(
-        df[df.target == 1].probPos,
-        density=True,
-        bins=25,
-        alpha=0.5,
-        color="green",
-        label=labels[0],
-    )
-    plt.hist(
-        df[df.target == 0].probPos,
-        density=True,
-        bins=25,
-        alpha=0.5,
-        color="red",
-        label=labels[1],
-    )
-    plt.axvline(0.5, color="blue", linestyle="--", label="Limiar(50%)")
-    plt.xlim([0, 1])
-    plt.title("Distribuição das Predições", size=15)
-    plt.xlabel("Probabilidade (predição)", size=13)
-    plt.ylabel("Amostras", size=13)
-    plt.legend(loc="upper right")
+    if show:
+        import matplotlib.pyplot as plt
 
-    # 3 -- ROC curve with annotated decision point
-    fp_rates, tp_rates, _ = roc_curve(y, p[:, 1])
-    roc_auc = auc(fp_rates, tp_rates)
-    plt.subplot(133)
-    plt.plot(
-        fp_rates,
-        tp_rates,
-        color="green",
-        lw=1,
-        label="ROC curve (area = %0.2f)" % roc_auc,
-    )
-    plt.plot([0, 1], [0, 1], lw=1, linestyle="--", color="grey")
-    # plot current decision point:
-    tn, fp, fn, tp = [i for i in cm.ravel()]
-    plt.plot(fp / (fp + tn), tp / (tp + fn), "bo", markersize=8, label="Decision Point")
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel("False Positive Rate", size=13)
-    plt.ylabel("True Positive Rate", size=13)
-    plt.title("ROC Curve", size=15)
-    plt.legend(loc="lower right")
-    plt.subplots_adjust(wspace=0.3)
-    plt.tight_layout()
-    plt.show()
-    # Print and Return the F1 score
-    tn, fp, fn, tp = [i for i in cm.ravel()]
-    precision = tp / (tp + fp)
-    recall = tp / (tp + fn)
-    F1 = 2 * (precision * recall) / (precision + recall)
+        plot_report(report, labels)
+        plt.show()
 
+    default = report["default"]
     print(
-        f"Precision: {round(precision, 2)} | "
-        f"Recall: {round(recall, 2)} | "
-        f"F1 Score: {round(F1, 2)} | "
-        f"AUC Score: {round(roc_auc, 2)} | "
+        f"Precision: {round(default['precision'], 2)} | "
+        f"Recall: {round(default['recall'], 2)} | "
+        f"F1 Score: {round(default['f1'], 2)} | "
+        f"AUC Score: {round(report['roc_auc'], 2)} | "
     )
-    return F1
+    return default["f1"]
@@ -0,0 +1,42 @@
+"""
+Paths of the blobs the DAG tasks exchange
+
+Kept apart from the modules reading and writing them, which import pandas and the
+Azure SDK, so the DAG modules can declare the inputs and outputs of their tasks
+without importing either.
+"""
+
+from dags import config
+
+EQUIPMENT_DATA = "O_G_Equipment_Data.xlsx"
+
+MODELS_FOLDER = f"{config.REFINED_FOLDER}/project1/models"
+LATEST_MODEL = f"{MODELS_FOLDER}/LATEST.json"
+RESULTS_FOLDER = f"{config.REFINED_FOLDER}/project1/results"
+PREDICTIONS_WATERMARK = f"{RESULTS_FOLDER}/_watermark.json"
+QUALITY_FOLDER = f"{config.REFINED_FOLDER}/project1/quality"
+MANIFESTS_FOLDER = f"{config.REFINED_FOLDER}/_manifests"
+METRICS_FOLDER = f"{config.LOGS_FOLDER}/metrics"
+
+
+def input_path(name):
+    return f"{config.INPUT_FOLDER}/{name}"
+
+
+def trusted_path(name):
+    return f"{config.TRUSTED_FOLDER}/project1/{name.rsplit('.', 1)[0]}.parquet"
+
+
+def predictions_path(date):
+    """Predictions of the rows scored on `date`, a YYYY-MM-DD string"""
+    return f"{RESULTS_FOLDER}/date={date}/predictions.parquet"
+
+
+def success_path(date):
+    """Marker of the complete partition of `date`, written after its predictions"""
+    return f"{RESULTS_FOLDER}/date={date}/_SUCCESS"
+
+
+def quality_report_path(dag, date):
+    """Report of the validation of the new rows of `dag` on `date`"""
+    return f"{QUALITY_FOLDER}/{dag}/date={date}/report.json"
@@ -1,15 +1,61 @@
-from dags.visualization.inference import predictions
+from dags import config
+from dags.memo import memoize
+from dags.paths import (
+    EQUIPMENT_DATA,
+    LATEST_MODEL,
+    PREDICTIONS_WATERMARK,
+    input_path,
+    quality_report_path,
+    trusted_path,
+)
+from dags.runner import backfill, task
 
 
-def run_dag(task):
-    from dags.runner import run_task
+@task
+@memoize(inputs=[input_path(EQUIPMENT_DATA)], outputs=[trusted_path(EQUIPMENT_DATA)])
+def ingest():
+    from dags.data.ingest import ingest as ingest_inputs
 
-    run_task(task)
+    ingest_inputs()
 
 
+@task
+@memoize(
+    inputs=[trusted_path(EQUIPMENT_DATA), LATEST_MODEL, PREDICTIONS_WATERMARK],
+    outputs=[quality_report_path("pipeline_daily", config.TODAY)],
+    params={
+        "max_null_fraction": config.MAX_NULL_FRACTION,
+        "drift": [
+            config.DRIFT_THRESHOLD,
+            config.DRIFT_KS_THRESHOLD,
+            config.DRIFT_PSI_THRESHOLD,
+        ],
+        "fail_on_drift": config.FAIL_ON_DRIFT,
+    },
+)
+def validate():
+    from dags.data.quality import validate as validate_rows
+    from dags.visualization.inference import read_watermark
+
+    validate_rows("pipeline_daily", read_watermark()["rows"])
+
+
+@task
+@memoize(
+    inputs=[trusted_path(EQUIPMENT_DATA), LATEST_MODEL], outputs=[PREDICTIONS_WATERMARK]
+)
 def predict():
+    from dags.visualization.inference import predictions
+
     predictions()
 
 
+@backfill
+def predict_partitions(dates, workers=None, force=False):
+    from dags.visualization.backfill import backfill_predictions
+
+    return backfill_predictions(dates, workers=workers, force=force)
+
+
 if __name__ == "__main__":
     predict()
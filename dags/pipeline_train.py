@@ -1,13 +1,53 @@
-from dags.models.train import train_model
+from dags import config
+from dags.memo import memoize
+from dags.paths import (
+    EQUIPMENT_DATA,
+    LATEST_MODEL,
+    input_path,
+    quality_report_path,
+    trusted_path,
+)
+from dags.runner import task
 
 
-def run_dag(task):
-    from dags.runner import run_task
+@task
+@memoize(inputs=[input_path(EQUIPMENT_DATA)], outputs=[trusted_path(EQUIPMENT_DATA)])
+def ingest():
+    from dags.data.ingest import ingest as ingest_inputs
 
-    run_task(task)
+    ingest_inputs()
 
 
+@task
+@memoize(
+    inputs=[trusted_path(EQUIPMENT_DATA), LATEST_MODEL],
+    outputs=[quality_report_path("pipeline_train", config.TODAY)],
+    params={
+        "max_null_fraction": config.MAX_NULL_FRACTION,
+        "drift": [
+            config.DRIFT_THRESHOLD,
+            config.DRIFT_KS_THRESHOLD,
+            config.DRIFT_PSI_THRESHOLD,
+        ],
+        "fail_on_drift": config.FAIL_ON_DRIFT,
+    },
+)
+def validate():
+    from dags.data.quality import trained_rows
+    from dags.data.quality import validate as validate_rows
+
+    validate_rows("pipeline_train", trained_rows())
+
+
+@task
+@memoize(
+    inputs=[trusted_path(EQUIPMENT_DATA)],
+    outputs=[LATEST_MODEL],
+    params={"mode": config.TRAIN_MODE, "shard_keys": config.SHARD_KEYS},
+)
 def train():
+    from dags.models.train import train_model
+
     train_model()
 
 
@@ -1,11 +1,95 @@
-import inspect
+"""
+Registry and runner of the DAG tasks
 
+The DAG modules register their tasks with the `task` decorator and keep the imports
+of the task bodies inside them, so importing a DAG to run one of its tasks doesn't
+import what the other tasks need. Each task runs inside dags.metrics.instrument.
+The inputs a task declares with dags.memo.memoize are prefetched as it starts, and its
+background uploads waited for before its manifest is recorded.
 
-def run_task(task):
-    prev = inspect.currentframe().f_back
+A DAG with a task writing date partitions also registers, with `backfill`, the
+function rewriting the partitions of a list of dates.
+"""
+
+import importlib
+import logging
+
+from dags import metrics
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+BACKFILLS = {}
+
+
+def task(func):
+    """Registers a function of a DAG module as a task of the DAG"""
+    dag = func.__module__.rsplit(".", 1)[-1]
+    TASKS.setdefault(dag, {})[func.__name__] = func
+    return func
+
+
+def backfill(func):
+    """
+    Registers the function rewriting the partitions of a DAG, called with the dates
+    of the partitions, the number of workers and whether to rewrite the complete ones.
+    It returns the dates that failed.
+    """
+    dag = func.__module__.rsplit(".", 1)[-1]
+    BACKFILLS[dag] = func
+    return func
+
+
+def get_tasks(dag):
+    """Tasks of a DAG, by name"""
+    importlib.import_module(f"dags.{dag}")
+    return TASKS.get(dag, {})
+
+
+def run_task(dag, task, force=False):
     try:
-        func = prev.f_globals[task]
+        func = get_tasks(dag)[task]
     except KeyError:
         raise Exception(f"Task {task} not found in DAG.")
     else:
-        func()
+        from dags.storage.cache import get_cache
+
+        with metrics.instrument(dag, task) as task_metrics:
+            try:
+                # Tasks declared with dags.memo.memoize are skipped when up to date
+                memo = getattr(func, "memo", None)
+                key = memo.key(dag, task) if memo else None
+                if key and not force and memo.is_fresh(dag, task, key):
+                    logger.info(f"{dag} {task} is up to date, skipping it")
+                    task_metrics.status = "skipped"
+                    return
+
+                from dags.storage import transfer
+
+                if memo:
+                    get_cache().prefetch(memo.inputs)
+                func()
+                transfer.wait_uploads()
+                if key:
+                    memo.record(dag, task, key)
+            finally:
+                get_cache().log_stats()
+
+
+def run_backfill(dag, dates, workers=None, force=False):
+    """
+    Rewrites the partitions of `dates` of a DAG.
+
+    Returns:
+        list: Dates of the partitions that failed.
+    """
+    get_tasks(dag)
+    if dag not in BACKFILLS:
+        raise Exception(f"DAG {dag} has no partitions to backfill.")
+
+    with metrics.instrument(dag, "backfill") as task_metrics:
+        failed = BACKFILLS[dag](dates, workers=workers, force=force)
+        metrics.count("partitions_failed", len(failed))
+        if failed:
+            task_metrics.status = "failed"
+        return failed
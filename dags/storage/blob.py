@@ -0,0 +1,201 @@
+"""
+Access to the files in the storage account
+
+paeio covers the usual reads and writes, here we add what the DAG code needs on top
+of it: the properties that tell whether a file changed without downloading it, and
+streaming downloads straight into a local file.
+
+Setting LOCAL_BLOB_ROOT replaces the storage account with a local folder, where
+`abfs://<account>.dfs.core.windows.net/<container>/<path>` is stored as
+`<LOCAL_BLOB_ROOT>/<account>.dfs.core.windows.net/<container>/<path>`. It lets the
+DAGs run offline, with LOCAL_BLOB_LATENCY and LOCAL_BLOB_BANDWIDTH slowing each
+request down like the network would.
+
+Every request holds one of the BLOB_CONCURRENCY slots while it runs, whichever thread
+makes it, see dags.storage.transfer.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from paeio import io
+
+from dags import config, metrics
+
+BlobInfo = namedtuple("BlobInfo", ["etag", "size", "last_modified"])
+
+_slots = threading.BoundedSemaphore(config.BLOB_CONCURRENCY)
+
+
+@contextmanager
+def _request(size=0, streams=1):
+    """Holds a slot for a request transferring `size` bytes over `streams` connections"""
+    with _slots:
+        if config.LOCAL_BLOB_ROOT:
+            delay = config.LOCAL_BLOB_LATENCY
+            if config.LOCAL_BLOB_BANDWIDTH:
+                delay += size / config.LOCAL_BLOB_BANDWIDTH / streams
+            time.sleep(delay)
+        yield
+
+
+def local_path(uri):
+    """Path of `uri` in the local stand-in of the storage account"""
+    return os.path.join(config.LOCAL_BLOB_ROOT, uri.split("://", 1)[1])
+
+
+@contextmanager
+def _file_client(uri, conn_type=io.DEFAULT_BLOB_SERVICE):
+    service_client = io.create_blob_service(uri, conn_type=conn_type)
+    container_name = uri.split("/")[3]
+    blob_name = "/".join(uri.split("/")[4:])
+
+    if conn_type == "gen2":
+        container_client = service_client.get_file_system_client(
+            file_system=container_name
+        )
+        file_client = container_client.get_file_client(blob_name)
+    elif conn_type == "blob":
+        container_client = service_client.get_container_client(container_name)
+        file_client = container_client.get_blob_client(blob_name)
+
+    try:
+        yield file_client
+    finally:
+        file_client.close()
+        container_client.close()
+        service_client.close()
+
+
+def exists(uri, conn_type=io.DEFAULT_BLOB_SERVICE):
+    if config.LOCAL_BLOB_ROOT:
+        with _request():
+            return os.path.isfile(local_path(uri))
+
+    with _request(), _file_client(uri, conn_type) as file_client:
+        return file_client.exists()
+
+
+def stat(uri, conn_type=io.DEFAULT_BLOB_SERVICE):
+    """ETag, size in bytes and last modification time of a file"""
+    if config.LOCAL_BLOB_ROOT:
+        with _request():
+            st = os.stat(local_path(uri))
+        return BlobInfo(
+            etag=f"0x{st.st_mtime_ns:X}{st.st_size:X}",
+            size=st.st_size,
+            last_modified=str(st.st_mtime),
+        )
+
+    with metrics.span("blob.stat", "io"), _request():
+        with _file_client(uri, conn_type) as file_client:
+            if conn_type == "gen2":
+                properties = file_client.get_file_properties()
+            elif conn_type == "blob":
+                properties = file_client.get_blob_properties()
+
+    return BlobInfo(
+        etag=properties.etag.strip('"'),
+        size=properties.size,
+        last_modified=properties.last_modified.isoformat(),
+    )
+
+
+def download(uri, file_obj, conn_type=io.DEFAULT_BLOB_SERVICE):
+    """Streams the content of `uri` into the binary `file_obj`"""
+    start = file_obj.tell()
+    with metrics.span("blob.download", "io"):
+        if config.LOCAL_BLOB_ROOT:
+            path = local_path(uri)
+            with _request(os.path.getsize(path)), open(path, "rb") as source:
+                shutil.copyfileobj(source, file_obj)
+        else:
+            with _request(), _file_client(uri, conn_type) as file_client:
+                if conn_type == "gen2":
+                    file_client.download_file().readinto(file_obj)
+                elif conn_type == "blob":
+                    file_client.download_blob().readinto(file_obj)
+    metrics.count("bytes_downloaded", file_obj.tell() - start)
+
+
+@contextmanager
+def range_reader(uri, etag=None, conn_type=io.DEFAULT_BLOB_SERVICE):
+    """
+    Reads ranges of `uri` through a single client, from any number of threads.
+
+    Args:
+        etag (str): ETag of the version of the file to read, the reads fail once it
+            changes.
+
+    Yields:
+        function: Reads `length` bytes from `offset`, returning them.
+    """
+    if config.LOCAL_BLOB_ROOT:
+        fd = os.open(local_path(uri), os.O_RDONLY)
+
+        def read(offset, length):
+            with _request(length):
+                data = os.pread(fd, length, offset)
+            metrics.count("bytes_downloaded", len(data))
+            return data
+
+        try:
+            yield read
+        finally:
+            os.close(fd)
+        return
+
+    conditions = {}
+    if etag is not None:
+        from azure.core import MatchConditions
+
+        conditions = {
+            "etag": f'"{etag}"',
+            "match_condition": MatchConditions.IfNotModified,
+        }
+
+    with _file_client(uri, conn_type) as file_client:
+        if conn_type == "gen2":
+            download = file_client.download_file
+        elif conn_type == "blob":
+            download = file_client.download_blob
+
+        def read(offset, length):
+            with _request():
+                data = download(offset=offset, length=length, **conditions).readall()
+            metrics.count("bytes_downloaded", len(data))
+            return data
+
+        yield read
+
+
+def to_any(byte_stream, uri, **kwargs):
+    """Writes `byte_stream` to `uri`, see paeio.io.to_any"""
+    position = byte_stream.tell()
+    size = byte_stream.seek(0, os.SEEK_END)
+    metrics.count("bytes_written", size)
+    byte_stream.seek(position)
+    # Large files are uploaded in parallel blocks, within the one slot
+    blocks = -(-size // config.BLOB_RANGE_BYTES)
+    streams = max(min(blocks, config.BLOB_CONCURRENCY), 1)
+    with metrics.span("blob.upload", "io"), _request(size, streams):
+        if not config.LOCAL_BLOB_ROOT:
+            if streams > 1:
+                kwargs.setdefault("max_concurrency", streams)
+            io.to_any(byte_stream, uri, **kwargs)
+            return
+
+        path = local_path(uri)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        byte_stream.seek(0)
+        # Written aside and renamed, so readers never see a partial file
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(path), delete=False
+        ) as tfile:
+            shutil.copyfileobj(byte_stream, tfile)
+        os.replace(tfile.name, path)
@@ -0,0 +1,181 @@
+"""
+Node-local read-through cache of the files in the storage account
+
+Tasks scheduled on the same Batch node share the cache folder, so a warm node reads
+the inputs and the model from local disk instead of downloading them again. Each
+entry is named after the file URI and its ETag: a changed file gets a new entry, and
+entries are only ever written to a temporary name and atomically renamed, so tasks
+running concurrently on a node never see partial or mixed content. Least recently
+used entries are evicted once the folder grows past BLOB_CACHE_MAX_BYTES.
+
+Files can be prefetched into the cache in the background. Opening one that is being
+prefetched waits for its download instead of starting another.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import wait
+
+from dags import config, metrics
+from dags.storage import blob, transfer
+
+logger = logging.getLogger(__name__)
+
+# Downloads that were interrupted leave temporary files behind
+STALE_TMP_SECONDS = 3600
+
+
+class BlobCache:
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._prefetches = {}
+        self._lock = threading.Lock()
+
+    def _entry_path(self, uri, etag):
+        uri_key = hashlib.sha256(uri.encode()).hexdigest()[:32]
+        etag_key = hashlib.sha256(etag.encode()).hexdigest()[:16]
+        return os.path.join(self.folder, f"{uri_key}-{etag_key}")
+
+    def open(self, uri):
+        """Opens the current version of `uri` for binary reading, from the cache"""
+        with self._lock:
+            prefetch = self._prefetches.pop(uri, None)
+        if prefetch is not None:
+            with metrics.span("cache.wait_prefetch", "io"):
+                wait([prefetch])
+        return self._open(uri)
+
+    def _open(self, uri, prefetch=False):
+        info = blob.stat(uri)
+        path = self._entry_path(uri, info.etag)
+
+        try:
+            file_obj = open(path, "rb")
+        except FileNotFoundError:
+            pass
+        else:
+            if os.fstat(file_obj.fileno()).st_size == info.size:
+                # The modification time orders the entries for eviction
+                os.utime(path)
+                if not prefetch:
+                    metrics.count("cache_hits")
+                    metrics.count("cache_bytes_saved", info.size)
+                    metrics.count("bytes_read", info.size)
+                return file_obj
+            file_obj.close()
+
+        os.makedirs(self.folder, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            dir=self.folder, prefix=".", delete=False
+        ) as tfile:
+            try:
+                transfer.download(uri, tfile, info.size, info.etag)
+            except BaseException:
+                os.unlink(tfile.name)
+                raise
+
+        size = os.path.getsize(tfile.name)
+        if size != info.size:
+            os.unlink(tfile.name)
+            raise IOError(f"{uri} changed while being downloaded")
+
+        # Opened before being published, so eviction by another task can't remove it
+        file_obj = open(tfile.name, "rb")
+        os.chmod(tfile.name, 0o644)
+        os.replace(tfile.name, path)
+        metrics.count("cache_bytes_downloaded", size)
+        if prefetch:
+            metrics.count("cache_prefetches")
+        else:
+            metrics.count("cache_misses")
+            metrics.count("bytes_read", size)
+        self.evict(keep=path)
+        return file_obj
+
+    def _prefetch(self, uri):
+        # A missing input fails the task when it opens it, not here
+        try:
+            if blob.exists(uri):
+                self._open(uri, prefetch=True).close()
+        except Exception:
+            logger.warning(f"Couldn't prefetch {uri}", exc_info=True)
+
+    def prefetch(self, uris):
+        """Downloads the files of `uris` missing from the cache, in the background"""
+        with self._lock:
+            for uri in uris:
+                if uri not in self._prefetches or self._prefetches[uri].done():
+                    self._prefetches[uri] = transfer.submit(
+                        "prefetch", self._prefetch, uri
+                    )
+
+    def evict(self, keep=None):
+        """Removes the least recently used entries until the cache fits its size cap"""
+        entries, total = [], 0
+        now = time.time()
+        for entry in os.scandir(self.folder):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if entry.name.startswith("."):
+                if now - st.st_mtime > STALE_TMP_SECONDS:
+                    self._remove(entry.path)
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        # Another task on the node may have evicted it first
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def log_stats():
+        """Logs the use of the cache by the task running, from its counters"""
+        task_metrics = metrics.current()
+        if task_metrics is None:
+            return
+        counters = task_metrics.counters
+        logger.info(
+            f"Blob cache: {counters['cache_hits']} hits, {counters['cache_misses']} "
+            f"misses, {counters['cache_prefetches']} prefetched, "
+            f"{counters['cache_bytes_saved']} bytes saved, "
+            f"{counters['cache_bytes_downloaded']} bytes downloaded"
+        )
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = BlobCache(config.BLOB_CACHE_DIR, config.BLOB_CACHE_MAX_BYTES)
+    return _cache
+
+
+def open_blob(uri):
+    """Opens `uri` for binary reading through the cache"""
+    return get_cache().open(uri)
+
+
+def read_any(uri, func, **kwargs):
+    """Reads `uri` with the reading function `func`, see paeio.io.read_any"""
+    with open_blob(uri) as file_obj, metrics.span(f"read.{func.__name__}", "io"):
+        return func(file_obj, **kwargs)
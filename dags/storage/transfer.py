@@ -0,0 +1,134 @@
+"""
+Concurrent transfers with the storage account
+
+A task used to download its inputs, compute and upload its outputs one after the
+other, the CPU idle while the network works and the other way round. Here the
+transfers overlap with each other and with the compute:
+
+- the runner prefetches the inputs a task declares with dags.memo.memoize into the
+  node cache as the task starts, see BlobCache.prefetch;
+- files larger than BLOB_RANGE_BYTES are downloaded as ranges in parallel;
+- `upload` writes an output in the background, and the runner waits for the uploads
+  of a task before recording its manifest.
+
+The jobs run on thread pools, in a copy of the context of the thread submitting them:
+their counters add up to the metrics of the task, while their time shows in the
+spans of the task waiting on them. Each request holds one of the BLOB_CONCURRENCY
+slots of dags.storage.blob.
+"""
+
+import contextvars
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+from dags import config, metrics
+from dags.storage import blob
+
+logger = logging.getLogger(__name__)
+
+_executors = {}
+_lock = threading.Lock()
+
+# Uploads `wait_uploads` waits for, started by the task running in the context
+_uploads = contextvars.ContextVar("uploads", default=None)
+
+
+def submit(pool, func, *args, **kwargs):
+    """
+    Runs `func` on a thread pool, in the context of the caller.
+
+    Each kind of job has its own pool, "prefetch", "range" or "upload", so a job never
+    waits for one queued behind it.
+
+    Returns:
+        concurrent.futures.Future: Future of the result of `func`.
+    """
+    with _lock:
+        if pool not in _executors:
+            _executors[pool] = ThreadPoolExecutor(
+                max_workers=config.BLOB_CONCURRENCY, thread_name_prefix=f"blob-{pool}"
+            )
+    context = contextvars.copy_context()
+    return _executors[pool].submit(context.run, func, *args, **kwargs)
+
+
+def download(uri, file_obj, size, etag=None):
+    """
+    Streams the content of `uri` into the binary `file_obj`, as parallel ranges of
+    BLOB_RANGE_BYTES when it is larger.
+
+    Args:
+        size (int): Size of the file, in bytes.
+        etag (str): ETag of the file, the download fails if it changes meanwhile.
+    """
+    if size <= config.BLOB_RANGE_BYTES:
+        blob.download(uri, file_obj)
+        return
+
+    start = file_obj.tell()
+    file_obj.flush()
+    fd = file_obj.fileno()
+    with metrics.span("blob.download", "io"), blob.range_reader(uri, etag) as read:
+
+        def fetch(offset):
+            data = read(offset, min(config.BLOB_RANGE_BYTES, size - offset))
+            os.pwrite(fd, data, start + offset)
+
+        futures = [
+            submit("range", fetch, offset)
+            for offset in range(0, size, config.BLOB_RANGE_BYTES)
+        ]
+        _, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in pending:
+            future.cancel()
+        # The ranges still being read write to the file until they are done
+        wait(futures)
+        for future in futures:
+            if not future.cancelled():
+                future.result()
+    file_obj.seek(start + size)
+
+
+def _log_failure(uri):
+    def callback(future):
+        if future.exception() is not None:
+            logger.warning(f"Couldn't upload {uri}: {future.exception()!r}")
+
+    return callback
+
+
+def upload(byte_stream, uri, critical=True, **kwargs):
+    """
+    Writes `byte_stream` to `uri` in the background, see blob.to_any. The stream is
+    the upload's from then on, the caller must not use it.
+
+    Args:
+        critical (bool): Whether `wait_uploads` waits for the upload and raises if it
+            failed. A failed upload that isn't critical is only logged.
+
+    Returns:
+        concurrent.futures.Future: Future of the upload.
+    """
+    future = submit("upload", blob.to_any, byte_stream, uri, **kwargs)
+    if not critical:
+        future.add_done_callback(_log_failure(uri))
+        return future
+
+    uploads = _uploads.get()
+    if uploads is None:
+        uploads = []
+        _uploads.set(uploads)
+    uploads.append(future)
+    return future
+
+
+def wait_uploads():
+    """Waits for the critical uploads started in this context, raising the first error"""
+    uploads = _uploads.get() or []
+    _uploads.set([])
+    with metrics.span("blob.wait_uploads", "io"):
+        wait(uploads)
+    for future in uploads:
+        future.result()
@@ -0,0 +1,181 @@
+"""
+Rescoring of past partitions of the predictions
+
+A backfill rescores the partitions of a range of dates with the latest model, e.g.
+after shipping a new one. The model is loaded and the trusted rows of every partition
+are read once, then written to a local Arrow file the workers memory map, so each one
+only converts the rows of the partition it scores. The workers start from a fork
+server rather than a fork of the task, whose transfer threads may hold locks. Each
+partition is published with its _SUCCESS marker written after its predictions, so an
+interrupted backfill resumes where it stopped and the partitions already scored with
+the model, by the daily run or a previous backfill, are skipped.
+
+The partitions and their rows come from the watermark manifest of the daily run:
+dates that have no partition had no new rows to score, or precede the first daily
+run that recorded its partitions, and can't be backfilled.
+"""
+
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+import pyarrow as pa
+
+from dags import config
+from dags.data.ingest import read_trusted
+from dags.features.engineering import WARMUP_ROWS, tail
+from dags.models.artifact import latest_model_path, load_model
+from dags.models.scorer import LinearScorer
+from dags.paths import predictions_path
+from dags.storage import blob
+from dags.visualization.inference import (
+    is_complete,
+    prediction_columns,
+    read_watermark,
+    write_predictions,
+    write_success,
+)
+
+logger = logging.getLogger(__name__)
+
+# Model of the backfill and memory map of its rows, in each worker
+_shared = {}
+
+
+def _init_worker(settings, model, scorer, state, rows_path, offset):
+    # The workers don't inherit the settings the task may have changed
+    for name, value in settings.items():
+        setattr(config, name, value)
+    # The partitions already keep every core busy, the shards of each are scored in
+    # a single process
+    config.SHARD_WORKERS = 1
+
+    with pa.memory_map(rows_path) as source:
+        rows = pa.ipc.open_file(source).read_all()
+    _shared.update(model=model, scorer=scorer, state=state, rows=rows, offset=offset)
+
+
+def _read_rows(start, stop):
+    """Rows of the trusted table from `start` to `stop` (excluded), from the map"""
+    offset = _shared["offset"]
+    start = max(start, offset)
+    df = _shared["rows"].slice(start - offset, max(stop - start, 0)).to_pandas()
+    df.index = pd.RangeIndex(start, start + len(df))
+    return df
+
+
+def _score_partition(date, start, stop, tails):
+    """Scores the rows of the partition of `date` and marks it complete"""
+    state = _shared["state"]
+    chunksize = config.PREDICT_CHUNKSIZE or max(stop - start, 1)
+    chunks = (
+        _read_rows(begin, min(begin + chunksize, stop))
+        for begin in range(start, stop, chunksize)
+    )
+    history = ()
+    if not state.shard_keys:
+        history = tail(_read_rows(start - WARMUP_ROWS, start), state)
+
+    with tempfile.TemporaryFile() as tfile:
+        write_predictions(
+            chunks, _shared["scorer"], state, tfile, chunksize, history, tails
+        )
+        blob.to_any(tfile, predictions_path(date))
+    write_success(date, _shared["model"], start, stop)
+    return stop - start
+
+
+def _settings():
+    return {name: value for name, value in vars(config).items() if name.isupper()}
+
+
+def backfill_predictions(dates, workers=None, force=False):
+    """
+    Rescores the partitions of `dates` with the latest model.
+
+    Args:
+        dates (list): Dates of the partitions, YYYY-MM-DD strings.
+        workers (int): Number of partitions scored at a time, defaults to the number
+            of cores.
+        force (bool): Whether to rescore the partitions already complete.
+
+    Returns:
+        list: Dates of the partitions that failed.
+    """
+    model = latest_model_path()
+    artifact = load_model(model)
+    scorer, state = LinearScorer.from_artifact(artifact), artifact.state
+
+    watermark = read_watermark()
+    partitions = {
+        date: watermark["partitions"][date]
+        for date in sorted(dates)
+        if date in watermark["partitions"]
+    }
+    logger.info(f"{len(partitions)} partitions among the {len(dates)} dates")
+    missing = sorted(set(dates) - set(partitions))
+    if missing:
+        logger.warning(
+            f"No partition recorded for {len(missing)} dates, from {missing[0]} to "
+            f"{missing[-1]}: they had no new rows, or precede the first daily run "
+            "that recorded its partitions, and can't be backfilled"
+        )
+
+    pending = {
+        date: partition
+        for date, partition in partitions.items()
+        if force or not is_complete(date, model, partition["start"], partition["stop"])
+    }
+    if len(pending) < len(partitions):
+        logger.info(f"Skipping {len(partitions) - len(pending)} complete partitions")
+    if not pending:
+        return []
+
+    # Rows of every partition, and the ones their rolling windows warm up from
+    _, columns = prediction_columns(state)
+    start = min(partition["start"] for partition in pending.values())
+    stop = max(partition["stop"] for partition in pending.values())
+    data = read_trusted(columns=columns, start=max(start - WARMUP_ROWS, 0), stop=stop)
+
+    # The tails of the shards were kept for the shard keys of the daily run's model
+    same_shards = watermark["shard_keys"] == state.shard_keys
+
+    failed = []
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    with tempfile.TemporaryDirectory() as folder:
+        rows_path = os.path.join(folder, "rows.arrow")
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        with pa.OSFile(rows_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        offset = int(data.index[0]) if len(data) else start
+        del data, table
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(_settings(), model, scorer, state, rows_path, offset),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _score_partition,
+                    date,
+                    partition["start"],
+                    partition["stop"],
+                    partition.get("tails", {}) if same_shards else {},
+                ): date
+                for date, partition in pending.items()
+            }
+            for future in as_completed(futures):
+                date = futures[future]
+                if future.exception() is not None:
+                    logger.error(f"Partition {date} failed: {future.exception()!r}")
+                    failed.append(date)
+                else:
+                    logger.info(f"Partition {date} scored, {future.result()} rows")
+    return sorted(failed)
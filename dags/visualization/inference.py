@@ -1,83 +1,320 @@
+"""
+Daily scoring of the equipment data
+
+Each run scores the rows appended to the trusted table since the previous one, and
+writes them to the partition of the day, predictions_path(TODAY). The watermark
+manifest, PREDICTIONS_WATERMARK, records the range of rows of each partition and how
+many rows were scored so far; it is written last, so a run that didn't finish is
+redone. Running again on the same day rescores the partition of the day along with
+the rows added since. A _SUCCESS marker in each partition names the model and rows it
+was scored with, see dags.visualization.backfill.
+
+The rolling features of a row look at the few rows preceding it. A model over a
+single series reads the WARMUP_ROWS rows before the first new one again, while a
+sharded model, whose previous rows of a shard may be anywhere in the table, keeps the
+tail of every shard in the manifest.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from itertools import repeat
+
 import numpy as np
 import pandas as pd
-from paeio import io
-from paeio.path import path_join
+import pyarrow as pa
+import pyarrow.parquet as pq
 
-from dags import config
+from dags import config, metrics
+from dags.data.ingest import ingest, read_trusted_chunks, trusted_rows
+from dags.data.schema import KEYS, PRESETS
+from dags.features.engineering import FEATURES, WARMUP_ROWS, build_features, tail
+from dags.features.sharding import spill_shards
+from dags.models.artifact import latest_model_path, load_model
+from dags.models.scorer import LinearScorer
+from dags.paths import PREDICTIONS_WATERMARK, predictions_path, success_path
+from dags.storage import blob, cache
 
+logger = logging.getLogger(__name__)
 
-def predictions():
-    model = io.read_any(
-        path_join(config.REFINED_FOLDER, "project1/models/model.pkl"),
-        func=pd.read_pickle,
-    )
 
-    features_df = io.read_excel(
-        path_join(config.INPUT_FOLDER, "O_G_Equipment_Data.xlsx")
-    )
-    features_df["Fail"] = features_df["Fail"].replace({False: 0, True: 1})
-    features_df["Verge_of_failing"] = features_df["Fail"].shift(-1)
+def score_chunks(chunks, scorer, state, keys=KEYS, history=()):
+    """
+    Predictions of consecutive chunks of a series, one DataFrame per chunk.
 
-    continuous_variables = features_df.select_dtypes(float).columns
+    Only the `keys` columns of the rows are kept, along with the model features, the
+    probability of failure (PROBA) and the predicted label (PRED). The raw columns of
+    a chunk are released as soon as its features are built. `history` is the tail of
+    the rows preceding the first chunk, see dags.features.engineering.tail, and the
+    generator returns the tail of the rows of the last chunk.
+    """
+    for chunk in chunks:
+        with metrics.span("predict.score_chunk", "compute"):
+            X = build_features(chunk, state, history)
+            history = tail(chunk, state, history)
+            proba, labels = scorer.score(X)
 
-    features_df["Verge_of_failing"] = np.where(
-        (features_df["Fail"] == 1) & (features_df["Verge_of_failing"] != 1),
-        1,
-        features_df["Verge_of_failing"],
-    )
+            scored = pd.DataFrame(
+                {
+                    **{key: np.asarray(chunk[key]) for key in keys},
+                    **dict(zip(FEATURES, X.T)),
+                    "PROBA": proba.astype(np.float32),
+                    "PRED": labels,
+                }
+            )
+        del chunk, X
+        metrics.count("rows_scored", len(scored))
+        yield scored
+    return history
 
-    features_df["Sum_of_variables"] = features_df[continuous_variables].sum(axis=1)
-    features_df["Diff_Sum_of_variables"] = features_df["Sum_of_variables"].diff()
-    features_df["Diff_acum_Sum_of_variables"] = (
-        features_df["Diff_Sum_of_variables"].rolling(4, min_periods=2).sum()
-    )
 
-    features_df["Sum_of_variables_MA"] = (
-        features_df["Sum_of_variables"].rolling(4, min_periods=2).mean()
-    )
-    features_df["Sum_of_variables_std"] = (
-        features_df["Sum_of_variables"].rolling(3, min_periods=2).std()
-    )
+def write_tables(tables, file_obj):
+    """Writes DataFrames or Arrow tables with the same columns to a parquet file"""
+    writer = None
+    try:
+        for table in tables:
+            if not isinstance(table, pa.Table):
+                table = pa.Table.from_pandas(
+                    table,
+                    schema=writer.schema if writer else None,
+                    preserve_index=False,
+                )
+            with metrics.span("predict.write_parquet", "io"):
+                if writer is None:
+                    writer = pq.ParquetWriter(file_obj, table.schema)
+                writer.write_table(table)
+            metrics.count("rows_written", table.num_rows)
+    finally:
+        if writer is not None:
+            writer.close()
 
-    features_df["Median_Sum_of_variables"] = features_df["Sum_of_variables"].median()
-    features_df["Diff_Median_Sum_of_variables"] = (
-        features_df["Sum_of_variables"] - features_df["Median_Sum_of_variables"]
-    )
 
-    features_df["Median_Sum_of_variables_Preset"] = features_df.groupby(
-        ["Preset_1", "Preset_2"]
-    )["Sum_of_variables"].transform("median")
-    features_df["Diff_Median_Sum_of_variables_Preset"] = (
-        features_df["Sum_of_variables"] - features_df["Median_Sum_of_variables_Preset"]
-    )
+def _score_shard(path, scorer, state, chunksize, keys, history):
+    """
+    Scores the rows of a shard file, writing them to a file next to it.
 
-    # Max value of a feature might be useful, although we know individual higher values
-    # don't necessarily result in failure
-    features_df["Max_value_among_feat"] = np.max(
-        features_df[continuous_variables], axis=1
-    )
-    features_df["Std_equip_features"] = np.std(
-        features_df[continuous_variables], axis=1
+    Returns:
+        tuple: Path of the predictions and tail of the rows of the shard.
+    """
+    batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize)
+    chunks = (batch.to_pandas() for batch in batches)
+    tails = [history]
+
+    def scored():
+        # The tail score_chunks returns, once the shard is written
+        tails[0] = yield from score_chunks(chunks, scorer, state, keys, history)
+
+    output = f"{os.path.splitext(path)[0]}.scored.parquet"
+    write_tables(scored(), output)
+    return output, tails[0]
+
+
+def shard_name(key):
+    """Name of the shard of a shard key tuple, e.g. 1,2 for (1, 2)"""
+    return ",".join(map(str, key))
+
+
+def _score_shards(chunks, scorer, state, chunksize, folder, keys, tails):
+    """
+    Predictions of each shard of the table, scored on a process pool.
+
+    The chunks are first split into local files with the rows of each shard, so a
+    worker only holds a chunk of its shard in memory at a time.
+
+    Args:
+        tails (dict): Tail of the rows preceding the chunks of each shard, by shard
+            name.
+
+    Returns:
+        tuple: Record batches of the predictions, and `tails` updated with the rows
+            of the chunks.
+    """
+    shards = spill_shards(chunks, state.shard_keys, folder)
+    names = [shard_name(key) for key, _ in shards]
+    with ProcessPoolExecutor(max_workers=config.SHARD_WORKERS) as executor:
+        outputs = list(
+            executor.map(
+                _score_shard,
+                [path for _, path in shards],
+                repeat(scorer),
+                repeat(state),
+                repeat(chunksize or None),
+                repeat(keys),
+                [tails.get(name, ()) for name in names],
+            )
+        )
+
+    tails = {
+        **tails,
+        **{name: np.asarray(t).tolist() for name, (_, t) in zip(names, outputs)},
+    }
+    batches = (
+        batch
+        for output, _ in outputs
+        for batch in pq.ParquetFile(output).iter_batches()
     )
+    return batches, tails
+
 
-    features_df["N_equip_feats_abv_85_pct"] = np.sum(
-        features_df[features_df.columns[features_df.columns.str.contains("FLAG")]],
-        axis=1,
+def _warmup(state, start, path=None):
+    """Tail of the rows preceding `start` in the trusted table"""
+    history = ()
+    chunks = read_trusted_chunks(
+        columns=state.sensors, start=max(start - WARMUP_ROWS, 0), stop=start, path=path
     )
+    for chunk in chunks:
+        history = tail(chunk, state, history)
+    return history
+
 
-    features = [
-        "Sum_of_variables",
-        "Sum_of_variables_MA",
-        "N_equip_feats_abv_85_pct",
-        "Max_value_among_feat",
-        "Sum_of_variables_std",
-        "Diff_Median_Sum_of_variables_Preset",
-        "Diff_Median_Sum_of_variables",
-    ]
-
-    features_df["PRED"] = model.predict(features_df[features])
-
-    io.to_parquet(
-        features_df,
-        path_join(config.REFINED_FOLDER, "project1/results/predictions.parquet"),
+def prediction_columns(state):
+    """Columns identifying the scored rows, and the columns they are scored from"""
+    keys = list(dict.fromkeys([*KEYS, *state.shard_keys]))
+    return keys, list(dict.fromkeys([*keys, *PRESETS, *state.sensors]))
+
+
+def write_predictions(
+    chunks, scorer, state, file_obj, chunksize=None, history=(), tails=None
+):
+    """
+    Writes the predictions of consecutive chunks of the trusted table.
+
+    Models trained with shard keys are scored shard by shard, and the predictions
+    come out grouped by shard, each one in row order. Each row is identified by the
+    KEYS and shard key columns, see score_chunks.
+
+    Args:
+        chunks (iterable): DataFrames with the prediction_columns of the rows.
+        scorer (LinearScorer): Scorer of the model.
+        state (FeatureState): Feature statistics of the model.
+        file_obj: File the predictions are written to, as parquet.
+        chunksize (int): Maximum number of rows held in memory.
+        history (array-like): Tail of the rows preceding the chunks, for models over
+            a single series.
+        tails (dict): Tail of the rows preceding the chunks of each shard, for
+            sharded models.
+
+    Returns:
+        dict: Tail of the rows up to the last chunk of each shard, empty for models
+            over a single series.
+    """
+    keys, _ = prediction_columns(state)
+    with tempfile.TemporaryDirectory() as folder:
+        if state.shard_keys:
+            batches, tails = _score_shards(
+                chunks, scorer, state, chunksize, folder, keys, tails or {}
+            )
+            tables = (pa.Table.from_batches([batch]) for batch in batches)
+        else:
+            tables, tails = score_chunks(chunks, scorer, state, keys, history), {}
+        write_tables(tables, file_obj)
+    return tails
+
+
+def score_rows(
+    scorer, state, start, stop, file_obj, chunksize=None, tails=None, path=None
+):
+    """
+    Scores the rows of the trusted table from `start` to `stop` (excluded), see
+    write_predictions. `path` is the parquet copy of the table, see
+    dags.data.ingest.trusted_rows.
+    """
+    path = path or ingest()
+    _, columns = prediction_columns(state)
+    chunks = read_trusted_chunks(
+        columns=columns, chunksize=chunksize, start=start, stop=stop, path=path
     )
+    history = () if state.shard_keys else _warmup(state, start, path)
+    return write_predictions(chunks, scorer, state, file_obj, chunksize, history, tails)
+
+
+def write_success(date, model, start, stop):
+    """Marks the partition of `date` complete, with the model and rows it holds"""
+    marker = {"model": model, "start": start, "stop": stop}
+    blob.to_any(BytesIO(json.dumps(marker).encode()), success_path(date))
+
+
+def is_complete(date, model, start, stop):
+    """Whether the partition of `date` holds the predictions of `model` for the rows"""
+    if not blob.exists(success_path(date)):
+        return False
+    marker = cache.read_any(success_path(date), func=json.load)
+    return marker == {"model": model, "start": start, "stop": stop}
+
+
+def _empty_watermark():
+    return {"rows": 0, "shard_keys": [], "tails": {}, "partitions": {}}
+
+
+def read_watermark():
+    """Watermark manifest of the predictions, empty before the first run"""
+    if not blob.exists(PREDICTIONS_WATERMARK):
+        return _empty_watermark()
+    return cache.read_any(PREDICTIONS_WATERMARK, func=json.load)
+
+
+def _partition_rows(watermark, date, rows):
+    """
+    Rows the partition of `date` holds, with the tails of the shards before them.
+
+    Returns:
+        tuple: Start, stop and tails, None when `date` precedes the last partition
+            without having one.
+    """
+    partitions = watermark["partitions"]
+    last = max(partitions, default=None)
+    if date in partitions:
+        partition = partitions[date]
+        # The last partition also takes the rows added since it was scored
+        stop = rows if date == last else partition["stop"]
+        return partition["start"], stop, partition.get("tails", {})
+    if last is None or date > last:
+        return watermark["rows"], rows, watermark["tails"]
+    return None
+
+
+def predictions(date=config.TODAY, chunksize=config.PREDICT_CHUNKSIZE):
+    """
+    Scores the rows of the equipment data added since the last run with the latest
+    model, writing them to the partition of `date`.
+    """
+    model = latest_model_path()
+    artifact = load_model(model)
+    scorer, state = LinearScorer.from_artifact(artifact), artifact.state
+
+    path = ingest()
+    watermark, rows = read_watermark(), trusted_rows(path=path)
+    if rows < watermark["rows"]:
+        logger.warning("The equipment data shrank since the last run, scoring it all")
+        watermark = _empty_watermark()
+
+    partition = _partition_rows(watermark, date, rows)
+    if partition is None:
+        logger.warning(f"{date} precedes the last partition of the predictions")
+        return
+    start, stop, tails = partition
+    if watermark["shard_keys"] != state.shard_keys:
+        # The first rows of each shard are scored without their preceding ones
+        tails = {}
+    if stop <= start:
+        logger.info(f"No new rows to score on {date}")
+        return
+
+    logger.info(f"Scoring rows {start} to {stop} on {date}")
+    with tempfile.TemporaryFile() as tfile:
+        end_tails = score_rows(
+            scorer, state, start, stop, tfile, chunksize, tails, path=path
+        )
+        blob.to_any(tfile, predictions_path(date))
+    write_success(date, model, start, stop)
+
+    partition = {"start": start, "stop": stop}
+    if state.shard_keys:
+        partition["tails"] = tails
+    watermark["partitions"] = {**watermark["partitions"], date: partition}
+    if stop >= watermark["rows"]:
+        watermark.update(rows=stop, shard_keys=state.shard_keys, tails=end_tails)
+    blob.to_any(BytesIO(json.dumps(watermark).encode()), PREDICTIONS_WATERMARK)
@@ -0,0 +1,322 @@
+"""
+Scoring server of the latest model
+
+The server keeps the model, its feature statistics and the rolling window of every
+series resident, and scores sensor readings as they come instead of a daily table.
+It speaks HTTP/1.1, on a TCP port or a Unix socket:
+
+    POST /score   a reading, or a list of readings of the same request, as JSON
+    GET  /health  the model being served
+    GET  /stats   batches scored so far
+
+A reading has the PRESETS and sensor columns of the equipment data, null for a
+missing sensor, and optionally an "equipment" identifying its series. The series of a
+reading without one is its shard for sharded models, the single series otherwise. The
+rolling features of a reading look at the previous readings of its series, starting
+from where the daily run stopped.
+
+The requests are queued and scored in micro-batches: the readings of every request
+waiting, up to SERVE_MAX_BATCH, are scored in a single vectorized call. The event
+loop scores the batch itself, so the requests arriving meanwhile make the next one.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+import numpy as np
+
+from dags import config
+from dags.data.ingest import read_trusted
+from dags.data.schema import KEYS, PRESETS
+from dags.features.engineering import WARMUP_ROWS, build_row_features, tail
+from dags.models.artifact import latest_model_path, load_model
+from dags.models.scorer import LinearScorer
+from dags.visualization.inference import read_watermark, shard_name
+
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted, in bytes
+MAX_BODY = 16 * 1024**2
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Server Error"}
+
+
+def _padded(history):
+    """History of build_row_features, from a tail of dags.features.engineering"""
+    history = np.asarray(history, dtype=np.float64)[-WARMUP_ROWS:]
+    return np.concatenate((np.full(WARMUP_ROWS - len(history), np.nan), history))
+
+
+class ScoringService:
+    """
+    Scores readings with the rolling window of each series kept in memory.
+
+    Args:
+        scorer (LinearScorer): Scorer of the model.
+        state (FeatureState): Feature statistics of the model.
+        histories (dict): Tail of the rows of each series scored before, by series.
+        model (str): Path of the model, reported by the server.
+    """
+
+    def __init__(self, scorer, state, histories=None, model=None):
+        self.scorer = scorer
+        self.state = state
+        self.model = model
+        self.histories = {
+            series: _padded(history) for series, history in (histories or {}).items()
+        }
+        self.batches = 0
+        self.readings = 0
+        self._empty = _padded(())
+
+    @classmethod
+    def from_latest_model(cls):
+        """Service of the latest model, following the rows the daily run scored"""
+        model = latest_model_path()
+        artifact = load_model(model)
+        state = artifact.state
+        logger.info(f"Serving {model}")
+
+        watermark, histories = read_watermark(), {}
+        if state.shard_keys and watermark["shard_keys"] == state.shard_keys:
+            histories = watermark["tails"]
+        elif not state.shard_keys and watermark["rows"]:
+            rows = read_trusted(
+                columns=state.sensors,
+                start=max(watermark["rows"] - WARMUP_ROWS, 0),
+                stop=watermark["rows"],
+            )
+            histories = {"": tail(rows, state)}
+        return cls(LinearScorer.from_artifact(artifact), state, histories, model)
+
+    def validate(self, reading):
+        """Raises ValueError unless `reading` can be scored"""
+        if not isinstance(reading, dict):
+            raise ValueError("A reading is a JSON object")
+        for column in [*PRESETS, *self.state.shard_keys]:
+            value = reading.get(column)
+            # JSON booleans are ints to Python
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ValueError(f"{column} must be an integer")
+        for column in self.state.sensors:
+            if column not in reading:
+                raise ValueError(f"{column} is missing")
+            value = reading[column]
+            if isinstance(value, bool) or (
+                value is not None and not isinstance(value, (int, float))
+            ):
+                raise ValueError(f"{column} must be a number or null")
+
+    def series(self, reading):
+        if "equipment" in reading:
+            return str(reading["equipment"])
+        return shard_name(reading[key] for key in self.state.shard_keys)
+
+    def score(self, readings):
+        """
+        Scores validated readings, in order, and moves the window of their series.
+
+        Readings of a series already in the batch are scored in a later round, after
+        the ones they follow.
+
+        Returns:
+            list: Probability of failure ("proba") and predicted label ("pred") of
+                each reading, along with its KEYS.
+        """
+        series = [self.series(reading) for reading in readings]
+        seen, rounds = {}, []
+        for position, name in enumerate(series):
+            rank = seen[name] = seen.get(name, -1) + 1
+            if rank == len(rounds):
+                rounds.append([])
+            rounds[rank].append(position)
+
+        sensors = self.state.sensors
+        # null readings become NaN
+        block = np.array([[r[c] for c in sensors] for r in readings], np.float64)
+        presets = np.array([[r[c] for c in PRESETS] for r in readings], np.int64)
+        proba = np.empty(len(readings))
+        labels = np.empty(len(readings), dtype=self.scorer.classes.dtype)
+        for positions in rounds:
+            names = [series[position] for position in positions]
+            histories = np.array([self.histories.get(n, self._empty) for n in names])
+            X, following = build_row_features(
+                block[positions], presets[positions], self.state, histories
+            )
+            proba[positions], labels[positions] = self.scorer.score(X)
+            self.histories.update(zip(names, following))
+
+        self.batches += 1
+        self.readings += len(readings)
+        return [
+            {
+                **{key: reading[key] for key in KEYS if key in reading},
+                "proba": p,
+                "pred": label,
+            }
+            for reading, p, label in zip(readings, proba.tolist(), labels.tolist())
+        ]
+
+
+class ScoringServer:
+    """
+    HTTP front of a ScoringService, batching the readings of concurrent requests.
+
+    Args:
+        service (ScoringService): Service scoring the batches.
+        max_batch (int): Most readings scored at a time.
+        batch_wait (float): Seconds a batch waits for more readings.
+    """
+
+    def __init__(self, service, max_batch=None, batch_wait=None):
+        self.service = service
+        self.max_batch = max_batch or config.SERVE_MAX_BATCH
+        self.batch_wait = config.SERVE_BATCH_WAIT if batch_wait is None else batch_wait
+        self.started = time.time()
+        self._queue = None
+
+    def _score_batch(self, pending):
+        """Scores the readings of the `pending` requests and answers them"""
+        readings = [reading for request, _ in pending for reading in request]
+        results = self.service.score(readings)
+        stop = 0
+        for request, future in pending:
+            start, stop = stop, stop + len(request)
+            # The future of a request whose client left is already cancelled
+            if not future.done():
+                future.set_result(results[slice(start, stop)])
+
+    async def _batches(self):
+        """Scores the queued requests a batch at a time"""
+        while True:
+            pending = [await self._queue.get()]
+            # Lets the requests already received join the batch
+            await asyncio.sleep(self.batch_wait)
+            size = len(pending[0][0])
+            while not self._queue.empty() and size < self.max_batch:
+                pending.append(self._queue.get_nowait())
+                size += len(pending[-1][0])
+
+            try:
+                self._score_batch(pending)
+            except Exception as ex:
+                # Fails the requests of the batch, not the next batches
+                logger.exception("Couldn't score a batch")
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(ex)
+
+    async def _score(self, body):
+        payload = json.loads(body)
+        readings = payload if isinstance(payload, list) else [payload]
+        for reading in readings:
+            self.service.validate(reading)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((readings, future))
+        results = await future
+        return results if isinstance(payload, list) else results[0]
+
+    async def _respond(self, method, path, body):
+        if method == "POST" and path == "/score":
+            try:
+                return 200, await self._score(body)
+            except ValueError as ex:
+                return 400, {"error": str(ex)}
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok", "model": self.service.model}
+        if method == "GET" and path == "/stats":
+            batches, readings = self.service.batches, self.service.readings
+            return 200, {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "batches": batches,
+                "readings": readings,
+                "mean_batch": round(readings / batches, 2) if batches else None,
+                "series": len(self.service.histories),
+            }
+        return 404, {"error": f"No route to {method} {path}"}
+
+    async def _handle(self, reader, writer):
+        """Serves the requests of a connection, kept alive until the client closes it"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+                request_line, *lines = head.decode("latin-1").rstrip().split("\r\n")
+                method, path, version = request_line.split(" ", 2)
+                headers = {
+                    name.strip().lower(): value.strip()
+                    for name, value in (line.split(":", 1) for line in lines)
+                }
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    status, payload = 400, {"error": "Request body too large"}
+                    body, headers["connection"] = b"", "close"
+                else:
+                    body = await reader.readexactly(length)
+                    try:
+                        status, payload = await self._respond(method, path, body)
+                    except Exception as ex:
+                        logger.exception(f"{method} {path} failed")
+                        status, payload = 500, {"error": repr(ex)}
+
+                close = (
+                    headers.get("connection", "").lower() == "close"
+                    or version == "HTTP/1.0"
+                )
+                content = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(content)}\r\n"
+                    f"Connection: {'close' if close else 'keep-alive'}\r\n"
+                    "\r\n".encode() + content
+                )
+                await writer.drain()
+                if close:
+                    return
+        except (ConnectionError, ValueError):
+            return
+        finally:
+            writer.close()
+
+    async def run(self, host="127.0.0.1", port=8080, unix_socket=None):
+        """Serves until interrupted"""
+        self._queue = asyncio.Queue()
+        if unix_socket:
+            server = await asyncio.start_unix_server(self._handle, path=unix_socket)
+            address = unix_socket
+        else:
+            server = await asyncio.start_server(self._handle, host, port)
+            address = f"http://{host}:{port}"
+
+        stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stopped.set)
+
+        batches = asyncio.create_task(self._batches())
+        logger.info(f"Scoring on {address}, batches of up to {self.max_batch} readings")
+        async with server:
+            await stopped.wait()
+        batches.cancel()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        logger.info(
+            f"Stopped after {self.service.batches} batches, "
+            f"{self.service.readings} readings"
+        )
+
+
+def serve(
+    host="127.0.0.1", port=8080, unix_socket=None, max_batch=None, batch_wait=None
+):
+    """Serves the latest model on a TCP port, or on a Unix socket when given"""
+    server = ScoringServer(ScoringService.from_latest_model(), max_batch, batch_wait)
+    asyncio.run(server.run(host, port, unix_socket))
@@ -1,19 +1,28 @@
 import os
+import time
 
 import docker
 import dotenv
-import tomli
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
 
 dotenv.load_dotenv()
 
+APP_NAME = "test"
+
+# Targets of the Dockerfile, each one pushed as <version>-<target>
+IMAGES = ["train", "predict"]
+
 
 def build_image():
     with open("pyproject.toml", "rb") as file:
-        toml_data = tomli.load(file)
+        toml_data = tomllib.load(file)
 
     acr_name = "54e5ef7c9fb5461ba8e5bfdfb25ddb7d"
     project_tag = toml_data["project"]["version"]
-    tag = f"{acr_name}.azurecr.io/test:{project_tag}"
 
     # Get the ACR login server and username/password
     acr_login_server = f"{acr_name}.azurecr.io"
@@ -24,9 +33,22 @@ def build_image():
     client.login(
         username=acr_username, password=acr_password, registry=acr_login_server
     )
-    image, logs = client.images.build(path=".", tag=tag)
-    for line in client.images.push(tag, stream=True):
-        print(line)
+
+    for target in IMAGES:
+        tag = f"{acr_login_server}/{APP_NAME}:{project_tag}-{target}"
+
+        start = time.perf_counter()
+        image, logs = client.images.build(path=".", tag=tag, target=target)
+        built = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for line in client.images.push(tag, stream=True, decode=True):
+            if "error" in line:
+                raise RuntimeError(f"Failed to push {tag}: {line['error']}")
+        pushed = time.perf_counter() - start
+
+        size = image.attrs["Size"] / 1024**2
+        print(f"{tag}: {size:.0f} MiB, built in {built:.1f}s, pushed in {pushed:.1f}s")
 
 
 if __name__ == "__main__":
@@ -1,10 +1,14 @@
+import dataclasses
 import datetime
+import graphlib
+import hashlib
+import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import crontab
 import dotenv
-import tomli
 from azure.batch import BatchServiceClient
 from azure.batch.models import (
     AutoUserScope,
@@ -17,21 +21,51 @@ from azure.batch.models import (
     JobAddParameter,
     JobConstraints,
     JobManagerTask,
+    JobPatchParameter,
+    JobState,
+    MetadataItem,
+    OnAllTasksComplete,
     PoolAddParameter,
     PoolInformation,
     TaskAddParameter,
+    TaskAddStatus,
+    TaskConstraints,
     TaskContainerSettings,
     TaskDependencies,
     UserIdentity,
 )
 from azure.common.credentials import ServicePrincipalCredentials
 
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+from dags.engine import parse_tasks
+
 APP_NAME = "test"
 pool_id = "batchpool"
 
+# Job metadata with the hash of the spec the job was created from
+SPEC_METADATA = "spec-hash"
+
+# Image the tasks of a DAG run on, unless its spec sets one, as built by deploy_code
+DEFAULT_IMAGE = "train"
+
+DEPLOY_WORKERS = 16
+MAX_TASKS_PER_REQUEST = 100
+TASK_ADD_ATTEMPTS = 5
+DELETE_TIMEOUT = 600
+MAX_POLL_DELAY = 30
+
 
 def _get_batch_client():
     dotenv.load_dotenv()
+    if os.getenv("BATCH_LOCAL"):
+        from local_batch import LocalBatchClient
+
+        return LocalBatchClient()
+
     # authenticate to Azure API using an administrative service principal
     # (ie. Jenkins) and get batch client. We expect the standard `AZURE_` env variables
     # to be present (can be part of the local .env file)
@@ -46,10 +80,10 @@ def _get_batch_client():
     return batch_client
 
 
-def _get_container_settings(version):
+def _get_container_settings(version, image):
     acr_name = "54e5ef7c9fb5461ba8e5bfdfb25ddb7d"
     server = f"{acr_name}.azurecr.io"
-    image_tag = f"{server}/{APP_NAME}:{version}"
+    image_tag = f"{server}/{APP_NAME}:{version}-{image}"
 
     # setup container info for tasks
     container_settings = TaskContainerSettings(
@@ -78,15 +112,24 @@ def _get_env_settings():
     return environment_settings
 
 
-def _get_job_manager_task(version):
+def _get_user_identity():
+    user = AutoUserSpecification(
+        scope=AutoUserScope.task,
+        elevation_level=ElevationLevel.admin,
+    )
+    return UserIdentity(auto_user=user)
+
+
+def _get_job_manager_task(dag, version, image):
     environment_settings = _get_env_settings()
 
-    command = "echo 'Running Container'"
+    # The arguments of run.py, the entrypoint of the images
+    command = f"list-tasks {dag}"
     job_manager_task = JobManagerTask(
         id="mlops-manager-task",
         display_name="MLOps Job Manager Task",
         command_line=command,
-        container_settings=_get_container_settings(version),
+        container_settings=_get_container_settings(version, image),
         environment_settings=environment_settings,
         kill_job_on_completion=False,
     )
@@ -106,36 +149,64 @@ def create_batch_pool(batch_client):
     return pool
 
 
-def _add_job(batch_client: BatchServiceClient, job_id, job_manager_task):
-    try:
-        batch_client.job.get(job_id)
-        batch_client.job.delete(job_id)
-        time.sleep(30)
+def _wait_deleted(batch_client: BatchServiceClient, job_id):
+    """Polls a job being deleted, more and more sparsely, until it's gone"""
+    delay, deadline = 1, time.monotonic() + DELETE_TIMEOUT
+    while True:
+        try:
+            batch_client.job.get(job_id)
+        except BatchErrorException as e:
+            if e.error.code == "JobNotFound":
+                return
+            raise
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Job {job_id} still being deleted")
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_DELAY)
+
+
+def _add_job(batch_client: BatchServiceClient, job_id, job_manager_task, spec_hash):
+    """
+    Adds the job, unless it's already there with the same spec.
+
+    Returns:
+        bool: Whether the job was (re)created and its tasks need to be added.
+    """
+    job = JobAddParameter(
+        id=job_id,
+        pool_info=PoolInformation(pool_id=pool_id),
+        uses_task_dependencies=True,
+        job_manager_task=job_manager_task,
+        constraints=JobConstraints(max_wall_clock_time="PT18H", max_task_retry_count=1),
+        metadata=[MetadataItem(name=SPEC_METADATA, value=spec_hash)],
+    )
 
-        print(f"Recreating job {job_id}")
-        job = JobAddParameter(
-            id=job_id,
-            pool_info=PoolInformation(pool_id=pool_id),
-            uses_task_dependencies=True,
-            job_manager_task=job_manager_task,
-            constraints=JobConstraints(
-                max_wall_clock_time="PT18H", max_task_retry_count=1
-            ),
-        )
-        batch_client.job.add(job)
+    try:
+        current = batch_client.job.get(job_id)
     except BatchErrorException as e:
-        print(f"{e.error.code}")
+        if e.error.code != "JobNotFound":
+            raise
         print(f"Adding job {job_id}")
-        job = JobAddParameter(
-            id=job_id,
-            pool_info=PoolInformation(pool_id=pool_id),
-            uses_task_dependencies=True,
-            job_manager_task=job_manager_task,
-            constraints=JobConstraints(
-                max_wall_clock_time="PT18H", max_task_retry_count=1
-            ),
-        )
-        batch_client.job.add(job)
+    else:
+        deployed = {item.name: item.value for item in current.metadata or []}
+        if (
+            current.state == JobState.active
+            and deployed.get(SPEC_METADATA) == spec_hash
+        ):
+            print(f"Updating job {job_id}")
+            batch_client.job.patch(
+                job_id,
+                JobPatchParameter(constraints=job.constraints, metadata=job.metadata),
+            )
+            return False
+
+        print(f"Recreating job {job_id}")
+        if current.state != JobState.deleting:
+            batch_client.job.delete(job_id)
+        _wait_deleted(batch_client, job_id)
+
+    batch_client.job.add(job)
+    return True
 
 
 def _parse_cron(cron, tz):
@@ -153,19 +224,34 @@ def _parse_cron(cron, tz):
 def _add_tasks(
     job_id: str, dag: str, spec: dict, version: str, batch_client: BatchServiceClient
 ):
-    dag_tasks = spec["tasks"]
+    dag_tasks = parse_tasks(spec)
     environment_settings = _get_env_settings()
+    container_settings = _get_container_settings(version, _image(spec))
 
-    user = AutoUserSpecification(
-        scope=AutoUserScope.task,
-        elevation_level=ElevationLevel.admin,
-    )
+    # Tasks are added in dependency order, each before the tasks depending on it
+    order = graphlib.TopologicalSorter(
+        {name: task.depends_on for name, task in dag_tasks.items()}
+    ).static_order()
 
-    # add tasks
-    for i, task_name in enumerate(dag_tasks):
+    tasks = []
+    for task_name in order:
+        dag_task = dag_tasks[task_name]
         task_id = f"{task_name}"
-        command = f"'python run.py task {dag} {task_name}'"
-        depends_on = TaskDependencies(task_ids=[dag_tasks[i - 1]]) if i > 0 else None
+        command = f"task {dag} {task_name}"
+        depends_on = (
+            TaskDependencies(task_ids=dag_task.depends_on)
+            if dag_task.depends_on
+            else None
+        )
+        # Unset options keep the constraints of the job
+        constraints = TaskConstraints(
+            max_task_retry_count=dag_task.retries,
+            max_wall_clock_time=(
+                datetime.timedelta(seconds=dag_task.timeout)
+                if dag_task.timeout
+                else None
+            ),
+        )
         # source_file_pattern = ".*"
         # container_url = "https://testmlopaes.dfs.core.windows.net/logs/"
         # output_path = f"{dag}/{job_id}/{task_id}"
@@ -173,10 +259,11 @@ def _add_tasks(
             id=task_id,
             display_name=f"Test Task {task_name}",
             command_line=command,
-            container_settings=_get_container_settings(version=version),
+            container_settings=container_settings,
             environment_settings=environment_settings,
             depends_on=depends_on,
-            user_identity=UserIdentity(auto_user=user),
+            constraints=constraints,
+            user_identity=_get_user_identity(),
             # output_files=[
             #     OutputFile(
             #         file_pattern=source_file_pattern,
@@ -191,31 +278,153 @@ def _add_tasks(
             #     )
             # ],
         )
-        print(f"Adding task: {task_id}")
-        batch_client.task.add(job_id, task)
+        tasks.append(task)
+
+    for start in range(0, len(tasks), MAX_TASKS_PER_REQUEST):
+        end = start + MAX_TASKS_PER_REQUEST
+        _add_task_collection(batch_client, job_id, tasks[start:end])
+
+
+def _add_task_collection(batch_client: BatchServiceClient, job_id, tasks):
+    """Adds up to MAX_TASKS_PER_REQUEST tasks, retrying the ones the service failed"""
+    delay = 1
+    for attempt in range(TASK_ADD_ATTEMPTS):
+        print(f"Adding {len(tasks)} tasks to job {job_id}")
+        results = batch_client.task.add_collection(job_id, tasks).value
+        failed = {
+            result.task_id: result
+            for result in results
+            if result.status != TaskAddStatus.success
+        }
+        client_errors = [
+            f"{task_id}: {result.error.code}"
+            for task_id, result in failed.items()
+            if result.status == TaskAddStatus.client_error
+        ]
+        if client_errors:
+            raise RuntimeError(f"Tasks rejected in job {job_id}: {client_errors}")
+        if not failed:
+            return
+
+        tasks = [task for task in tasks if task.id in failed]
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_POLL_DELAY)
+    raise RuntimeError(f"Tasks {list(failed)} couldn't be added to job {job_id}")
+
+
+def _image(spec):
+    return spec.get("image", DEFAULT_IMAGE)
+
+
+def _spec_hash(dag, spec, version):
+    """Hash of what a job is made of: the DAG spec and the image version"""
+    content = {
+        "dag": dag,
+        "version": version,
+        "image": _image(spec),
+        "pool_id": pool_id,
+        "tasks": [dataclasses.asdict(task) for task in parse_tasks(spec).values()],
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
 
 
-def run_job():
-    import run
+def _deploy_dag(batch_client: BatchServiceClient, dag, spec, version):
+    job_id = f"test-{dag}"
+    job_manager_task = _get_job_manager_task(dag, version, _image(spec))
 
-    batch_client = _get_batch_client()
+    spec_hash = _spec_hash(dag, spec, version)
+    if _add_job(batch_client, job_id, job_manager_task, spec_hash):
+        _add_tasks(job_id, dag, spec, version, batch_client)
+
+
+def _get_version():
     with open("pyproject.toml", "rb") as file:
-        toml_data = tomli.load(file)
+        toml_data = tomllib.load(file)
+    return toml_data["project"]["version"]
+
 
-    specs = run.get_dags()
-    specs.pop("config")
-    dags = specs.keys()
-    version = toml_data["project"]["version"]
+def _split_dates(first, last, parts):
+    """Splits the dates from `first` to `last` into at most `parts` contiguous ranges"""
+    days = (last - first).days + 1
+    parts = min(parts, days)
+    starts = [first + datetime.timedelta(days=days * i // parts) for i in range(parts)]
+    ends = [start - datetime.timedelta(days=1) for start in starts[1:]] + [last]
+    return list(zip(starts, ends))
 
-    for dag in dags:
-        spec = specs[dag]
 
-        job_manager_task = _get_job_manager_task(version)
+def submit_backfill(
+    dag, first, last, parts, workers=None, force=False, batch_client=None
+):
+    """
+    Submits the backfill of the partitions of `dag` from `first` to `last` as a job
+    of `parts` parallel tasks, each running `run.py backfill` over a range of dates.
+    The job terminates once its tasks are done.
+
+    Returns:
+        str: Id of the job.
+    """
+    import run
 
-        job_id = f"test-{dag}"
+    batch_client = batch_client or _get_batch_client()
+    spec = run.get_dags()[dag]
+    version = _get_version()
 
-        _add_job(batch_client, job_id, job_manager_task)
-        _add_tasks(job_id, dag, spec, version, batch_client)
+    job_id = f"test-{dag}-backfill-{datetime.datetime.now():%Y%m%d%H%M%S}"
+    print(f"Adding job {job_id}")
+    batch_client.job.add(
+        JobAddParameter(
+            id=job_id,
+            pool_info=PoolInformation(pool_id=pool_id),
+            constraints=JobConstraints(
+                max_wall_clock_time="PT18H", max_task_retry_count=1
+            ),
+            on_all_tasks_complete=OnAllTasksComplete.terminate_job,
+        )
+    )
+
+    options = (f" --workers {workers}" if workers else "") + (
+        " --force" if force else ""
+    )
+    container_settings = _get_container_settings(version, _image(spec))
+    environment_settings = _get_env_settings()
+    tasks = [
+        TaskAddParameter(
+            id=f"backfill-{start}-{end}",
+            display_name=f"Backfill {dag} {start} to {end}",
+            command_line=f"backfill {dag} --start {start} --end {end}{options}",
+            container_settings=container_settings,
+            environment_settings=environment_settings,
+            user_identity=_get_user_identity(),
+        )
+        for start, end in _split_dates(first, last, parts)
+    ]
+    for start in range(0, len(tasks), MAX_TASKS_PER_REQUEST):
+        end = start + MAX_TASKS_PER_REQUEST
+        _add_task_collection(batch_client, job_id, tasks[start:end])
+    return job_id
+
+
+def run_job(batch_client=None):
+    import run
+
+    batch_client = batch_client or _get_batch_client()
+    specs = {dag: spec for dag, spec in run.get_dags().items() if dag != "config"}
+    version = _get_version()
+
+    # The DAGs are deployed concurrently, the calls are mostly waiting on the service
+    failed = []
+    with ThreadPoolExecutor(max_workers=DEPLOY_WORKERS) as executor:
+        futures = {
+            executor.submit(_deploy_dag, batch_client, dag, spec, version): dag
+            for dag, spec in specs.items()
+        }
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                print(f"Failed to deploy {futures[future]}: {future.exception()!r}")
+                failed.append(futures[future])
+
+    if failed:
+        raise RuntimeError(f"Failed to deploy {failed}")
 
 
 if __name__ == "__main__":
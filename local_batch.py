@@ -0,0 +1,1206 @@
+"""
+Local stand-in for the BatchServiceClient used by deploy_infra
+
+Pools, jobs and tasks are kept in memory behind the same operations, models and
+errors as the service, so deploys can be run and timed offline. Like the service,
+every call takes `latency` seconds and a deleted job stays in the deleting state for
+`delete_seconds` before it is gone.
+
+    BATCH_LOCAL=1 python deploy_infra.py
+
+With `run_tasks`, the client also emulates the pools: their nodes are simulated, on
+a clock running `speedup` times faster than the wall clock, and each task runs its
+command line as a local process, or container, on a free node once its job manager
+task started and the tasks it depends on succeeded. The pools scale following their
+autoscale formula, evaluated on samples of their tasks, and the client reports the
+latency of each job and the utilisation of the nodes, e.g. to try pool sizes and
+formulas before paying for them:
+
+    python local_batch.py --autoscale tf/autoscale.txt --speedup 60
+"""
+
+import datetime
+import math
+import operator
+import os
+import re
+import shlex
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from azure.batch.models import (
+    AutoScaleRun,
+    AutoScaleRunError,
+    BatchError,
+    BatchErrorException,
+    CloudJob,
+    CloudPool,
+    CloudTask,
+    ErrorMessage,
+    JobState,
+    PoolState,
+    TaskAddCollectionResult,
+    TaskAddResult,
+    TaskAddStatus,
+    TaskExecutionInformation,
+    TaskExecutionResult,
+    TaskState,
+)
+
+# Maximum number of tasks of an add_collection call
+MAX_TASKS_PER_REQUEST = 100
+
+# Simulated seconds between the samples of the metrics of the autoscale formulas,
+# and the number of samples kept, a day of them
+SAMPLE_INTERVAL = 30
+MAX_SAMPLES = 2880
+
+# Simulated seconds between evaluations of an autoscale formula, unless the pool
+# sets its own interval
+AUTO_SCALE_INTERVAL = 900
+
+
+class LocalBatchError(BatchErrorException):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.error = BatchError(code=code, message=ErrorMessage(value=message))
+
+
+class FormulaError(Exception):
+    pass
+
+
+class Interval(float):
+    """Time interval of an autoscale formula, in seconds"""
+
+    def __mul__(self, other):
+        return Interval(float(self) * other)
+
+    def __truediv__(self, other):
+        return Interval(float(self) / other)
+
+    def __add__(self, other):
+        return Interval(float(self) + other)
+
+    def __sub__(self, other):
+        return Interval(float(self) - other)
+
+    __rmul__ = __mul__
+    __radd__ = __add__
+
+
+TIME_INTERVALS = {
+    "TimeInterval_Zero": Interval(0),
+    "TimeInterval_Second": Interval(1),
+    "TimeInterval_Minute": Interval(60),
+    "TimeInterval_Hour": Interval(3600),
+    "TimeInterval_Day": Interval(86400),
+    "TimeInterval_Week": Interval(604800),
+}
+
+
+class Metric:
+    """Samples of a metric of an autoscale formula, taken every SAMPLE_INTERVAL"""
+
+    def __init__(self, samples, now):
+        # (time, value) pairs, the most recent one last
+        self.samples = samples
+        self.now = now
+
+    def _values(self, span):
+        if isinstance(span, Interval):
+            return [value for at, value in self.samples if at > self.now - span]
+        count = int(span)
+        return [value for _, value in self.samples][-count:] if count else []
+
+    def GetSample(self, span):
+        """The last `span` samples, or the samples of the last `span` interval"""
+        values = self._values(span)
+        if not values:
+            raise FormulaError(f"No samples in {span:g}")
+        return values
+
+    def GetSamplePercent(self, interval):
+        """Percentage of the samples of the last `interval` that were taken"""
+        expected = interval / SAMPLE_INTERVAL
+        return min(100.0, 100 * len(self._values(interval)) / expected)
+
+    def Count(self):
+        return float(len(self.samples))
+
+
+def _flatten(args):
+    values = []
+    for arg in args:
+        values.extend(arg if isinstance(arg, list) else [arg])
+    if not values:
+        raise FormulaError("No values")
+    return values
+
+
+FUNCTIONS = {
+    "max": lambda *args: max(_flatten(args)),
+    "min": lambda *args: min(_flatten(args)),
+    "avg": lambda *args: statistics.fmean(_flatten(args)),
+    "sum": lambda *args: math.fsum(_flatten(args)),
+    "count": lambda *args: float(len(_flatten(args))),
+}
+
+
+def _compare(func):
+    return lambda left, right: float(func(left, right))
+
+
+# Binary operators, from the lowest precedence to the highest
+OPERATORS = [
+    {"||": lambda left, right: float(bool(left) or bool(right))},
+    {"&&": lambda left, right: float(bool(left) and bool(right))},
+    {
+        "==": _compare(operator.eq),
+        "!=": _compare(operator.ne),
+        "<": _compare(operator.lt),
+        "<=": _compare(operator.le),
+        ">": _compare(operator.gt),
+        ">=": _compare(operator.ge),
+    },
+    {"+": operator.add, "-": operator.sub},
+    {"*": operator.mul, "/": operator.truediv},
+]
+
+TOKEN = re.compile(
+    r"\s*(?:(?P<number>\d+(?:\.\d*)?)|(?P<name>\$?\w+)"
+    r"|(?P<op>&&|\|\||[<>=!]=|[-+*/<>!?:(),.=;]))"
+)
+
+
+def _apply(func, *operands):
+    return lambda variables: func(*(operand(variables) for operand in operands))
+
+
+def _variable(name):
+    def lookup(variables):
+        if name not in variables:
+            raise FormulaError(f"Unknown variable {name}")
+        return variables[name]
+
+    return lookup
+
+
+def _method(obj, name, *args):
+    if not isinstance(obj, Metric) or not hasattr(Metric, name):
+        raise FormulaError(f"Unknown method {name}")
+    return getattr(obj, name)(*args)
+
+
+class _Parser:
+    """Recursive descent parser compiling the statements of a formula to functions"""
+
+    def __init__(self, text):
+        text = re.sub(r"//[^\n]*", "", text).rstrip()
+        self.tokens, self.position = [], 0
+        position = 0
+        while position < len(text):
+            match = TOKEN.match(text, position)
+            if match is None:
+                raise FormulaError(f"Unexpected {text[position:][:20]!r}")
+            position = match.end()
+            self.tokens.append((match.lastgroup, match.group(match.lastgroup)))
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][1]
+        return None
+
+    def next(self):
+        if self.position == len(self.tokens):
+            raise FormulaError("Unexpected end of the formula")
+        self.position += 1
+        return self.tokens[self.position - 1]
+
+    def expect(self, value):
+        token = self.next()[1]
+        if token != value:
+            raise FormulaError(f"Expected {value!r}, got {token!r}")
+
+    def statements(self):
+        statements = []
+        while self.peek() is not None:
+            kind, name = self.next()
+            if kind != "name" or not name.startswith("$"):
+                raise FormulaError(f"Expected a variable, got {name!r}")
+            self.expect("=")
+            statements.append((name, self.expression()))
+            if self.peek() is not None:
+                self.expect(";")
+        return statements
+
+    def expression(self):
+        condition = self.binary()
+        if self.peek() != "?":
+            return condition
+        self.next()
+        then = self.expression()
+        self.expect(":")
+        otherwise = self.expression()
+        return lambda variables: (
+            then(variables) if condition(variables) else otherwise(variables)
+        )
+
+    def binary(self, level=0):
+        if level == len(OPERATORS):
+            return self.unary()
+        left = self.binary(level + 1)
+        while self.peek() in OPERATORS[level]:
+            func = OPERATORS[level][self.next()[1]]
+            left = _apply(func, left, self.binary(level + 1))
+        return left
+
+    def unary(self):
+        if self.peek() == "-":
+            self.next()
+            return _apply(operator.neg, self.unary())
+        if self.peek() == "!":
+            self.next()
+            return _apply(lambda value: float(not value), self.unary())
+
+        expression = self.primary()
+        while self.peek() == ".":
+            self.next()
+            _, name = self.next()
+            expression = _apply(
+                lambda obj, *args, name=name: _method(obj, name, *args),
+                expression,
+                *self.arguments(),
+            )
+        return expression
+
+    def arguments(self):
+        self.expect("(")
+        arguments = []
+        while self.peek() != ")":
+            if arguments:
+                self.expect(",")
+            arguments.append(self.expression())
+        self.next()
+        return arguments
+
+    def primary(self):
+        kind, value = self.next()
+        if kind == "number":
+            return lambda variables: float(value)
+        if value == "(":
+            expression = self.expression()
+            self.expect(")")
+            return expression
+        if kind != "name":
+            raise FormulaError(f"Unexpected {value!r}")
+
+        if self.peek() == "(":
+            if value not in FUNCTIONS:
+                raise FormulaError(f"Unknown function {value}")
+            return _apply(FUNCTIONS[value], *self.arguments())
+        if value.startswith("$"):
+            return _variable(value)
+        if value in TIME_INTERVALS:
+            return lambda variables: TIME_INTERVALS[value]
+        # Keywords, like the taskcompletion deallocation option
+        return lambda variables: value
+
+
+class AutoScaleFormula:
+    """
+    Autoscale formula of a pool.
+
+    Covers the part of the formula language of Batch the pools use: assignments of
+    arithmetic, comparisons, `?:`, the max, min, avg, sum and count functions, time
+    intervals and the GetSample, GetSamplePercent and Count methods of the metrics.
+
+    Raises:
+        FormulaError: If the formula can't be parsed.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.statements = _Parser(text).statements()
+
+    def evaluate(self, variables):
+        """
+        Runs the statements of the formula.
+
+        Args:
+            variables (dict): Service defined variables, like $TargetDedicatedNodes,
+                with the metrics as Metric.
+
+        Returns:
+            dict: The variables once assigned by the formula.
+
+        Raises:
+            FormulaError: If a statement can't be evaluated, e.g. for lack of samples.
+        """
+        variables = dict(variables)
+        for name, expression in self.statements:
+            variables[name] = expression(variables)
+        return variables
+
+
+def _format_results(variables):
+    """Results of an evaluation, as in the AutoScaleRun of the service"""
+    results = []
+    for name, value in variables.items():
+        if isinstance(value, Metric):
+            continue
+        if isinstance(value, list):
+            value = "[" + ",".join(f"{item:g}" for item in value) + "]"
+        elif isinstance(value, float):
+            value = f"{value:g}"
+        results.append(f"{name}={value}")
+    return ";".join(results)
+
+
+@dataclass
+class _Node:
+    id: str
+    # Simulated time the node is done starting
+    ready_at: float
+    run: "_Run" = None
+    removing: bool = False
+
+
+@dataclass
+class _Run:
+    job_id: str
+    task_id: str
+    pool_id: str
+    node: _Node
+    process: subprocess.Popen
+    log: object
+    deadline: float
+
+
+@dataclass
+class _SimulatedPool:
+    formula: AutoScaleFormula = None
+    interval: float = AUTO_SCALE_INTERVAL
+    next_evaluation: float = 0.0
+    # What happens to the tasks of the nodes removed by a resize
+    deallocation: str = "requeue"
+    nodes: list = field(default_factory=list)
+    # (time, active tasks, running tasks) samples
+    samples: deque = field(default_factory=lambda: deque(maxlen=MAX_SAMPLES))
+    next_sample: float = 0.0
+    allocated: int = 0
+    max_nodes: int = 0
+    node_seconds: float = 0.0
+    busy_seconds: float = 0.0
+
+
+class _Operations:
+    def __init__(self, client):
+        self._client = client
+
+    def _call(self):
+        with self._client.lock:
+            self._client.requests += 1
+        time.sleep(self._client.latency)
+
+
+class PoolOperations(_Operations):
+    def _pool(self, pool_id):
+        if pool_id not in self._client.pools:
+            raise LocalBatchError("PoolNotFound", f"Pool {pool_id} not found")
+        return self._client.pools[pool_id]
+
+    def _formula(self, text):
+        try:
+            return AutoScaleFormula(text)
+        except FormulaError as ex:
+            raise LocalBatchError("InvalidAutoScaleFormula", str(ex))
+
+    def add(self, pool):
+        self._call()
+        with self._client.lock:
+            if pool.id in self._client.pools:
+                raise LocalBatchError("PoolExists", f"Pool {pool.id} already exists")
+
+            simulated = _SimulatedPool()
+            if pool.enable_auto_scale:
+                simulated.formula = self._formula(pool.auto_scale_formula)
+            if pool.auto_scale_evaluation_interval:
+                interval = pool.auto_scale_evaluation_interval
+                simulated.interval = interval.total_seconds()
+
+            self._client.pools[pool.id] = CloudPool(
+                id=pool.id,
+                vm_size=pool.vm_size,
+                state=PoolState.active,
+                creation_time=self._client.timestamp(),
+                current_dedicated_nodes=0,
+                target_dedicated_nodes=pool.target_dedicated_nodes or 0,
+                enable_auto_scale=pool.enable_auto_scale,
+                auto_scale_formula=pool.auto_scale_formula,
+                auto_scale_evaluation_interval=pool.auto_scale_evaluation_interval,
+            )
+            self._client.simulated[pool.id] = simulated
+
+    def get(self, pool_id):
+        self._call()
+        with self._client.lock:
+            return self._pool(pool_id)
+
+    def delete(self, pool_id):
+        self._call()
+        with self._client.lock:
+            self._pool(pool_id)
+            del self._client.pools[pool_id]
+            del self._client.simulated[pool_id]
+
+    def resize(self, pool_id, pool_resize_parameter):
+        self._call()
+        with self._client.lock:
+            pool = self._pool(pool_id)
+            if pool.enable_auto_scale:
+                raise LocalBatchError(
+                    "AutoScalingEnabled", f"Pool {pool_id} is autoscaled"
+                )
+            pool.target_dedicated_nodes = pool_resize_parameter.target_dedicated_nodes
+            option = pool_resize_parameter.node_deallocation_option
+            if option is not None:
+                simulated = self._client.simulated[pool_id]
+                simulated.deallocation = getattr(option, "value", option)
+
+    def enable_auto_scale(
+        self, pool_id, auto_scale_formula=None, auto_scale_evaluation_interval=None
+    ):
+        self._call()
+        with self._client.lock:
+            pool, simulated = self._pool(pool_id), self._client.simulated[pool_id]
+            if auto_scale_formula is not None:
+                simulated.formula = self._formula(auto_scale_formula)
+                pool.auto_scale_formula = auto_scale_formula
+            if simulated.formula is None:
+                raise LocalBatchError(
+                    "MissingAutoScaleFormula", f"Pool {pool_id} has no formula"
+                )
+            if auto_scale_evaluation_interval is not None:
+                simulated.interval = auto_scale_evaluation_interval.total_seconds()
+                pool.auto_scale_evaluation_interval = auto_scale_evaluation_interval
+
+            # The formula is evaluated right away, then every interval
+            pool.enable_auto_scale = True
+            simulated.next_evaluation = self._client.now()
+
+    def disable_auto_scale(self, pool_id):
+        self._call()
+        with self._client.lock:
+            self._pool(pool_id).enable_auto_scale = False
+            self._client.simulated[pool_id].formula = None
+
+    def evaluate_auto_scale(self, pool_id, auto_scale_formula):
+        """Evaluates a formula on the samples of the pool, without resizing it"""
+        self._call()
+        with self._client.lock:
+            self._pool(pool_id)
+            formula = self._formula(auto_scale_formula)
+            run, _ = self._client.evaluate(pool_id, formula)
+            return run
+
+
+class JobOperations(_Operations):
+    def _job(self, job_id):
+        job = self._client.jobs.get(job_id)
+        if job is None:
+            raise LocalBatchError("JobNotFound", f"Job {job_id} not found")
+        if job.state == JobState.deleting and time.monotonic() >= job.deleted_at:
+            del self._client.jobs[job_id]
+            self._client.tasks.pop(job_id, None)
+            raise LocalBatchError("JobNotFound", f"Job {job_id} not found")
+        return job
+
+    def add(self, job):
+        self._call()
+        with self._client.lock:
+            try:
+                self._job(job.id)
+            except LocalBatchError:
+                pass
+            else:
+                raise LocalBatchError("JobExists", f"Job {job.id} already exists")
+
+            self._client.jobs[job.id] = CloudJob(
+                id=job.id,
+                state=JobState.active,
+                creation_time=self._client.timestamp(),
+                uses_task_dependencies=job.uses_task_dependencies,
+                priority=job.priority,
+                constraints=job.constraints,
+                job_manager_task=job.job_manager_task,
+                pool_info=job.pool_info,
+                metadata=job.metadata,
+            )
+            self._client.tasks[job.id] = {}
+
+            # The job manager task is listed with the tasks, and started before them
+            if job.job_manager_task is not None:
+                tasks = self._client.tasks[job.id]
+                self._client.task._add(tasks, job.job_manager_task)
+
+    def get(self, job_id):
+        self._call()
+        with self._client.lock:
+            return self._job(job_id)
+
+    def list(self):
+        self._call()
+        with self._client.lock:
+            jobs = []
+            for job_id in list(self._client.jobs):
+                try:
+                    jobs.append(self._job(job_id))
+                except LocalBatchError:
+                    pass
+            return jobs
+
+    def patch(self, job_id, job_patch_parameter):
+        self._call()
+        with self._client.lock:
+            job = self._job(job_id)
+            if job.state != JobState.active:
+                raise LocalBatchError(
+                    "JobNotActive", f"Job {job_id} is {job.state.value}"
+                )
+            for name in ("priority", "constraints", "pool_info", "metadata"):
+                value = getattr(job_patch_parameter, name)
+                if value is not None:
+                    setattr(job, name, value)
+
+    def delete(self, job_id):
+        self._call()
+        with self._client.lock:
+            job = self._job(job_id)
+            if job.state == JobState.deleting:
+                raise LocalBatchError(
+                    "JobBeingDeleted", f"Job {job_id} is being deleted"
+                )
+            job.state = JobState.deleting
+            job.deleted_at = time.monotonic() + self._client.delete_seconds
+
+
+class TaskOperations(_Operations):
+    def _tasks(self, job_id):
+        job = self._client.job._job(job_id)
+        if job.state != JobState.active:
+            raise LocalBatchError("JobNotActive", f"Job {job_id} is {job.state.value}")
+        return self._client.tasks[job_id]
+
+    def _add(self, tasks, task):
+        if task.id in tasks:
+            raise LocalBatchError("TaskExists", f"Task {task.id} already exists")
+        tasks[task.id] = CloudTask(
+            id=task.id,
+            display_name=task.display_name,
+            command_line=task.command_line,
+            container_settings=task.container_settings,
+            environment_settings=task.environment_settings,
+            depends_on=getattr(task, "depends_on", None),
+            constraints=task.constraints,
+            user_identity=task.user_identity,
+            state=TaskState.active,
+            creation_time=self._client.timestamp(),
+        )
+
+    def add(self, job_id, task):
+        self._call()
+        with self._client.lock:
+            self._add(self._tasks(job_id), task)
+
+    def add_collection(self, job_id, value, **kwargs):
+        self._call()
+        if len(value) > MAX_TASKS_PER_REQUEST:
+            raise LocalBatchError(
+                "RequestBodyTooLarge",
+                f"At most {MAX_TASKS_PER_REQUEST} tasks can be added at a time",
+            )
+
+        results = []
+        with self._client.lock:
+            tasks = self._tasks(job_id)
+            for task in value:
+                try:
+                    self._add(tasks, task)
+                except LocalBatchError as ex:
+                    results.append(
+                        TaskAddResult(
+                            status=TaskAddStatus.client_error,
+                            task_id=task.id,
+                            error=ex.error,
+                        )
+                    )
+                else:
+                    results.append(
+                        TaskAddResult(status=TaskAddStatus.success, task_id=task.id)
+                    )
+        return TaskAddCollectionResult(value=results)
+
+    def get(self, job_id, task_id):
+        self._call()
+        with self._client.lock:
+            self._client.job._job(job_id)
+            tasks = self._client.tasks[job_id]
+            if task_id not in tasks:
+                raise LocalBatchError("TaskNotFound", f"Task {task_id} not found")
+            return tasks[task_id]
+
+    def list(self, job_id):
+        self._call()
+        with self._client.lock:
+            self._client.job._job(job_id)
+            return list(self._client.tasks[job_id].values())
+
+    def delete(self, job_id, task_id):
+        self._call()
+        with self._client.lock:
+            self._client.job._job(job_id)
+            if self._client.tasks[job_id].pop(task_id, None) is None:
+                raise LocalBatchError("TaskNotFound", f"Task {task_id} not found")
+
+
+def _succeeded(task):
+    return (
+        task is not None
+        and task.state == TaskState.completed
+        and task.execution_info.result == TaskExecutionResult.success
+    )
+
+
+class LocalBatchClient:
+    """
+    In-memory BatchServiceClient.
+
+    The tasks only run with `run_tasks`, once the client is started, e.g. by using it
+    as a context manager. A task taking a second of wall clock time then takes
+    `speedup` simulated seconds, like every other delay of the simulation.
+
+    Args:
+        latency (float): Seconds each request takes.
+        delete_seconds (float): Seconds a deleted job takes to be gone.
+        run_tasks (bool): Whether to simulate the nodes of the pools and run the
+            tasks on them.
+        speedup (float): Simulated seconds per second of wall clock time.
+        node_start_seconds (float): Simulated seconds a node takes to start.
+        command (str): Shell command run locally instead of the command line of the
+            tasks, other than the job manager tasks, e.g. `sleep 2` for synthetic
+            loads.
+        docker (bool): Whether to run the tasks with container settings in their
+            container instead of a local process.
+        cwd (str): Directory of the local processes, the one of the image.
+        log_dir (str): Directory of the output of each task attempt, a temporary one
+            by default.
+        tick (float): Seconds between two steps of the simulation.
+    """
+
+    def __init__(
+        self,
+        latency=0.05,
+        delete_seconds=2.0,
+        run_tasks=False,
+        speedup=1.0,
+        node_start_seconds=0.0,
+        command=None,
+        docker=False,
+        cwd=None,
+        log_dir=None,
+        tick=0.05,
+    ):
+        if docker and shutil.which("docker") is None:
+            raise ValueError("docker isn't installed")
+
+        self.latency = latency
+        self.delete_seconds = delete_seconds
+        self.requests = 0
+        self.lock = threading.RLock()
+        self.pools, self.jobs, self.tasks = {}, {}, {}
+
+        self.pool = PoolOperations(self)
+        self.job = JobOperations(self)
+        self.task = TaskOperations(self)
+
+        self.run_tasks = run_tasks
+        self.speedup = speedup
+        self.node_start_seconds = node_start_seconds
+        self.command = command
+        self.docker = docker
+        self.cwd = cwd or os.path.dirname(os.path.abspath(__file__))
+        self.log_dir = log_dir or tempfile.mkdtemp(prefix="local-batch-")
+        self.tick = tick
+
+        self.simulated = {}
+        self._runs = []
+        self._started = time.monotonic()
+        self._created = datetime.datetime.now(datetime.timezone.utc)
+        self._last_step = 0.0
+        self._thread, self._stopped, self._error = None, threading.Event(), None
+
+    def now(self):
+        """Simulated seconds since the client was created"""
+        return (time.monotonic() - self._started) * self.speedup
+
+    def timestamp(self, seconds=None):
+        """Simulated time, as a datetime"""
+        seconds = self.now() if seconds is None else seconds
+        return self._created + datetime.timedelta(seconds=seconds)
+
+    def _seconds(self, timestamp):
+        return (timestamp - self._created).total_seconds()
+
+    def start(self):
+        if self.run_tasks and self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the simulation, killing the tasks still running"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+        with self.lock:
+            for run in list(self._runs):
+                run.process.kill()
+                run.process.wait()
+                self._release(run)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def wait(self, timeout=None):
+        """
+        Waits until no task is running or ready to run.
+
+        As in the service, the tasks depending on a task that failed never get ready.
+
+        Returns:
+            dict: The report of the run.
+
+        Raises:
+            TimeoutError: If tasks are still running after `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout if timeout else math.inf
+        while True:
+            if self._error is not None:
+                raise RuntimeError("The simulation stopped") from self._error
+            with self.lock:
+                if not self._runs and not any(
+                    self._ready_tasks(job) for job in self._active_jobs()
+                ):
+                    return self.report()
+            if time.monotonic() > deadline:
+                raise TimeoutError("Tasks still running")
+            time.sleep(self.tick)
+
+    def report(self):
+        """
+        Latency of each job and utilisation of the nodes of each pool.
+
+        The latency of a job goes from its creation to the end of its last task, in
+        simulated seconds, and is None while tasks are left, including the ones
+        blocked by a failed task. Nodes count as allocated while starting too.
+        """
+        with self.lock:
+            jobs = {}
+            for job in self._active_jobs():
+                tasks = list(self.tasks[job.id].values())
+                ended = [
+                    self._seconds(task.execution_info.end_time)
+                    for task in tasks
+                    if task.state == TaskState.completed
+                ]
+                succeeded = sum(_succeeded(task) for task in tasks)
+                unfinished = len(tasks) - len(ended)
+                jobs[job.id] = {
+                    "tasks": len(tasks),
+                    "succeeded": succeeded,
+                    "failed": len(ended) - succeeded,
+                    "unfinished": unfinished,
+                    "latency": (
+                        round(max(ended) - self._seconds(job.creation_time), 1)
+                        if ended and not unfinished
+                        else None
+                    ),
+                }
+
+            pools = {}
+            for pool_id, simulated in self.simulated.items():
+                pools[pool_id] = {
+                    "nodes": len(simulated.nodes),
+                    "max_nodes": simulated.max_nodes,
+                    "node_seconds": round(simulated.node_seconds, 1),
+                    "busy_node_seconds": round(simulated.busy_seconds, 1),
+                    "utilisation": (
+                        round(simulated.busy_seconds / simulated.node_seconds, 3)
+                        if simulated.node_seconds
+                        else None
+                    ),
+                }
+
+            return {
+                "simulated_seconds": round(self.now(), 1),
+                "requests": self.requests,
+                "jobs": jobs,
+                "pools": pools,
+            }
+
+    def evaluate(self, pool_id, formula):
+        """
+        Evaluates a formula on the current samples of a pool.
+
+        Returns:
+            tuple: The AutoScaleRun and the variables assigned, None on errors.
+        """
+        now = self.now()
+        try:
+            results = formula.evaluate(self._formula_variables(pool_id, now))
+        except FormulaError as ex:
+            error = AutoScaleRunError(code="FormulaEvaluationError", message=str(ex))
+            return AutoScaleRun(timestamp=self.timestamp(now), error=error), None
+        run = AutoScaleRun(
+            timestamp=self.timestamp(now), results=_format_results(results)
+        )
+        return run, results
+
+    def _loop(self):
+        try:
+            while not self._stopped.wait(self.tick):
+                with self.lock:
+                    self._step()
+        except Exception as ex:
+            self._error = ex
+            raise
+
+    def _step(self):
+        now = self.now()
+        elapsed, self._last_step = now - self._last_step, now
+        for simulated in self.simulated.values():
+            busy = sum(node.run is not None for node in simulated.nodes)
+            simulated.node_seconds += elapsed * len(simulated.nodes)
+            simulated.busy_seconds += elapsed * busy
+
+        self._reap(now)
+        for pool_id, simulated in self.simulated.items():
+            if now >= simulated.next_sample:
+                simulated.samples.append((now, *self._task_counts(pool_id)))
+                simulated.next_sample = now + SAMPLE_INTERVAL
+            if simulated.formula is not None and now >= simulated.next_evaluation:
+                self._autoscale(pool_id, now)
+            self._resize(pool_id, now)
+        self._schedule(now)
+
+    def _active_jobs(self):
+        return [job for job in self.jobs.values() if job.state == JobState.active]
+
+    def _pool_id(self, job):
+        return job.pool_info.pool_id if job.pool_info is not None else None
+
+    def _ready_tasks(self, job):
+        """Active tasks of a job whose dependencies succeeded"""
+        tasks = self.tasks[job.id]
+        manager = job.job_manager_task
+        if manager is not None and tasks[manager.id].state == TaskState.active:
+            return [tasks[manager.id]]
+
+        ready = []
+        for task in tasks.values():
+            depends_on = task.depends_on.task_ids if task.depends_on else []
+            if task.state == TaskState.active and all(
+                _succeeded(tasks.get(task_id)) for task_id in depends_on
+            ):
+                ready.append(task)
+        return ready
+
+    def _task_counts(self, pool_id):
+        """Tasks of the jobs of a pool ready to run, and running"""
+        active = running = 0
+        for job in self._active_jobs():
+            if self._pool_id(job) == pool_id:
+                tasks = self.tasks[job.id].values()
+                active += len(self._ready_tasks(job))
+                running += sum(task.state == TaskState.running for task in tasks)
+        return active, running
+
+    def _formula_variables(self, pool_id, now):
+        pool, simulated = self.pools[pool_id], self.simulated[pool_id]
+        samples = list(simulated.samples)
+        pending = [(at, active + running) for at, active, running in samples]
+        return {
+            "$ActiveTasks": Metric([(at, active) for at, active, _ in samples], now),
+            "$RunningTasks": Metric([(at, running) for at, _, running in samples], now),
+            # Tasks ready to run or running, as in the service
+            "$PendingTasks": Metric(pending, now),
+            "$CurrentDedicatedNodes": float(len(simulated.nodes)),
+            "$TargetDedicatedNodes": float(pool.target_dedicated_nodes or 0),
+            "$CurrentLowPriorityNodes": 0.0,
+            "$TargetLowPriorityNodes": 0.0,
+            "$NodeDeallocationOption": simulated.deallocation,
+        }
+
+    def _autoscale(self, pool_id, now):
+        pool, simulated = self.pools[pool_id], self.simulated[pool_id]
+        simulated.next_evaluation = now + simulated.interval
+        pool.auto_scale_run, results = self.evaluate(pool_id, simulated.formula)
+        if results is None:
+            return
+
+        # Fractions of nodes are rounded down
+        pool.target_dedicated_nodes = max(0, int(results["$TargetDedicatedNodes"]))
+        simulated.deallocation = str(results["$NodeDeallocationOption"])
+
+    def _resize(self, pool_id, now):
+        """Allocates or removes nodes to reach the target of the pool"""
+        pool, simulated = self.pools[pool_id], self.simulated[pool_id]
+        kept = [node for node in simulated.nodes if not node.removing]
+        target = pool.target_dedicated_nodes or 0
+
+        for _ in range(target - len(kept)):
+            simulated.allocated += 1
+            node = _Node(
+                f"{pool_id}-node-{simulated.allocated}",
+                ready_at=now + self.node_start_seconds,
+            )
+            simulated.nodes.append(node)
+
+        # The nodes running a task are the last ones removed
+        for node in sorted(kept, key=lambda node: node.run is None)[target:]:
+            node.removing = True
+            if node.run is None:
+                simulated.nodes.remove(node)
+            elif simulated.deallocation in ("requeue", "terminate"):
+                self._preempt(
+                    node.run, now, requeue=simulated.deallocation == "requeue"
+                )
+
+        pool.current_dedicated_nodes = len(simulated.nodes)
+        simulated.max_nodes = max(simulated.max_nodes, len(simulated.nodes))
+
+    def _schedule(self, now):
+        """Starts the ready tasks on the free nodes, by job priority"""
+        jobs = sorted(self._active_jobs(), key=lambda job: -(job.priority or 0))
+        for job in jobs:
+            simulated = self.simulated.get(self._pool_id(job))
+            if simulated is None:
+                continue
+            for task in self._ready_tasks(job):
+                free = [
+                    node
+                    for node in simulated.nodes
+                    if node.run is None and not node.removing and node.ready_at <= now
+                ]
+                if not free:
+                    break
+                self._start(job, task, free[0], now)
+
+    def _arguments(self, job, task):
+        manager = job.job_manager_task
+        if self.command and (manager is None or task.id != manager.id):
+            return ["bash", "-c", self.command]
+
+        arguments = shlex.split(task.command_line)
+        settings = task.container_settings
+        if self.docker and settings is not None:
+            # The values of the variables are taken from the environment of docker
+            variables = [
+                argument
+                for setting in task.environment_settings or []
+                for argument in ("-e", setting.name)
+            ]
+            options = shlex.split(settings.container_run_options or "")
+            image = settings.image_name
+            return ["docker", "run", "--rm", *variables, *options, image, *arguments]
+
+        # The command lines are the arguments of run.py, the entrypoint of the images
+        return [sys.executable, "run.py", *arguments]
+
+    def _start(self, job, task, node, now):
+        info = task.execution_info or TaskExecutionInformation(
+            retry_count=0, requeue_count=0
+        )
+        info.start_time, info.end_time, info.exit_code = self.timestamp(now), None, None
+        task.execution_info, task.state = info, TaskState.running
+
+        attempt = info.retry_count + info.requeue_count
+        log_file = os.path.join(self.log_dir, f"{job.id}.{task.id}.{attempt}.log")
+        log = open(log_file, "wb")
+        environment = {
+            setting.name: setting.value for setting in task.environment_settings or []
+        }
+        process = subprocess.Popen(
+            self._arguments(job, task),
+            cwd=self.cwd,
+            env={**os.environ, **environment},
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+
+        timeout = task.constraints.max_wall_clock_time if task.constraints else None
+        if isinstance(timeout, datetime.timedelta):
+            deadline = now + timeout.total_seconds()
+        else:
+            deadline = math.inf
+        node.run = _Run(
+            job.id, task.id, self._pool_id(job), node, process, log, deadline
+        )
+        self._runs.append(node.run)
+
+    def _release(self, run):
+        run.log.close()
+        self._runs.remove(run)
+        run.node.run = None
+        simulated = self.simulated.get(run.pool_id)
+        if run.node.removing and simulated is not None:
+            simulated.nodes.remove(run.node)
+
+    def _reap(self, now):
+        """Completes the tasks whose process exited or ran out of time"""
+        for run in list(self._runs):
+            job = self.jobs.get(run.job_id)
+            task = self.tasks.get(run.job_id, {}).get(run.task_id)
+            gone = (
+                job is None
+                or job.state != JobState.active
+                or task is None
+                or run.pool_id not in self.simulated
+            )
+
+            code = run.process.poll()
+            timed_out = code is None and now >= run.deadline
+            if code is None and not (gone or timed_out):
+                continue
+            if code is None:
+                run.process.kill()
+                code = run.process.wait()
+
+            self._release(run)
+            if not gone:
+                # As in the service, tasks that ran out of time aren't retried
+                self._complete(job, task, code, now, retry=not timed_out)
+
+    def _complete(self, job, task, code, now, retry=True):
+        info = task.execution_info
+        info.end_time, info.exit_code = self.timestamp(now), code
+        if code and retry and info.retry_count < self._retries(job, task):
+            info.retry_count += 1
+            info.last_retry_time = self.timestamp(now)
+            task.state = TaskState.active
+        else:
+            info.result = (
+                TaskExecutionResult.success
+                if code == 0
+                else TaskExecutionResult.failure
+            )
+            task.state = TaskState.completed
+
+    def _preempt(self, run, now, requeue):
+        """Stops the task of a node being removed, requeuing it or failing it"""
+        job, task = self.jobs[run.job_id], self.tasks[run.job_id][run.task_id]
+        run.process.kill()
+        code = run.process.wait()
+        self._release(run)
+        if requeue:
+            task.execution_info.requeue_count += 1
+            task.execution_info.last_requeue_time = self.timestamp(now)
+            task.state = TaskState.active
+        else:
+            self._complete(job, task, code, now, retry=False)
+
+    def _retries(self, job, task):
+        retries = None
+        for constraints in (task.constraints, job.constraints):
+            if retries is None and constraints is not None:
+                retries = constraints.max_task_retry_count
+        # -1 retries without limit
+        return math.inf if retries == -1 else retries or 0
+
+
+def benchmark(nodes, autoscale, interval, speedup, node_start, command, docker):
+    """
+    Deploys the DAGs of dags.yaml to an emulated pool and runs them to the end.
+
+    Returns:
+        dict: The report of the run, with the directory of the logs of the tasks.
+    """
+    from azure.batch.models import PoolAddParameter
+
+    import deploy_infra
+
+    # The tasks are given the credentials of the deploy, the emulator needs none
+    for name in ("AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID"):
+        os.environ.setdefault(name, "")
+
+    client = LocalBatchClient(
+        latency=0,
+        delete_seconds=0,
+        run_tasks=True,
+        speedup=speedup,
+        node_start_seconds=node_start,
+        command=command,
+        docker=docker,
+    )
+    formula = None
+    if autoscale:
+        with open(autoscale) as file:
+            formula = file.read()
+    client.pool.add(
+        PoolAddParameter(
+            id=deploy_infra.pool_id,
+            vm_size="Standard_D2_v3",
+            target_dedicated_nodes=None if formula else nodes,
+            enable_auto_scale=formula is not None,
+            auto_scale_formula=formula,
+            auto_scale_evaluation_interval=datetime.timedelta(minutes=interval),
+        )
+    )
+
+    with client:
+        deploy_infra.run_job(client)
+        report = client.wait()
+    report["log_dir"] = client.log_dir
+    return report
+
+
+if __name__ == "__main__":
+    import json
+
+    import click
+
+    @click.command()
+    @click.option("--nodes", default=1, help="Dedicated nodes of a fixed size pool")
+    @click.option(
+        "--autoscale",
+        type=click.Path(exists=True, dir_okay=False),
+        help="Autoscale formula of the pool instead, e.g. tf/autoscale.txt",
+    )
+    @click.option(
+        "--interval", default=15.0, help="Minutes between autoscale evaluations"
+    )
+    @click.option(
+        "--speedup", default=60.0, help="Simulated seconds per wall clock second"
+    )
+    @click.option(
+        "--node-start", default=180.0, help="Simulated seconds a node takes to start"
+    )
+    @click.option("--command", help="Shell command run instead of each task")
+    @click.option("--docker", is_flag=True, help="Run the tasks in their container")
+    def main(**kwargs):
+        print(json.dumps(benchmark(**kwargs), indent=2))
+
+    main()
@@ -1,10 +1,18 @@
 import importlib
+import json
 import logging
+import os
+from pathlib import Path
 
 import click
 
 logger = logging.getLogger(__name__)
 
+DAGS_FILE = Path(__file__).parent / "dags.yaml"
+# dags.yaml parsed, as JSON, so the commands reading it don't import yaml until it
+# changes. Rewritten under the modification time and size of dags.yaml
+DAGS_CACHE = Path(__file__).parent / "__pycache__" / "dags.yaml.json"
+
 try:
     import colored_traceback
 
@@ -21,9 +29,12 @@ def run():
 @run.command("task")
 @click.argument("dag")
 @click.argument("task")
-def task(dag, task):
+@click.option("--force", is_flag=True, help="Run the task even when it's up to date")
+def task(dag, task, force):
+    from dags.runner import run_task
+
     try:
-        mod = importlib.import_module(f"dags.{dag}")
+        importlib.import_module(f"dags.{dag}")
     except ModuleNotFoundError as ex:
         if "dag" not in ex.args[0]:
             raise
@@ -31,31 +42,183 @@ def task(dag, task):
         logger.exception(ex)
         raise SystemExit(1)
 
-    mod.run_dag(task)
+    run_task(dag, task, force)
+
+
+@run.command("dag")
+@click.argument("dag")
+@click.option("--workers", type=int, help="Maximum number of tasks running at a time")
+@click.option(
+    "--processes", is_flag=True, help="Run the tasks on processes instead of threads"
+)
+@click.option(
+    "--force", is_flag=True, help="Run the tasks even when they're up to date"
+)
+def dag(dag, workers, processes, force):
+    from dags.engine import run_dag
+
+    dags = get_dags()
+
+    if dag not in dags:
+        click.secho(f"ERROR: DAG '{dag}' not found in dags.yaml")
+        raise SystemExit(1)
+
+    status = run_dag(dag, dags[dag], workers=workers, processes=processes, force=force)
+    if any(value != "done" for value in status.values()):
+        raise SystemExit(1)
+
+
+@run.command("backfill")
+@click.argument("dag")
+@click.option("--start", required=True, help="First date of the range, YYYY-MM-DD")
+@click.option("--end", required=True, help="Last date of the range, YYYY-MM-DD")
+@click.option("--workers", type=int, help="Maximum number of partitions at a time")
+@click.option(
+    "--batch",
+    "batch_tasks",
+    type=int,
+    help="Split the range into this many parallel tasks of the Batch pool",
+)
+@click.option("--force", is_flag=True, help="Rewrite the partitions already complete")
+def backfill(dag, start, end, workers, batch_tasks, force):
+    """
+    Rewrites the date partitions of DAG from START to END, both included
+
+    Only the dates with a partition in the watermark of the daily run are rewritten,
+    the ones before it recorded its partitions are skipped with a warning.
+    """
+    import datetime
+
+    first = datetime.date.fromisoformat(start)
+    last = datetime.date.fromisoformat(end)
+    if last < first:
+        click.secho("ERROR: --end precedes --start")
+        raise SystemExit(1)
+
+    if batch_tasks:
+        from deploy_infra import submit_backfill
+
+        submit_backfill(dag, first, last, batch_tasks, workers=workers, force=force)
+        return
+
+    from dags.runner import run_backfill
+
+    days = (last - first).days + 1
+    dates = [(first + datetime.timedelta(days=day)).isoformat() for day in range(days)]
+    if run_backfill(dag, dates, workers=workers, force=force):
+        raise SystemExit(1)
+
+
+@run.command("serve")
+@click.option("--host", default="127.0.0.1", help="Address to listen on")
+@click.option("--port", type=int, default=8080, help="Port to listen on")
+@click.option(
+    "--unix",
+    "unix_socket",
+    type=click.Path(dir_okay=False),
+    help="Listen on this Unix socket instead of a TCP port",
+)
+@click.option("--max-batch", type=int, help="Most readings scored at a time")
+@click.option(
+    "--batch-wait", type=float, help="Seconds a batch waits for more readings"
+)
+def serve(host, port, unix_socket, max_batch, batch_wait):
+    """Scores sensor readings over HTTP with the latest model"""
+    from dags.visualization.serving import serve
+
+    serve(host, port, unix_socket, max_batch=max_batch, batch_wait=batch_wait)
 
 
 @run.command("list-tasks")
 @click.argument("dag")
 def list_tasks(dag):
+    from dags.engine import parse_tasks
 
     dags = get_dags()
 
     if dag not in dags:
         click.secho(f"ERROR: DAG '{dag}' not found in dags.yaml")
+        raise SystemExit(1)
 
-    for task in dags[dag]:
-        print(task)
+    for task in parse_tasks(dags[dag]).values():
+        depends_on = f" (after {', '.join(task.depends_on)})" if task.depends_on else ""
+        print(f"{task.name}{depends_on}")
+
+
+@run.command("startup-profile")
+@click.argument("dag")
+@click.option(
+    "--module", "modules", multiple=True, help="Other module imported, e.g. a task's"
+)
+@click.option("--top", default=20, help="Number of modules listed")
+def startup_profile(dag, modules, top):
+    """Import time of each module imported to start a task of DAG, slowest first"""
+    import subprocess
+    import sys
+
+    code = "; ".join(
+        [
+            "import run",
+            "from dags import logging",
+            "from dags.runner import get_tasks",
+            f"get_tasks({dag!r})",
+            *(f"import {module}" for module in modules),
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode:
+        click.secho(result.stderr, err=True)
+        raise SystemExit(result.returncode)
+
+    # "import time: self [us] | cumulative | imported package", nested imports are
+    # indented under the module importing them
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    total = sum(cumulative for cumulative, _, name in imports if name[1] != " ")
+    print(f"{len(imports)} modules imported in {total / 1000:.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative, self_us, name in sorted(imports, reverse=True)[:top]:
+        print(f"{cumulative / 1000:>14.1f} {self_us / 1000:>8.1f}  {name.strip()}")
 
 
 def get_dags():
-    from pathlib import Path
+    stat = DAGS_FILE.stat()
+    key = [stat.st_mtime_ns, stat.st_size]
+    try:
+        with DAGS_CACHE.open("r") as fo:
+            cached = json.load(fo)
+        if cached["key"] == key:
+            return cached["dags"]
+    except (OSError, ValueError, KeyError):
+        pass
 
     import yaml
 
-    dags_file = Path(__file__).parent / "dags.yaml"
+    # The C parser of libyaml, when PyYAML was built with it
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+    with DAGS_FILE.open("r") as fo:
+        dags = yaml.load(fo, Loader=loader)
 
-    with dags_file.open("r") as fo:
-        dags = yaml.safe_load(fo)
+    # Written to a temporary name first, so a concurrent run never reads half of it.
+    # A read-only install parses dags.yaml every time
+    try:
+        content = json.dumps({"key": key, "dags": dags})
+        DAGS_CACHE.parent.mkdir(exist_ok=True)
+        tmp = DAGS_CACHE.with_name(f".{DAGS_CACHE.name}.{os.getpid()}")
+        tmp.write_text(content)
+        os.replace(tmp, DAGS_CACHE)
+    except (OSError, TypeError):
+        pass
     return dags
 
 
@@ -0,0 +1,74 @@
+import pytest
+
+from dags import config
+from dags.storage import cache
+
+ACCOUNT = "abfs://testaccount.dfs.core.windows.net/testing"
+
+
+@pytest.fixture
+def local_store(tmp_path, monkeypatch):
+    """Local stand-in of the storage account, answering each request after 20ms"""
+    monkeypatch.setattr(config, "LOCAL_BLOB_ROOT", str(tmp_path / "blob"))
+    monkeypatch.setattr(config, "LOCAL_BLOB_LATENCY", 0.02)
+    monkeypatch.setattr(config, "LOCAL_BLOB_BANDWIDTH", 0.0)
+    return ACCOUNT
+
+
+@pytest.fixture
+def store(local_store, tmp_path, monkeypatch):
+    """Local stand-in of the storage account without latency, with an empty cache"""
+    monkeypatch.setattr(config, "LOCAL_BLOB_LATENCY", 0.0)
+    monkeypatch.setattr(config, "BLOB_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache, "_cache", None)
+    return local_store
+
+
+@pytest.fixture(scope="session")
+def equipment():
+    """3000 rows of synthetic equipment data"""
+    import pandas as pd
+
+    from benchmarks.synthetic import generate
+
+    return pd.concat(generate(3000), ignore_index=True)
+
+
+@pytest.fixture(scope="session")
+def scoring_model(equipment):
+    """Builds the feature state and a scorer of the equipment data for shard keys"""
+    import numpy as np
+
+    from dags.data.schema import SENSORS
+    from dags.features.engineering import FEATURES, build_features, fit_state
+    from dags.models.scorer import LinearScorer
+
+    def build(shard_keys=()):
+        state = fit_state(equipment, SENSORS)
+        state.shard_keys = list(shard_keys)
+        X = build_features(equipment, state).astype(np.float64)
+        state.scaler_mean, state.scaler_scale = X.mean(axis=0), X.std(axis=0)
+        coef = np.random.default_rng(0).normal(0, 1, len(FEATURES))
+        scorer = LinearScorer(
+            coef, -0.5, [0, 1], state.scaler_mean, state.scaler_scale, threshold=0.5
+        )
+        return state, scorer
+
+    return build
+
+
+@pytest.fixture
+def saved_model(store, equipment):
+    """Path of a logistic regression of the equipment data saved as the latest model"""
+    from sklearn.linear_model import LogisticRegression
+
+    from dags.data.schema import SENSORS, TARGET
+    from dags.features.engineering import FEATURES, build_features, fit_state
+    from dags.models.artifact import save_model
+
+    state = fit_state(equipment, SENSORS)
+    X = build_features(equipment, state)
+    state.scaler_mean, state.scaler_scale = X.mean(axis=0), X.std(axis=0)
+    X = (X - state.scaler_mean) / state.scaler_scale
+    model = LogisticRegression().fit(X, equipment[TARGET])
+    return save_model(model, state, FEATURES, threshold=0.5)
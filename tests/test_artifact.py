@@ -0,0 +1,73 @@
+import hashlib
+import json
+from io import BytesIO
+
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+
+from dags.features.engineering import FEATURES
+from dags.models.artifact import (
+    latest_model_path,
+    load_model,
+    read_artifact,
+    save_model,
+    write_artifact,
+)
+from dags.storage import blob
+
+
+@pytest.fixture
+def model():
+    rng = np.random.default_rng(0)
+    X = rng.normal(0, 1, (500, len(FEATURES)))
+    y = X[:, 0] + rng.normal(0, 1, 500) > 1
+    return LogisticRegression(C=0.5, class_weight={0: 1, 1: 3}).fit(X, y)
+
+
+def test_artifact_round_trip(saved_model, model):
+    artifact = load_model(saved_model)
+    assert artifact.features == FEATURES
+    assert artifact.threshold == 0.5
+    # The arrays are read-only views over the memory map of the file
+    assert not artifact.coef.flags.owndata and not artifact.coef.flags.writeable
+    for name in ["coef", "intercept", "classes", "scaler_mean", "scaler_scale"]:
+        assert artifact.arrays[name].ctypes.data % 64 == 0
+
+    buffer = BytesIO()
+    write_artifact(model, artifact.state, FEATURES, buffer, training={"rows": 500})
+    loaded = read_artifact(buffer.getbuffer())
+    np.testing.assert_array_equal(loaded.coef, model.coef_)
+    np.testing.assert_array_equal(loaded.intercept, model.intercept_)
+    np.testing.assert_array_equal(loaded.classes, model.classes_)
+    assert loaded.params == {"solver": "lbfgs", "C": 0.5, "class_weight": {0: 1, 1: 3}}
+    assert loaded.training == {"rows": 500}
+    assert loaded.state.to_dict() == artifact.state.to_dict()
+    np.testing.assert_array_equal(loaded.state.scaler_mean, artifact.state.scaler_mean)
+
+    X = np.random.default_rng(1).normal(0, 1, (10, len(FEATURES)))
+    np.testing.assert_array_equal(
+        loaded.to_estimator().predict_proba(X), model.predict_proba(X)
+    )
+
+
+def test_models_saved_under_their_hash(saved_model, model):
+    assert latest_model_path() == saved_model
+    with open(blob.local_path(saved_model), "rb") as file_obj:
+        version = hashlib.sha256(file_obj.read()).hexdigest()[:16]
+    assert saved_model.split("/")[-2] == version
+
+    state = load_model(saved_model).state
+    path = save_model(model, state, FEATURES, evaluation={"f1": 0.5})
+    assert path != saved_model
+    assert latest_model_path() == path
+    with open(blob.local_path(path.replace("model.bin", "evaluation.json"))) as f:
+        assert json.load(f) == {"f1": 0.5}
+
+    # Saving the same model again points LATEST.json back to the same files
+    assert save_model(model, state, FEATURES, evaluation={"f1": 0.5}) == path
+
+
+def test_not_an_artifact():
+    with pytest.raises(ValueError, match="Not a model artifact"):
+        read_artifact(b"\x80\x04pickle")
@@ -0,0 +1,62 @@
+import json
+import logging
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import write_trusted
+from dags.paths import predictions_path, success_path
+from dags.storage import blob
+from dags.visualization import inference
+from dags.visualization.backfill import backfill_predictions
+
+DATES = ["2026-09-30", "2026-10-01", "2026-10-02"]
+
+
+def read(date):
+    return pd.read_parquet(blob.local_path(predictions_path(date)))
+
+
+def marker(date):
+    with open(blob.local_path(success_path(date))) as file_obj:
+        return json.load(file_obj)
+
+
+@pytest.fixture
+def partitions(saved_model):
+    """Predictions of two daily runs, on 2026-10-01 and 2026-10-02"""
+    write_trusted(2000)
+    inference.predictions("2026-10-01", chunksize=700)
+    write_trusted(3000)
+    inference.predictions("2026-10-02", chunksize=700)
+    return {date: read(date) for date in DATES[1:]}
+
+
+def test_backfill_skips_complete_partitions(partitions, caplog):
+    caplog.set_level(logging.INFO, logger="dags.visualization.backfill")
+    markers = {date: marker(date) for date in partitions}
+
+    assert backfill_predictions(DATES, workers=2) == []
+    assert "Skipping 2 complete partitions" in caplog.text
+    # The date before the first daily run has no partition to rewrite
+    assert "No partition recorded for 1 dates" in caplog.text
+    assert not blob.exists(predictions_path(DATES[0]))
+    for date, predictions in partitions.items():
+        pd.testing.assert_frame_equal(read(date), predictions)
+        assert marker(date) == markers[date]
+
+
+def test_backfill_rescores_incomplete_partitions(saved_model, partitions, caplog):
+    caplog.set_level(logging.INFO, logger="dags.visualization.backfill")
+    # A backfill interrupted while writing the partition of 2026-10-02
+    os.remove(blob.local_path(success_path("2026-10-02")))
+    with open(blob.local_path(predictions_path("2026-10-02")), "wb"):
+        pass
+
+    assert backfill_predictions(DATES, workers=2) == []
+    assert "Skipping 1 complete partitions" in caplog.text
+    assert "Partition 2026-10-02 scored, 1000 rows" in caplog.text
+    # The rows before the partition warm its rolling windows up as in the daily run
+    pd.testing.assert_frame_equal(read("2026-10-02"), partitions["2026-10-02"])
+    assert marker("2026-10-02") == {"model": saved_model, "start": 2000, "stop": 3000}
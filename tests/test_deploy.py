@@ -0,0 +1,246 @@
+import datetime
+import os
+import time
+
+import pytest
+from azure.batch.models import (
+    BatchErrorException,
+    JobState,
+    TaskAddParameter,
+    TaskAddResult,
+    TaskAddStatus,
+)
+
+import deploy_infra
+import run
+from dags.engine import parse_tasks
+from local_batch import LocalBatchClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def environment(monkeypatch):
+    for name in ["AZURE_CLIENT_ID", "AZURE_CLIENT_SECRET", "AZURE_TENANT_ID"]:
+        monkeypatch.setenv(name, name.lower())
+    # The version is read from pyproject.toml in the working directory
+    monkeypatch.chdir(ROOT)
+
+
+@pytest.fixture
+def client():
+    return LocalBatchClient(latency=0, delete_seconds=0.05)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Seconds deploy_infra waited, each wait taking a hundredth of it"""
+    delays = []
+    sleep = time.sleep
+
+    def fast(seconds):
+        if seconds:
+            delays.append(seconds)
+        sleep(seconds / 100)
+
+    monkeypatch.setattr(time, "sleep", fast)
+    return delays
+
+
+def dags():
+    return {dag: spec for dag, spec in run.get_dags().items() if dag != "config"}
+
+
+def deployed_tasks(client, job_id):
+    return {
+        task.id: task
+        for task in client.task.list(job_id)
+        if task.id != "mlops-manager-task"
+    }
+
+
+def test_run_job_twice(client):
+    deploy_infra.run_job(client)
+
+    jobs = {job.id: job for job in client.job.list()}
+    assert set(jobs) == {f"test-{dag}" for dag in dags()}
+    for dag, spec in dags().items():
+        tasks = deployed_tasks(client, f"test-{dag}")
+        assert set(tasks) == set(parse_tasks(spec))
+        for name, task in parse_tasks(spec).items():
+            assert tasks[name].command_line == f"task {dag} {name}"
+            depends_on = tasks[name].depends_on
+            assert (depends_on.task_ids if depends_on else []) == task.depends_on
+
+    # The same specs are patched in place, their tasks aren't added again
+    requests = client.requests
+    deploy_infra.run_job(client)
+    # A get and a patch of each job
+    assert client.requests - requests == 2 * len(jobs)
+    for job in client.job.list():
+        assert job.creation_time == jobs[job.id].creation_time
+        assert job.state == JobState.active
+
+
+def add_job(client, spec_hash):
+    manager = deploy_infra._get_job_manager_task("pipeline_daily", "1.0", "predict")
+    return deploy_infra._add_job(client, "test-pipeline_daily", manager, spec_hash)
+
+
+def test_add_job_patches_same_spec(client):
+    assert add_job(client, "a")
+    created = client.job.get("test-pipeline_daily").creation_time
+
+    assert not add_job(client, "a")
+    assert client.job.get("test-pipeline_daily").creation_time == created
+
+
+def test_add_job_recreates_changed_spec(client, sleeps):
+    assert add_job(client, "a")
+    created = client.job.get("test-pipeline_daily").creation_time
+
+    assert add_job(client, "b")
+    job = client.job.get("test-pipeline_daily")
+    assert job.creation_time > created
+    assert {item.value for item in job.metadata} == {"b"}
+    # Waited for the old job to be gone before adding the new one
+    assert sleeps
+
+
+def test_add_job_recreates_job_being_deleted(client, sleeps):
+    assert add_job(client, "a")
+    client.job.delete("test-pipeline_daily")
+
+    # The job isn't deleted a second time, which the service rejects
+    assert add_job(client, "a")
+    assert client.job.get("test-pipeline_daily").state == JobState.active
+
+
+def test_wait_deleted_backs_off(client, sleeps, monkeypatch):
+    monkeypatch.setattr(deploy_infra, "MAX_POLL_DELAY", 4)
+    client.delete_seconds = 0.1
+    add_job(client, "a")
+    client.job.delete("test-pipeline_daily")
+
+    deploy_infra._wait_deleted(client, "test-pipeline_daily")
+    # Waits of 1, 2, 4, 4, ... seconds, a hundredth of them here, until it's gone
+    assert len(sleeps) >= 3
+    assert sleeps == [min(2**i, 4) for i in range(len(sleeps))]
+    with pytest.raises(BatchErrorException):
+        client.job.get("test-pipeline_daily")
+
+
+def test_wait_deleted_times_out(client, sleeps, monkeypatch):
+    monkeypatch.setattr(deploy_infra, "DELETE_TIMEOUT", 0)
+    client.delete_seconds = 60
+    add_job(client, "a")
+    client.job.delete("test-pipeline_daily")
+
+    with pytest.raises(TimeoutError):
+        deploy_infra._wait_deleted(client, "test-pipeline_daily")
+
+
+def tasks_of(names):
+    return [
+        TaskAddParameter(id=name, command_line=f"task dag {name}") for name in names
+    ]
+
+
+@pytest.fixture
+def flaky(client, monkeypatch):
+    """
+    Fails the adds of the tasks in `flaky.failures` with server errors, as many times
+    as it maps them to, and records the ids of the tasks of each request.
+    """
+    add_collection = client.task.add_collection
+
+    def add(job_id, tasks, **kwargs):
+        add.calls.append([task.id for task in tasks])
+        failing = {task.id for task in tasks if add.failures.get(task.id, 0) > 0}
+        for task_id in failing:
+            add.failures[task_id] -= 1
+        added = add_collection(
+            job_id, [task for task in tasks if task.id not in failing], **kwargs
+        )
+        added.value += [
+            TaskAddResult(status=TaskAddStatus.server_error, task_id=task_id)
+            for task_id in failing
+        ]
+        return added
+
+    add.failures, add.calls = {}, []
+    monkeypatch.setattr(client.task, "add_collection", add)
+    return add
+
+
+def test_add_task_collection_retries_failed_adds(client, flaky, sleeps):
+    add_job(client, "a")
+    flaky.failures = {"b": 1, "c": 2}
+
+    deploy_infra._add_task_collection(client, "test-pipeline_daily", tasks_of("abcd"))
+    assert set(deployed_tasks(client, "test-pipeline_daily")) == set("abcd")
+    # Only the failed tasks are sent again
+    assert flaky.calls == [list("abcd"), list("bc"), list("c")]
+    assert sleeps == [1, 2]
+
+
+def test_add_task_collection_gives_up(client, flaky, sleeps, monkeypatch):
+    monkeypatch.setattr(deploy_infra, "TASK_ADD_ATTEMPTS", 3)
+    add_job(client, "a")
+    flaky.failures = {"b": 3}
+
+    with pytest.raises(RuntimeError, match="couldn't be added"):
+        deploy_infra._add_task_collection(client, "test-pipeline_daily", tasks_of("ab"))
+    assert flaky.calls == [["a", "b"], ["b"], ["b"]]
+    assert sleeps == [1, 2, 4]
+
+
+def test_add_task_collection_rejected(client):
+    add_job(client, "a")
+    deploy_infra._add_task_collection(client, "test-pipeline_daily", tasks_of("a"))
+
+    # A task that already exists is a client error, not retried
+    with pytest.raises(RuntimeError, match="TaskExists"):
+        deploy_infra._add_task_collection(client, "test-pipeline_daily", tasks_of("ab"))
+
+
+def test_submit_backfill(client):
+    job_id = deploy_infra.submit_backfill(
+        "pipeline_daily",
+        datetime.date(2026, 1, 1),
+        datetime.date(2026, 1, 10),
+        parts=3,
+        workers=2,
+        force=True,
+        batch_client=client,
+    )
+
+    assert job_id.startswith("test-pipeline_daily-backfill-")
+    tasks = {task.id: task for task in client.task.list(job_id)}
+    assert {task_id: task.command_line for task_id, task in tasks.items()} == {
+        "backfill-2026-01-01-2026-01-03": "backfill pipeline_daily "
+        "--start 2026-01-01 --end 2026-01-03 --workers 2 --force",
+        "backfill-2026-01-04-2026-01-06": "backfill pipeline_daily "
+        "--start 2026-01-04 --end 2026-01-06 --workers 2 --force",
+        "backfill-2026-01-07-2026-01-10": "backfill pipeline_daily "
+        "--start 2026-01-07 --end 2026-01-10 --workers 2 --force",
+    }
+    # The tasks run on the image of the DAG
+    version = deploy_infra._get_version()
+    for task in tasks.values():
+        assert task.container_settings.image_name.endswith(f":{version}-predict")
+
+
+def test_submit_backfill_more_parts_than_days(client):
+    job_id = deploy_infra.submit_backfill(
+        "pipeline_daily",
+        datetime.date(2026, 1, 1),
+        datetime.date(2026, 1, 2),
+        parts=8,
+        batch_client=client,
+    )
+
+    assert {task.command_line for task in client.task.list(job_id)} == {
+        "backfill pipeline_daily --start 2026-01-01 --end 2026-01-01",
+        "backfill pipeline_daily --start 2026-01-02 --end 2026-01-02",
+    }
@@ -0,0 +1,75 @@
+import time
+
+import pytest
+
+from dags import engine
+
+SPEC = {
+    "tasks": {
+        "ingest": None,
+        "slow": {"depends_on": ["ingest"], "retries": 1, "timeout": 0.5},
+        "report": {"depends_on": ["slow"]},
+        "broken": {"depends_on": ["ingest"], "retries": 2},
+        "after_broken": {"depends_on": ["broken"]},
+    }
+}
+
+
+@pytest.fixture
+def runs(tmp_path, monkeypatch):
+    """Starts and ends of the runs of each task, as (event, task, attempt) lines"""
+    log = tmp_path / "runs.log"
+    log.touch()
+
+    def write(*fields):
+        with open(log, "a") as file:
+            file.write(" ".join(map(str, fields)) + "\n")
+
+    def read():
+        return [tuple(line.split()) for line in log.read_text().splitlines()]
+
+    def run_task(dag, task, force):
+        attempt = 1 + sum(line[:2] == ("start", task) for line in read())
+        write("start", task, attempt)
+        if task == "slow" and attempt == 1:
+            time.sleep(1.5)
+        if task == "broken":
+            raise ValueError("broken")
+        write("end", task, attempt)
+
+    monkeypatch.setattr(engine, "_run_task", run_task)
+    return read
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_run_dag(runs, processes):
+    status = engine.run_dag("dag", SPEC, workers=4, processes=processes)
+
+    assert status == {
+        "ingest": "done",
+        "slow": "done",
+        "report": "done",
+        "broken": "failed",
+        "after_broken": "skipped",
+    }
+    events = runs()
+    assert events.count(("start", "broken", "3")) == 1
+    assert events.index(("end", "slow", "2")) < events.index(("start", "report", "1"))
+
+    # The attempt that timed out never runs along with the retry
+    retry = events.index(("start", "slow", "2"))
+    if processes:
+        assert ("end", "slow", "1") not in events
+    else:
+        assert events.index(("end", "slow", "1")) < retry
+
+
+def test_process_exiting(runs, monkeypatch):
+    def exit_task(dag, task, force):
+        import os
+
+        os._exit(3)
+
+    monkeypatch.setattr(engine, "_run_task", exit_task)
+    status = engine.run_dag("dag", {"tasks": ["ingest", "train"]}, processes=True)
+    assert status == {"ingest": "failed", "train": "skipped"}
@@ -0,0 +1,115 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dags.data.schema import PRESETS, SENSORS
+from dags.features.engineering import FEATURES, build_features, fit_state, tail
+from dags.features.state import FeatureState
+
+
+def baseline_features(equip_data):
+    """Features of the pandas code train_model had before the feature engine"""
+    continuous_variables = SENSORS
+    features_df = equip_data.copy()
+
+    features_df["Sum_of_variables"] = features_df[continuous_variables].sum(axis=1)
+    features_df["Sum_of_variables_MA"] = (
+        features_df["Sum_of_variables"].rolling(4, min_periods=2).mean()
+    )
+    features_df["Sum_of_variables_std"] = (
+        features_df["Sum_of_variables"].rolling(3, min_periods=2).std()
+    )
+    features_df["Diff_Median_Sum_of_variables"] = (
+        features_df["Sum_of_variables"] - features_df["Sum_of_variables"].median()
+    )
+    features_df["Diff_Median_Sum_of_variables_Preset"] = features_df[
+        "Sum_of_variables"
+    ] - features_df.groupby(["Preset_1", "Preset_2"])["Sum_of_variables"].transform(
+        "median"
+    )
+    features_df["Max_value_among_feat"] = np.max(
+        features_df[continuous_variables], axis=1
+    )
+    for col in continuous_variables:
+        features_df[f"FLAG_{col}"] = features_df[col] >= equip_data[col].quantile(0.85)
+    features_df["N_equip_feats_abv_85_pct"] = np.sum(
+        features_df[features_df.columns[features_df.columns.str.contains("FLAG")]],
+        axis=1,
+    )
+
+    X = features_df[FEATURES].copy()
+    X[["Sum_of_variables_MA", "Sum_of_variables_std"]] = X[
+        ["Sum_of_variables_MA", "Sum_of_variables_std"]
+    ].fillna(-1)
+    return X.to_numpy(dtype=np.float64)
+
+
+@pytest.fixture(scope="module")
+def readings(equipment):
+    """Equipment data with a few missing sensor readings"""
+    df = equipment.copy()
+    rng = np.random.default_rng(0)
+    for column in SENSORS:
+        df.loc[rng.choice(len(df), 30, replace=False), column] = np.nan
+    return df
+
+
+def test_features_match_baseline(readings):
+    features = build_features(readings, fit_state(readings, SENSORS))
+
+    assert features.dtype == np.float32
+    np.testing.assert_allclose(
+        features, baseline_features(readings).astype(np.float32), rtol=1e-6, atol=1e-4
+    )
+
+
+@pytest.mark.parametrize("chunksize", [1, 2, 7, 1000])
+def test_chunked_features_match_one_pass(readings, chunksize):
+    state = fit_state(readings, SENSORS)
+    readings = readings.iloc[:600]
+
+    chunks, history = [], ()
+    for start in range(0, len(readings), chunksize):
+        chunk = readings.iloc[slice(start, start + chunksize)]
+        chunks.append(build_features(chunk, state, history))
+        history = tail(chunk, state, history)
+    np.testing.assert_array_equal(
+        np.concatenate(chunks), build_features(readings, state)
+    )
+
+
+def test_preset_median_unseen_combination(readings):
+    state = fit_state(readings, SENSORS)
+    presets = np.array([[1, 1], [99, 99]])
+
+    seen = readings[(readings.Preset_1 == 1) & (readings.Preset_2 == 1)]
+    expected = seen[SENSORS].sum(axis=1).median()
+    assert state.preset_median(presets).tolist() == [expected, state.median]
+
+
+def test_preset_median_without_presets():
+    state = FeatureState(
+        sensors=SENSORS,
+        thresholds=np.zeros(len(SENSORS)),
+        median=5.0,
+        preset_keys=np.empty((0, 2), dtype=np.int64),
+        preset_medians=np.empty(0),
+    )
+    presets = pd.DataFrame([[1, 2], [3, 4]], columns=PRESETS)
+
+    assert state.preset_median(presets).tolist() == [5.0, 5.0]
+
+
+def test_state_round_trip(readings):
+    state = fit_state(readings.iloc[:2000], SENSORS)
+    state.shard_keys = ["Preset_1"]
+    loaded = FeatureState.from_dict(json.loads(json.dumps(state.to_dict())))
+
+    assert loaded.shard_keys == ["Preset_1"]
+    # The features of rows never seen in training only depend on the statistics
+    rows = readings.iloc[2000:]
+    np.testing.assert_array_equal(
+        build_features(rows, loaded), build_features(rows, state)
+    )
@@ -0,0 +1,72 @@
+import logging
+
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import write_trusted
+from dags import config
+from dags.data.ingest import read_trusted
+from dags.features.engineering import FEATURES, build_features
+from dags.models import train
+from dags.models.artifact import latest_model_path, load_model
+from dags.models.incremental import update_model
+from dags.models.scorer import LinearScorer
+
+
+def grow(rows):
+    """Equipment data of `rows` rows, the ones of the previous tables first"""
+    write_trusted(rows, chunksize=1000)
+
+
+@pytest.fixture(params=["lbfgs", "liblinear"])
+def trained(store, monkeypatch, request):
+    """Path of a model fully trained on 3000 rows, with parameters of `solver`"""
+    params = {"solver": request.param, "C": 1.0, "class_weight": {0: 0.25, 1: 0.75}}
+    monkeypatch.setattr(train, "search", lambda data, time_budget=None: params)
+    grow(3000)
+    train.train_model(mode="full")
+    return latest_model_path()
+
+
+def probabilities(model):
+    artifact = load_model(model)
+    data = read_trusted()
+    scorer = LinearScorer.from_artifact(artifact)
+    return scorer.predict_proba(build_features(data, artifact.state))[:, 1]
+
+
+def test_refined_with_new_rows(trained, caplog):
+    caplog.set_level(logging.INFO, logger="dags.models.incremental")
+    grow(4000)
+
+    assert update_model()
+    assert "Model refined with 1000 new rows" in caplog.text
+    refined = latest_model_path()
+    artifact = load_model(refined)
+    assert refined != trained
+    assert artifact.training["rows"] == 4000
+    assert artifact.params == load_model(trained).params
+
+    # Closer to a model retrained on the whole history than the previous one
+    train.train_model(mode="full")
+    previous, full = probabilities(trained), probabilities(latest_model_path())
+    refined = probabilities(refined)
+    assert np.abs(refined - full).mean() < np.abs(previous - full).mean() < 0.05
+
+    # and nothing to refine once it's up to date
+    caplog.clear()
+    assert update_model()
+    assert "No new rows since the last training" in caplog.text
+
+
+def test_retrained_on_drift(trained, monkeypatch, caplog):
+    caplog.set_level(logging.INFO, logger="dags.models.incremental")
+    monkeypatch.setattr(config, "DRIFT_THRESHOLD", 0.0)
+    grow(4000)
+
+    train.train_model(mode="incremental")
+    assert "retraining from scratch" in caplog.text
+    artifact = load_model(latest_model_path())
+    assert "Model refined" not in caplog.text
+    assert artifact.training["rows"] == 4000
+    assert artifact.features == FEATURES
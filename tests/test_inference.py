@@ -0,0 +1,123 @@
+import json
+import logging
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import write_trusted
+from dags.data.ingest import read_trusted
+from dags.models.artifact import load_model
+from dags.models.scorer import LinearScorer
+from dags.paths import PREDICTIONS_WATERMARK, predictions_path
+from dags.storage import blob
+from dags.visualization import inference
+from dags.visualization.inference import _partition_rows, write_predictions
+
+
+def chunked(df, chunksize):
+    return (
+        df.iloc[slice(start, start + chunksize)]
+        for start in range(0, len(df), chunksize)
+    )
+
+
+def predictions(path, chunks, state, scorer, chunksize, **kwargs):
+    with open(path, "wb") as file_obj:
+        tails = write_predictions(chunks, scorer, state, file_obj, chunksize, **kwargs)
+    return pd.read_parquet(path).sort_values("Cycle", ignore_index=True), tails
+
+
+@pytest.mark.parametrize("chunksize", [7, 500])
+def test_sharded_predictions_across_runs(tmp_path, equipment, scoring_model, chunksize):
+    state, scorer = scoring_model(["Preset_1"])
+    whole, whole_tails = predictions(
+        tmp_path / "whole.parquet", [equipment], state, scorer, len(equipment)
+    )
+
+    # Two runs, the second one carrying the tails of the shards of the first
+    first, tails = predictions(
+        tmp_path / "first.parquet",
+        chunked(equipment[:1700], chunksize),
+        state,
+        scorer,
+        chunksize,
+    )
+    second, end_tails = predictions(
+        tmp_path / "second.parquet",
+        chunked(equipment[1700:], chunksize),
+        state,
+        scorer,
+        chunksize,
+        tails=tails,
+    )
+    pd.testing.assert_frame_equal(pd.concat([first, second], ignore_index=True), whole)
+    assert end_tails == whole_tails
+
+
+WATERMARK = {
+    "rows": 300,
+    "shard_keys": [],
+    "tails": {"1": [1.0]},
+    "partitions": {
+        "2026-10-01": {"start": 0, "stop": 100},
+        "2026-10-03": {"start": 100, "stop": 300, "tails": {"1": [0.5]}},
+    },
+}
+
+
+@pytest.mark.parametrize(
+    "date, rows, expected",
+    [
+        # A new day takes the rows added since the last run
+        ("2026-10-04", 350, (300, 350, {"1": [1.0]})),
+        # The last one again the rows added since it was scored
+        ("2026-10-03", 350, (100, 350, {"1": [0.5]})),
+        # An earlier one its own rows
+        ("2026-10-01", 350, (0, 100, {})),
+        ("2026-10-02", 350, None),
+    ],
+)
+def test_partition_rows(date, rows, expected):
+    assert _partition_rows(WATERMARK, date, rows) == expected
+
+
+def test_partition_rows_first_run():
+    watermark = {"rows": 0, "shard_keys": [], "tails": {}, "partitions": {}}
+    assert _partition_rows(watermark, "2026-10-01", 100) == (0, 100, {})
+
+
+def test_daily_partitions(saved_model, tmp_path, caplog):
+    caplog.set_level(logging.INFO, logger="dags.visualization.inference")
+    runs = [("2026-10-01", 2000), ("2026-10-02", 3000), ("2026-10-02", 3500)]
+    for date, rows in runs:
+        write_trusted(rows, chunksize=500)
+        inference.predictions(date, chunksize=700)
+
+    inference.predictions("2026-09-30")
+    assert "2026-09-30 precedes the last partition" in caplog.text
+
+    with open(blob.local_path(PREDICTIONS_WATERMARK)) as file_obj:
+        watermark = json.load(file_obj)
+    assert watermark["rows"] == 3500
+    assert watermark["partitions"] == {
+        "2026-10-01": {"start": 0, "stop": 2000},
+        "2026-10-02": {"start": 2000, "stop": 3500},
+    }
+
+    # The partitions hold the predictions of the whole table, scored at once
+    partitions = pd.concat(
+        [
+            pd.read_parquet(blob.local_path(predictions_path(date)))
+            for date in watermark["partitions"]
+        ],
+        ignore_index=True,
+    )
+    artifact = load_model(saved_model)
+    whole, _ = predictions(
+        tmp_path / "whole.parquet",
+        [read_trusted()],
+        artifact.state,
+        LinearScorer.from_artifact(artifact),
+        3500,
+    )
+    pd.testing.assert_frame_equal(partitions, whole)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate, write_workbook
+from dags.data import ingest as ingestion
+from dags.data.ingest import ingest, read_trusted, read_trusted_chunks, trusted_rows
+from dags.data.schema import PRESETS, SENSORS
+
+
+def decoded(df):
+    """`df` with its presets as integers, the categories of each read differ"""
+    return df.astype({preset: "int16" for preset in PRESETS})
+
+
+@pytest.fixture
+def workbook(store):
+    """Input workbook of 500 rows, ingested 100 rows at a time"""
+    write_workbook(500)
+    return ingest(chunksize=100)
+
+
+def test_ingest_converts_workbook(workbook):
+    expected = pd.concat(generate(500), ignore_index=True)
+    df = read_trusted(path=workbook)
+
+    assert trusted_rows(path=workbook) == 500
+    assert df["Cycle"].tolist() == expected["Cycle"].tolist()
+    assert df["Preset_1"].dtype == "category"
+    assert (df[SENSORS].dtypes == np.float32).all()
+    np.testing.assert_allclose(df[SENSORS], expected[SENSORS], rtol=1e-6)
+
+
+def test_ingest_skips_unchanged_source(workbook, monkeypatch):
+    def read_excel_chunks(*args, **kwargs):
+        raise AssertionError("The workbook was converted again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(ingestion, "read_excel_chunks", read_excel_chunks)
+        assert ingest(chunksize=100) == workbook
+
+    # A new version of the workbook is converted again
+    write_workbook(300, seed=1)
+    assert ingest(chunksize=100) == workbook
+    assert trusted_rows(path=workbook) == 300
+
+
+@pytest.mark.parametrize("start, stop", [(0, None), (130, 420), (200, 300), (450, 900)])
+def test_read_trusted_rows(workbook, start, stop):
+    df = read_trusted(path=workbook, start=start, stop=stop)
+    whole = read_trusted(path=workbook)
+    pd.testing.assert_frame_equal(decoded(df), decoded(whole).iloc[slice(start, stop)])
+
+    chunks = list(
+        read_trusted_chunks(path=workbook, chunksize=70, start=start, stop=stop)
+    )
+    assert all(len(chunk) <= 70 for chunk in chunks)
+    pd.testing.assert_frame_equal(
+        pd.concat([decoded(chunk) for chunk in chunks]), decoded(df)
+    )
@@ -0,0 +1,86 @@
+import json
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dags.data import quality
+from dags.data.quality import DataProfile, reference_profile
+from dags.data.schema import PRESETS, SENSORS, TARGET
+from dags.paths import LATEST_MODEL, MODELS_FOLDER
+from dags.storage import blob, cache
+from dags.storage.cache import BlobCache
+
+
+def equipment_data(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(70, 5, (rows, len(SENSORS))), columns=SENSORS)
+    for preset in PRESETS:
+        df[preset] = rng.integers(1, 4, rows)
+    df[TARGET] = rng.random(rows) < 0.1
+    return df
+
+
+@pytest.fixture
+def models(local_store, tmp_path, monkeypatch):
+    """Saves the profiles of a model, by file name"""
+    monkeypatch.setattr(cache, "_cache", BlobCache(str(tmp_path / "cache"), 1024**3))
+    blob.to_any(BytesIO(json.dumps({"version": "v1"}).encode()), LATEST_MODEL)
+
+    def save(**profiles):
+        for name, rows in profiles.items():
+            profile = DataProfile().update(equipment_data(rows)).to_dict()
+            uri = f"{MODELS_FOLDER}/v1/{name}.json"
+            blob.to_any(BytesIO(json.dumps(profile).encode()), uri)
+
+    return save
+
+
+def test_reference_without_the_validated_rows(models):
+    # Refined with the rows 1000 to 1500
+    models(profile=1500, previous_profile=1000)
+
+    assert reference_profile(1500).rows == 1500
+    # The rows the model was refined with aren't compared with themselves
+    assert reference_profile(1000).rows == 1000
+    assert reference_profile(1200).rows == 1000
+
+
+def test_reference_overlapping_the_validated_rows(models):
+    models(profile=1500)
+
+    assert reference_profile(1500).rows == 1500
+    assert reference_profile(1200).rows == 1500
+
+
+def test_no_reference(local_store):
+    assert reference_profile(0) is None
+
+
+def test_profile_rows_whole_range(monkeypatch):
+    ranges = []
+
+    def profile_range(start, stop, chunksize, path):
+        ranges.append((start, stop, chunksize))
+        return DataProfile()
+
+    monkeypatch.setattr(quality, "_profile_range", profile_range)
+    # A chunksize of 0 reads the rows at once
+    quality.profile_rows(10, 110, chunksize=0, workers=4, path="trusted.parquet")
+    quality.profile_rows(10, 10, chunksize=0, workers=4, path="trusted.parquet")
+    assert ranges == [(10, 110, 100), (10, 10, 1)]
+
+
+def test_profile_merge():
+    df = equipment_data(1000)
+    df.loc[::7, SENSORS[0]] = np.nan
+
+    merged = DataProfile().update(df[:300]).merge(DataProfile().update(df[300:]))
+    whole = DataProfile().update(df)
+    assert merged.rows == whole.rows == 1000
+    np.testing.assert_array_equal(merged.nulls, whole.nulls)
+    np.testing.assert_allclose(merged.means, whole.means)
+    np.testing.assert_allclose(merged.std(), whole.std())
+    assert merged.presets == whole.presets
+    assert quality.compare(merged, whole)["drift"] == []
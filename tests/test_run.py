@@ -0,0 +1,64 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+import run
+from dags.engine import parse_tasks
+from dags.runner import get_tasks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def dags_file(tmp_path, monkeypatch):
+    path = tmp_path / "dags.yaml"
+    path.write_text("pipeline:\n  tasks: [ingest, train]\n")
+    monkeypatch.setattr(run, "DAGS_FILE", path)
+    monkeypatch.setattr(run, "DAGS_CACHE", tmp_path / "__pycache__" / "dags.json")
+    return path
+
+
+def test_get_dags_cached(dags_file, monkeypatch):
+    assert run.get_dags() == {"pipeline": {"tasks": ["ingest", "train"]}}
+
+    # Read back without importing yaml
+    with monkeypatch.context() as patch:
+        patch.setitem(sys.modules, "yaml", None)
+        assert run.get_dags() == {"pipeline": {"tasks": ["ingest", "train"]}}
+        result = CliRunner().invoke(run.run, ["list-tasks", "pipeline"])
+    assert result.output == "ingest\ntrain (after ingest)\n"
+
+    # and parsed again once changed
+    dags_file.write_text("pipeline:\n  tasks: [ingest]\n")
+    os.utime(dags_file, ns=(0, 0))
+    assert run.get_dags() == {"pipeline": {"tasks": ["ingest"]}}
+
+
+def test_tasks_registered():
+    for dag, spec in run.get_dags().items():
+        if dag != "config":
+            assert set(parse_tasks(spec)) <= set(get_tasks(dag))
+
+
+def test_task_startup_imports():
+    # Loading the DAGs and their tasks leaves the data stack to the task bodies
+    code = (
+        "import sys, run\n"
+        "from dags.runner import get_tasks\n"
+        "for dag in run.get_dags():\n"
+        "    if dag != 'config':\n"
+        "        get_tasks(dag)\n"
+        "heavy = ['numpy', 'pandas', 'pyarrow', 'sklearn', 'azure', 'paeio']\n"
+        "print(' '.join(module for module in heavy if module in sys.modules))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == ""
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from dags.models.scorer import BLOCK_ROWS, LinearScorer
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    rng = np.random.default_rng(0)
+    X = rng.normal(70, 15, (5000, 7))
+    y = (X[:, 0] - X[:, 3] + rng.normal(0, 10, len(X)) > 0).astype(int)
+    return make_pipeline(StandardScaler(), LogisticRegression()).fit(X, y)
+
+
+def scorer_of(pipeline, threshold=None):
+    scaler, model = pipeline[0], pipeline[-1]
+    return LinearScorer(
+        model.coef_,
+        model.intercept_,
+        model.classes_,
+        scaler.mean_,
+        scaler.scale_,
+        threshold=threshold,
+    )
+
+
+# Sizes around the blocks, including a lone row after a full block
+@pytest.mark.parametrize(
+    "rows", [1, 2, BLOCK_ROWS - 1, BLOCK_ROWS, BLOCK_ROWS + 1, 2 * BLOCK_ROWS + 1]
+)
+def test_same_as_pipeline(pipeline, rows):
+    X = np.random.default_rng(rows).normal(70, 15, (rows, 7))
+    scorer = scorer_of(pipeline)
+
+    np.testing.assert_array_equal(scorer.predict(X), pipeline.predict(X))
+    np.testing.assert_array_equal(
+        scorer.decision_function(X), pipeline.decision_function(X)
+    )
+    # The logistic function is NumPy's, scikit-learn's may round the last bit apart
+    np.testing.assert_allclose(
+        scorer.predict_proba(X), pipeline.predict_proba(X), rtol=0, atol=1e-15
+    )
+
+
+def test_threshold(pipeline):
+    X = np.random.default_rng(1).normal(70, 15, (1000, 7))
+    proba = pipeline.predict_proba(X)[:, 1]
+    classes = pipeline[-1].classes_
+
+    for threshold in [0.0, 0.2, 0.5, 0.8, 1.0]:
+        labels = scorer_of(pipeline, threshold).predict(X)
+        np.testing.assert_array_equal(labels == classes[1], proba >= threshold)
+
+
+@pytest.mark.parametrize("threshold", [-0.1, 1.5, np.nan])
+def test_threshold_out_of_range(pipeline, threshold):
+    with pytest.raises(ValueError):
+        scorer_of(pipeline, threshold)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+from dags.models.search import halving_search
+
+GRID = {"solver": ["lbfgs"], "C": [0.1, 1, 10], "class_weight": [None]}
+
+
+def data(rows=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 1, (rows, 3))
+    y = (X[:, 0] + rng.normal(0, 1, rows) > 1).astype(int)
+    return X, y
+
+
+def test_search_without_time_budget():
+    X, y = data()
+
+    best, history = halving_search(X, y, GRID, n_jobs=2)
+    assert best in [entry["params"] for entry in history if entry["size"] == len(y)]
+
+
+def test_no_candidate_fitted():
+    # A single class can't be fitted, which isn't the time budget running out
+    X, _ = data()
+    with pytest.raises(RuntimeError, match="No candidate could be fitted"):
+        halving_search(X, np.zeros(len(X), dtype=int), GRID, time_budget=60, n_jobs=2)
@@ -0,0 +1,165 @@
+import asyncio
+import contextlib
+import json
+import os
+
+import pytest
+
+from dags.data.schema import PRESETS, SENSORS
+from dags.visualization.serving import ScoringServer, ScoringService
+
+
+@pytest.fixture
+def service(scoring_model):
+    state, scorer = scoring_model()
+    return ScoringService(scorer, state)
+
+
+def readings(equipment, start, stop, equipment_id=None):
+    rows = equipment.iloc[slice(start, stop)]
+    records = [
+        {
+            "Cycle": int(row.Cycle),
+            **{column: int(getattr(row, column)) for column in PRESETS},
+            **{column: float(getattr(row, column)) for column in SENSORS},
+        }
+        for row in rows.itertuples()
+    ]
+    if equipment_id is not None:
+        for record in records:
+            record["equipment"] = equipment_id
+    return records
+
+
+@contextlib.asynccontextmanager
+async def serving(server, folder):
+    """Runs `server` on a Unix socket in `folder` until the block exits"""
+    socket = str(folder / "scoring.sock")
+    task = asyncio.create_task(server.run(unix_socket=socket))
+    while not os.path.exists(socket):
+        await asyncio.sleep(0.01)
+    try:
+        yield socket
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def request(socket, method, path, body=b""):
+    reader, writer = await asyncio.open_unix_connection(socket)
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nContent-Length: {len(body)}\r\n"
+        "Connection: close\r\n\r\n".encode() + body
+    )
+    response = await reader.read()
+    writer.close()
+    head, content = response.split(b"\r\n\r\n", 1)
+    return int(head.split()[1]), json.loads(content)
+
+
+def test_concurrent_requests_scored_in_micro_batches(
+    service, scoring_model, equipment, tmp_path
+):
+    state, scorer = scoring_model()
+    requests = [readings(equipment, 5 * i, 5 * i + 5, f"eq-{i}") for i in range(10)]
+
+    async def main():
+        async with serving(ScoringServer(service, batch_wait=0.05), tmp_path) as socket:
+            return await asyncio.gather(
+                *(
+                    request(socket, "POST", "/score", json.dumps(body).encode())
+                    for body in requests
+                )
+            )
+
+    responses = asyncio.run(main())
+    assert service.readings == 50
+    assert service.batches < len(requests)
+    # Each series is scored as if its requests had been scored alone
+    alone = ScoringService(scorer, state)
+    for (status, results), body in zip(responses, requests):
+        assert status == 200
+        expected = alone.score(body)
+        assert [r["Cycle"] for r in results] == [r["Cycle"] for r in expected]
+        assert [r["pred"] for r in results] == [r["pred"] for r in expected]
+        assert [r["proba"] for r in results] == pytest.approx(
+            [r["proba"] for r in expected]
+        )
+
+
+@pytest.mark.parametrize(
+    "change, error",
+    [
+        ({"Preset_1": True}, "Preset_1 must be an integer"),
+        ({"Preset_2": 1.5}, "Preset_2 must be an integer"),
+        ({"Pressure": "high"}, "Pressure must be a number or null"),
+        ({"Frequency": False}, "Frequency must be a number or null"),
+    ],
+)
+def test_invalid_readings_rejected(service, equipment, tmp_path, change, error):
+    reading = {**readings(equipment, 0, 1)[0], **change}
+
+    async def main():
+        async with serving(ScoringServer(service, batch_wait=0), tmp_path) as socket:
+            return await request(socket, "POST", "/score", json.dumps(reading).encode())
+
+    assert asyncio.run(main()) == (400, {"error": error})
+    assert service.batches == 0
+
+
+def test_bad_requests(service, equipment, tmp_path):
+    missing = readings(equipment, 0, 1)[0]
+    del missing["Temperature"]
+
+    async def main():
+        async with serving(ScoringServer(service, batch_wait=0), tmp_path) as socket:
+            return [
+                await request(socket, "POST", "/score", b"{not json"),
+                await request(socket, "POST", "/score", json.dumps(missing).encode()),
+                await request(socket, "POST", "/score", b"[1]"),
+                await request(socket, "GET", "/scores"),
+            ]
+
+    (invalid, _), (absent, error), (scalar, _), (route, _) = asyncio.run(main())
+    assert (invalid, absent, scalar, route) == (400, 400, 400, 404)
+    assert error == {"error": "Temperature is missing"}
+
+
+def test_failed_batch_keeps_serving(service, equipment, tmp_path, monkeypatch):
+    score = service.score
+    calls = []
+
+    def flaky(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise RuntimeError("boom")
+        return score(batch)
+
+    monkeypatch.setattr(service, "score", flaky)
+    body = json.dumps(readings(equipment, 0, 1)[0]).encode()
+
+    async def main():
+        async with serving(ScoringServer(service, batch_wait=0), tmp_path) as socket:
+            return [await request(socket, "POST", "/score", body) for _ in range(2)]
+
+    (failed, error), (status, result) = asyncio.run(main())
+    assert (failed, status) == (500, 200)
+    assert "boom" in error["error"]
+    assert result["Cycle"] == 1
+
+
+def test_batch_of_a_cancelled_request(service, equipment):
+    async def main():
+        loop = asyncio.get_running_loop()
+        left, waiting = loop.create_future(), loop.create_future()
+        left.cancel()
+        ScoringServer(service)._score_batch(
+            [
+                (readings(equipment, 0, 2), left),
+                (readings(equipment, 2, 3), waiting),
+            ]
+        )
+        return await waiting
+
+    assert [result["Cycle"] for result in asyncio.run(main())] == [3]
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dags.data.schema import TARGET
+from dags.features.engineering import build_features, target
+from dags.features.sharding import labelled_features, shard_groups, spill_shards
+
+
+def test_shard_groups():
+    keys = np.array([[2, 1], [1, 1], [2, 1], [1, 2], [1, 1]])
+    unique, groups = shard_groups(keys)
+
+    assert unique.tolist() == [[1, 1], [1, 2], [2, 1]]
+    assert [rows.tolist() for rows in groups] == [[1, 4], [3], [0, 2]]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_features_within_shards(equipment, scoring_model, workers):
+    state, _ = scoring_model(["Preset_1", "Preset_2"])
+    X, y = labelled_features(equipment, state, workers=workers)
+
+    shards = equipment.groupby(["Preset_1", "Preset_2"]).indices
+    assert len(shards) > 1
+    for rows in shards.values():
+        shard = equipment.iloc[rows]
+        np.testing.assert_array_equal(X[rows], build_features(shard, state))
+        np.testing.assert_array_equal(y[rows], target(shard[TARGET]))
+    # The rolling features of a shard don't look at the rows of the others
+    assert not np.array_equal(X, build_features(equipment, state))
+
+
+def test_spill_shards(equipment, tmp_path):
+    chunks = (
+        equipment.iloc[slice(start, start + 700)]
+        for start in range(0, len(equipment), 700)
+    )
+    shards = spill_shards(chunks, ["Preset_1"], str(tmp_path))
+
+    assert [key for key, _ in shards] == [(1,), (2,), (3,)]
+    for (preset,), path in shards:
+        expected = equipment[equipment.Preset_1 == preset].reset_index(drop=True)
+        pd.testing.assert_frame_equal(pd.read_parquet(path), expected)
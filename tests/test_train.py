@@ -0,0 +1,46 @@
+import sys
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+
+from dags.models.evaluation import evaluate
+from dags.models.train import TrainingSet, evaluate_model
+from dags.models.utils import evalBinaryClassifier
+
+
+def split(rows, seed):
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 1, (rows, 3))
+    y = (X[:, 0] + rng.normal(0, 1, rows) > 1).astype(int)
+    return X, y
+
+
+def test_threshold_chosen_on_validation_rows():
+    (X_train, y_train), (X_val, y_val), (X_test, y_test) = (
+        split(2000, seed) for seed in range(3)
+    )
+    data = TrainingSet(
+        X_train, y_train, X_val, y_val, X_test, y_test, None, None, None, None, {}
+    )
+    model = LogisticRegression().fit(X_train, y_train)
+
+    report = evaluate_model(data, model)
+    validation = evaluate(y_val, model.predict_proba(X_val)[:, 1])
+    test = evaluate(y_test, model.predict_proba(X_test)[:, 1])
+    assert report["default"]["threshold"] == validation["best"]["threshold"]
+    assert report["validation"] == validation["best"]
+    # The test rows are scored at the threshold of the validation rows, not their own
+    assert report["default"]["threshold"] != test["best"]["threshold"]
+    assert report["default"]["f1"] <= test["best"]["f1"]
+
+
+def test_eval_binary_classifier():
+    X, y = split(1000, 0)
+    model = LogisticRegression().fit(X, y)
+    predicted = model.predict(X)
+    tp = np.sum((predicted == 1) & (y == 1))
+    f1 = 2 * tp / (np.sum(predicted == 1) + np.sum(y == 1))
+
+    assert evalBinaryClassifier(model, X, y) == f1
+    # Nothing is plotted unless asked to
+    assert "matplotlib.pyplot" not in sys.modules
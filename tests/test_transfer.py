@@ -0,0 +1,133 @@
+import logging
+import os
+import time
+from io import BytesIO
+
+import pytest
+
+from dags import config, metrics
+from dags.storage import blob, transfer
+from dags.storage.cache import BlobCache
+
+RANGE_BYTES = 64 * 1024
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "BLOB_RANGE_BYTES", RANGE_BYTES)
+    return BlobCache(str(tmp_path / "cache"), 1024**3)
+
+
+@pytest.fixture
+def downloads(monkeypatch):
+    """URIs downloaded through dags.storage.transfer"""
+    uris = []
+    download = transfer.download
+
+    def counted(uri, *args, **kwargs):
+        uris.append(uri)
+        return download(uri, *args, **kwargs)
+
+    monkeypatch.setattr(transfer, "download", counted)
+    return uris
+
+
+def put(uri, content):
+    blob.to_any(BytesIO(content), uri)
+    return content
+
+
+def test_ranged_download(local_store, cache):
+    # 16 full ranges and a partial one
+    content = put(f"{local_store}/big.bin", os.urandom(16 * RANGE_BYTES + 12345))
+
+    start = time.perf_counter()
+    with cache.open(f"{local_store}/big.bin") as file_obj:
+        assert file_obj.read() == content
+    # The 17 ranges one after the other would take 340ms on their own
+    assert time.perf_counter() - start < 17 * config.LOCAL_BLOB_LATENCY / 2
+
+
+def test_ranged_download_after_offset(local_store, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "BLOB_RANGE_BYTES", RANGE_BYTES)
+    content = put(f"{local_store}/big.bin", os.urandom(3 * RANGE_BYTES + 1))
+
+    with open(tmp_path / "copy.bin", "w+b") as file_obj:
+        file_obj.write(b"header")
+        transfer.download(f"{local_store}/big.bin", file_obj, len(content))
+        assert file_obj.tell() == len(b"header") + len(content)
+        file_obj.seek(0)
+        assert file_obj.read() == b"header" + content
+
+
+def test_prefetch_deduplicated(local_store, cache, downloads):
+    uri = f"{local_store}/model.bin"
+    content = put(uri, os.urandom(1000))
+
+    cache.prefetch([uri, uri])
+    cache.prefetch([uri])
+    # Waits for the prefetch in flight instead of downloading again
+    with cache.open(uri) as file_obj:
+        assert file_obj.read() == content
+    assert downloads == [uri]
+
+
+def test_stats_per_task(local_store, cache, tmp_path, monkeypatch, caplog):
+    monkeypatch.setattr(config, "METRICS_DIR", str(tmp_path / "metrics"))
+    caplog.set_level(logging.INFO, logger="dags.storage.cache")
+    uri = f"{local_store}/model.bin"
+    put(uri, os.urandom(1000))
+
+    with metrics.instrument("dag", "first") as first:
+        cache.prefetch([uri])
+        cache.open(uri).close()
+    with metrics.instrument("dag", "second") as second:
+        cache.open(uri).close()
+        cache.log_stats()
+
+    # The prefetch isn't a miss, and each task only counts its own reads
+    assert first.counters["cache_prefetches"] == 1
+    assert first.counters["cache_misses"] == 0
+    assert first.counters["cache_hits"] == second.counters["cache_hits"] == 1
+    assert "cache_prefetches" not in second.counters
+    assert "Blob cache: 1 hits, 0 misses, 0 prefetched" in caplog.text
+
+
+def test_prefetch_missing_file(local_store, cache, downloads):
+    cache.prefetch([f"{local_store}/missing.bin"])
+    with pytest.raises(FileNotFoundError):
+        cache.open(f"{local_store}/missing.bin")
+    assert downloads == []
+
+
+@pytest.fixture
+def failing_upload(monkeypatch):
+    """Makes the uploads of the files named bad.bin fail"""
+    to_any = blob.to_any
+
+    def upload(byte_stream, uri, **kwargs):
+        if uri.endswith("/bad.bin"):
+            raise IOError(f"Couldn't write {uri}")
+        return to_any(byte_stream, uri, **kwargs)
+
+    monkeypatch.setattr(blob, "to_any", upload)
+
+
+def test_wait_uploads_raises(local_store, failing_upload):
+    transfer.upload(BytesIO(b"good"), f"{local_store}/good.bin")
+    transfer.upload(BytesIO(b"bad"), f"{local_store}/bad.bin")
+
+    with pytest.raises(IOError, match="bad.bin"):
+        transfer.wait_uploads()
+    # Every upload was waited for, not just the ones before the failure
+    with open(blob.local_path(f"{local_store}/good.bin"), "rb") as file_obj:
+        assert file_obj.read() == b"good"
+    # and none is left to wait for
+    transfer.wait_uploads()
+
+
+def test_background_upload_failure(local_store, failing_upload):
+    future = transfer.upload(BytesIO(b"bad"), f"{local_store}/bad.bin", critical=False)
+
+    transfer.wait_uploads()
+    assert isinstance(future.exception(), IOError)